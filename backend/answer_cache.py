@@ -0,0 +1,258 @@
+"""Answers already given, replayed instead of asked again.
+
+Gemini's free tier grants about twenty requests per model per day, and a large
+share of visitors open with the same handful of questions. Each of those was a
+fresh upstream call for an answer the site had already produced minutes
+earlier. This keeps the recent ones, bounded by count and by age, and hands a
+stored `Answer` back when the same question arrives against the same documents
+and the same conversation.
+
+"The same question" is the same text once case, runs of whitespace and
+trailing punctuation are folded, so "What did you build at Moonsite?" and
+"what did you build at  moonsite" are one entry. It is deliberately not the
+topic terms selection works from: those drop the question words, and "Why did
+you build ReelSensei?" and "When did you build ReelSensei?" share every term
+while asking different things. The key also carries the documents the
+selection chose, the turns the model would be replayed and the corpus version,
+because an answer is a function of all four - the same words after a different
+conversation, or against an edited profile, are a different request.
+
+Only complete answers are stored. A truncation notice, an empty-response
+apology or a busy message describe a moment, not the question, and replaying
+one would turn a transient failure into a sticky one.
+
+The cache only helps once an answer exists. When a link is shared, several
+visitors ask the same opening question within the same few seconds, all of them
+miss, and each becomes its own upstream call. `SingleFlight` closes that gap:
+the first request for a key makes the call and the rest wait on it, so N
+simultaneous asks cost one round-trip and one unit of quota.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import replace
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+import context
+from gemini_helper import EMPTY_RESPONSE_MESSAGE, Answer
+from prompt import HISTORY_TURNS
+from selection import Selection
+
+logger = logging.getLogger(__name__)
+
+# How many answers are kept. Generous for a site whose visitors ask variations
+# of a few dozen questions, and small enough that memory is not a concern.
+MAX_ENTRIES = 256
+
+# How long an answer may be replayed. Long enough to cover a shared link's
+# burst of visitors; short enough that a reworded prompt or a model update
+# reaches visitors the same day.
+TTL_SECONDS = 6 * 60 * 60
+
+_TRAILING_PUNCTUATION = re.compile(r"[^\w]+$")
+
+CacheKey = Tuple[object, ...]
+
+
+def normalise_question(question: str) -> str:
+    """`question` with case, whitespace runs and trailing punctuation folded."""
+    return _TRAILING_PUNCTUATION.sub("", " ".join(question.lower().split()))
+
+
+def cache_key(
+    question: str,
+    selection: Selection,
+    turns: Iterable[Dict[str, str]] | None = None,
+) -> CacheKey:
+    """What an answer depends on, reduced to something hashable."""
+    asked = normalise_question(question)
+
+    # Only the turns the model is actually replayed; anything older cannot
+    # change the answer.
+    replayed = [
+        (turn.get("role"), (turn.get("content") or "").strip())
+        for turn in list(turns or [])[-HISTORY_TURNS:]
+    ]
+    history = hashlib.sha256(json.dumps(replayed).encode()).hexdigest()
+
+    return (
+        asked,
+        selection.outcome,
+        selection.knowledge.sources,
+        history,
+        context.corpus_version(),
+    )
+
+
+def cacheable(answer: Answer) -> bool:
+    """Whether an answer is worth replaying: a complete reply from a model."""
+    return (
+        answer.from_model
+        and not answer.from_cache
+        and answer.finish_reason != "MAX_TOKENS"
+        and answer.text != EMPTY_RESPONSE_MESSAGE
+    )
+
+
+class AnswerCache:
+    """LRU over (key -> answer), with a lifetime on each entry."""
+
+    def __init__(self, max_entries: int = MAX_ENTRIES, ttl_seconds: float = TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[CacheKey, Tuple[float, Answer]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key: CacheKey) -> Optional[Answer]:
+        """The stored answer, marked as served from cache, or None."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now - entry[0] >= self.ttl_seconds:
+                if entry is not None:
+                    del self._entries[key]
+                    self._evictions += 1
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return replace(entry[1], from_cache=True)
+
+    def put(self, key: CacheKey, answer: Answer) -> None:
+        if not cacheable(answer):
+            return
+
+        with self._lock:
+            self._entries[key] = (time.monotonic(), answer)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+            }
+
+    def clear(self) -> None:
+        """Forgets every answer and count."""
+        with self._lock:
+            self._entries.clear()
+            self._hits = self._misses = self._evictions = 0
+
+
+answer_cache = AnswerCache()
+
+
+class SingleFlight:
+    """At most one upstream call per key at a time; identical requests share it.
+
+    Runs on the event loop and is only touched from it, so it needs no lock -
+    nothing can interleave between looking a flight up and registering one.
+
+    A follower never inherits a failure. If the call it was waiting on raised,
+    was abandoned - the leading visitor closed a stream - or came back with an
+    answer the cache would not keep either - a busy message, a timeout, a
+    truncation - it gets None and makes a call of its own, so one request's bad
+    luck is not served to everyone who happened to ask at the same moment.
+    """
+
+    def __init__(self):
+        self._flights: Dict[CacheKey, "asyncio.Future[Answer]"] = {}
+        self._led = 0
+        # Followers handed a shared answer - calls coalescing actually saved -
+        # and followers that waited and then had to make their own call anyway.
+        self._joined = 0
+        self._fell_through = 0
+
+    async def run(
+        self, key: CacheKey, produce: Callable[[], Awaitable[Answer]]
+    ) -> Tuple[Answer, bool]:
+        """The answer for `key`, and whether it was shared from another request.
+
+        The call runs as a task of its own and every caller awaits it shielded,
+        so the leader's visitor disconnecting does not cancel it out from under
+        the ones still waiting.
+        """
+        shared = await self.follow(key)
+        if shared is not None:
+            return shared, True
+
+        task = asyncio.ensure_future(produce())
+        self._track(key, task)
+        return await asyncio.shield(task), False
+
+    async def follow(self, key: CacheKey) -> Optional[Answer]:
+        """The answer of an identical call already in flight, or None."""
+        flight = self._flights.get(key)
+        if flight is None or flight.done():
+            return None
+
+        try:
+            answer = await asyncio.shield(flight)
+        except asyncio.CancelledError:
+            if flight.cancelled():
+                self._fell_through += 1
+                return None
+            raise
+        except Exception:
+            self._fell_through += 1
+            return None
+        if not cacheable(answer):
+            self._fell_through += 1
+            return None
+        self._joined += 1
+        return answer
+
+    def lead(self, key: CacheKey) -> "asyncio.Future[Answer]":
+        """Registers a flight the caller completes itself with `set_result`.
+
+        For the streamed route, whose answer arrives a piece at a time and so
+        cannot be handed over as a single awaitable. The caller must cancel the
+        future if it ends without an answer, or followers wait for nothing.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._track(key, future)
+        return future
+
+    def _track(self, key: CacheKey, flight: "asyncio.Future[Answer]") -> None:
+        self._led += 1
+        self._flights[key] = flight
+
+        def land(done: "asyncio.Future[Answer]") -> None:
+            if self._flights.get(key) is done:
+                del self._flights[key]
+
+        flight.add_done_callback(land)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._flights),
+            "led": self._led,
+            "joined": self._joined,
+            "fell_through": self._fell_through,
+        }
+
+    def clear(self) -> None:
+        """Forgets every flight and count. Flights already running carry on."""
+        self._flights.clear()
+        self._led = self._joined = self._fell_through = 0
+
+
+single_flight = SingleFlight()
@@ -0,0 +1 @@
+"""Microbenchmarks for the request hot paths, with a stored baseline to compare against."""
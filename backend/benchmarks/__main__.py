@@ -0,0 +1,66 @@
+"""`python -m benchmarks run|compare`. See suite.py."""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from typing import List, Optional
+
+from benchmarks import suite
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=suite.__doc__.split("\n\n")[0])
+    parser.add_argument("mode", choices=("run", "compare"), help="run: time and print; compare: also judge against the baseline")
+    parser.add_argument("--baseline", default=suite.BASELINE_PATH)
+    parser.add_argument("--save", action="store_true", help="with run, store the result as the baseline")
+    parser.add_argument("--out", help="also write this run's result here")
+    parser.add_argument(
+        "--threshold", type=float, default=suite.DEFAULT_THRESHOLD_PERCENT,
+        help="percent slower than the baseline that counts as a regression",
+    )
+    parser.add_argument("--scales", default=",".join(suite.SCALES), help="subset of real,10,1k,10k")
+    parser.add_argument("-k", dest="match", default="", help="only cases whose name contains this")
+    parser.add_argument("--min-batch-seconds", type=float, default=suite.MIN_BATCH_SECONDS)
+    parser.add_argument("--rounds", type=int, default=suite.ROUNDS)
+    args = parser.parse_args(argv)
+
+    scales = [s.strip() for s in args.scales.split(",") if s.strip()]
+    unknown = [s for s in scales if s not in suite.SCALES]
+    if unknown:
+        parser.error(f"unknown scale(s) {', '.join(unknown)}; expected some of {', '.join(suite.SCALES)}")
+    cases = [c for c in suite.CASES if args.match in c]
+    if not cases:
+        parser.error(f"no case matches {args.match!r}")
+
+    baseline = None
+    if args.mode == "compare":
+        try:
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f)
+        except FileNotFoundError:
+            parser.error(f"no baseline at {args.baseline}; record one with `run --save` first")
+
+    print(f"{'case':<48}{'fastest':>12}{'median':>12}")
+    result = suite.run(scales, cases, args.min_batch_seconds, args.rounds, report=print)
+
+    for path in filter(None, (args.out, args.baseline if args.save else None)):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"Result written to {path}")
+
+    if baseline is None:
+        return 0
+    lines, regressed = suite.compare(baseline, result, args.threshold)
+    print(f"\n{'case':<48}{'baseline':>12}{'now':>12}{'change':>10}")
+    print("\n".join(lines))
+    if regressed:
+        print(f"\n{len(regressed)} case(s) regressed by more than {args.threshold:g}%: {', '.join(regressed)}")
+        return 1
+    print(f"\nNo case regressed by more than {args.threshold:g}%.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,347 @@
+"""Timings for the code every chat request runs before it reaches the model.
+
+The load test (loadtest/) says whether the app as a whole keeps up; it cannot
+say which function got slower. These time the pieces one at a time - selection,
+the term index, the corpus fingerprint and join, project parsing, prompt
+assembly and the rate limiter - each on the real documents and on synthetic
+corpora of 10, 1,000 and 10,000 documents. The real corpus is what a visitor
+pays for today; the synthetic ones show how each path scales, which is the
+thing a change to it most often breaks.
+
+    python -m benchmarks run --save            # record the baseline
+    python -m benchmarks compare --threshold 15  # fail on a >15% regression
+
+pytest-benchmark would do the timing, but it is one more dependency for the
+deploy image to carry for something only run by hand, and the part that
+matters here - a baseline and a regression gate - is small. The method is its
+own: each case is run in batches long enough to time reliably (timeit's
+autorange), several rounds of those, and the fastest round is the number.
+Noise on a shared machine only ever adds time, so the minimum is the
+measurement least polluted by it; the median is recorded alongside.
+
+The baseline is machine-specific, so it is not committed: record one before a
+change and compare after it, on the same machine.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import os
+import platform
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import context
+import prompt
+import selection
+from context import Knowledge, Section
+from docs_helper import PROJECTS_DIR, parse_project_metadata
+from rate_limit import SlidingWindowLimiter
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# Bumped when what a case measures changes, so a stale baseline is refused
+# rather than compared against something else. 2: the corpus join and prompt
+# assembly are timed uncached.
+RESULT_VERSION = 2
+
+SCALES: Tuple[str, ...] = ("real", "10", "1k", "10k")
+_SCALE_SIZES = {"10": 10, "1k": 1_000, "10k": 10_000}
+
+# Percent slower than the baseline before compare fails.
+DEFAULT_THRESHOLD_PERCENT = 15.0
+
+# How long one timed batch must run, and how many batches a case gets.
+MIN_BATCH_SECONDS = 0.2
+ROUNDS = 5
+
+QUESTION = "What did you build with FastAPI and how did you handle rate limiting?"
+
+
+@dataclass
+class Corpus:
+    """One scale's inputs: the corpus, its project markdown, and a directory tree."""
+
+    name: str
+    knowledge: Knowledge
+    project_docs: List[str]
+    # Directories holding the corpus as files, for the fingerprint. Built on
+    # first use: writing 10,000 files is not free and only one case needs them.
+    _dirs: Optional[Tuple[str, ...]] = None
+    _tmp: Optional[str] = None
+
+    def content_dirs(self) -> Tuple[str, ...]:
+        if self._dirs is None:
+            self._tmp = tempfile.mkdtemp(prefix=f"bench-corpus-{self.name}-")
+            dirs = tuple(os.path.join(self._tmp, kind) for kind in ("profile", "projects", "writing"))
+            for directory in dirs:
+                os.mkdir(directory)
+            for i, section in enumerate(self.knowledge.sections):
+                directory = dirs[0] if section.is_profile else dirs[1 + i % 2]
+                with open(os.path.join(directory, f"doc-{i:05d}.md"), "w", encoding="utf-8") as f:
+                    f.write(section.body)
+            self._dirs = dirs
+        return self._dirs
+
+    def cleanup(self) -> None:
+        if self._tmp is not None:
+            shutil.rmtree(self._tmp, ignore_errors=True)
+
+
+def _vocabulary(rng: random.Random, size: int = 5_000) -> List[str]:
+    syllables = ["ka", "lo", "mi", "ter", "sun", "vel", "dra", "po", "qui", "ren", "sta", "xo", "bel", "nor"]
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def synthetic_corpus(documents: int, seed: int = 1234) -> Corpus:
+    """A deterministic corpus shaped like the real one, at any size.
+
+    Word frequencies are Zipfian, as in real prose, so the term index sees the
+    same mix of everywhere-words and rare ones; bodies are project-style
+    markdown with the headings and `- **Field**: value` lines the parser reads.
+    Two documents are profile, as in the real corpus, and the rest alternate
+    between projects and writing.
+    """
+    rng = random.Random(seed)
+    vocabulary = _vocabulary(rng)
+    cumulative = list(_zipf_cumulative(len(vocabulary)))
+
+    def prose(words: int) -> str:
+        return " ".join(rng.choices(vocabulary, cum_weights=cumulative, k=words))
+
+    sections: List[Section] = []
+    project_docs: List[str] = []
+    for i in range(documents):
+        title = prose(3).title()
+        body = (
+            f"# {title}\n\n## Overview\n{prose(60)}\n\n## Status\nShipped\n\n"
+            f"## Technical Details\n- **Stack**: {prose(4)}\n- **Hosting**: {prose(2)}\n\n"
+            f"## What I learned\n{prose(180)}\n"
+        )
+        if i < 2:
+            label = f"Profile / profile-{i}"
+        elif i % 2:
+            label = f"Project / {title}"
+            project_docs.append(body)
+        else:
+            label = f"Writing / {title}"
+        sections.append(Section(label=label, body=body))
+    return Corpus(name=str(documents), knowledge=Knowledge(sections=tuple(sections)), project_docs=project_docs)
+
+
+def _zipf_cumulative(n: int) -> Iterator[float]:
+    total = 0.0
+    for rank in range(1, n + 1):
+        total += 1.0 / rank
+        yield total
+
+
+def real_corpus() -> Corpus:
+    """The documents the site actually serves, built the way a request builds them."""
+    knowledge = context._build()
+    project_docs = []
+    if os.path.isdir(PROJECTS_DIR):
+        for name in sorted(os.listdir(PROJECTS_DIR)):
+            if name.endswith(".md"):
+                with open(os.path.join(PROJECTS_DIR, name), encoding="utf-8") as f:
+                    project_docs.append(f.read())
+    corpus = Corpus(name="real", knowledge=knowledge, project_docs=project_docs)
+    corpus._dirs = context._CONTENT_DIRS
+    return corpus
+
+
+def load_corpus(scale: str) -> Corpus:
+    if scale == "real":
+        return real_corpus()
+    return synthetic_corpus(_SCALE_SIZES[scale])
+
+
+@contextlib.contextmanager
+def _content_dirs(dirs: Tuple[str, ...]) -> Iterator[None]:
+    saved = context._CONTENT_DIRS
+    context._CONTENT_DIRS = dirs
+    try:
+        yield
+    finally:
+        context._CONTENT_DIRS = saved
+
+
+@contextlib.contextmanager
+def _quiet_selection() -> Iterator[None]:
+    # select() logs every decision at info; formatting 10,000 labels into a log
+    # line would be timed as if it were selection.
+    logger = selection.logger
+    level = logger.level
+    logger.setLevel("WARNING")
+    try:
+        yield
+    finally:
+        logger.setLevel(level)
+
+
+def _limiter_check(keys: int) -> Callable[[], object]:
+    """A check against a limiter already tracking `keys` visitors, as a busy instance would be.
+
+    Calls rotate through the known visitors. The window is short and the limit
+    out of reach, so every call takes the allowed path and each visitor's window
+    stays the few entries a real one holds rather than growing with the loop.
+    """
+    limiter = SlidingWindowLimiter(per_key_limit=1_000_000, global_limit=1_000_000, window_seconds=1)
+    visitors = [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(keys)]
+    for visitor in visitors:
+        limiter.check(visitor)
+    turn = iter(range(1 << 62))
+    return lambda: limiter.check(visitors[next(turn) % keys])
+
+
+# name -> builds a zero-argument callable timing one operation on a corpus.
+# Each is something a request does (or, for the index and the corpus join, does
+# whenever the corpus changes), at the size the corpus gives it.
+def _cases(corpus: Corpus) -> Dict[str, Callable[[], object]]:
+    knowledge = corpus.knowledge
+    sections = knowledge.sections
+    size = max(len(sections), 1)
+    selection._reset_cache()
+    selection._index_for(knowledge)
+
+    return {
+        # Steady state: the index is built, and a request scores against it.
+        "selection.select": lambda: selection.select(QUESTION, knowledge),
+        "selection._build_index": lambda: selection._build_index(knowledge),
+        "selection._terms": lambda: [selection._terms(s.body) for s in sections],
+        "context._fingerprint": context._fingerprint,
+        # Both are cached - the join per Knowledge, the instruction per set of
+        # passages - and a cache hit is an attribute read that no slow join
+        # could move. A new Knowledge per call, and the render without the
+        # cache in front of it, keep the work itself on the clock.
+        "Knowledge.text": lambda: Knowledge(sections=sections).text,
+        "docs_helper.parse_project_metadata": lambda: [parse_project_metadata(d) for d in corpus.project_docs],
+        "prompt.build_system_instruction": lambda: prompt._render_system_instruction(
+            Knowledge(sections=sections)
+        ),
+        "SlidingWindowLimiter.check": _limiter_check(size),
+    }
+
+
+CASES: Tuple[str, ...] = (
+    "selection.select",
+    "selection._build_index",
+    "selection._terms",
+    "context._fingerprint",
+    "Knowledge.text",
+    "docs_helper.parse_project_metadata",
+    "prompt.build_system_instruction",
+    "SlidingWindowLimiter.check",
+)
+
+
+def time_callable(
+    fn: Callable[[], object], min_batch_seconds: float = MIN_BATCH_SECONDS, rounds: int = ROUNDS
+) -> Dict[str, float]:
+    """Seconds per call: the fastest and the median of `rounds` batches."""
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_batch_seconds or loops >= 1 << 24:
+            break
+        loops *= 2 if elapsed == 0 else max(2, min(10, int(min_batch_seconds / elapsed) + 1))
+
+    per_call = [elapsed / loops]
+    for _ in range(rounds - 1):
+        started = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        per_call.append((time.perf_counter() - started) / loops)
+    return {"min": min(per_call), "median": statistics.median(per_call), "loops": loops}
+
+
+def run(
+    scales: Sequence[str] = SCALES,
+    cases: Sequence[str] = CASES,
+    min_batch_seconds: float = MIN_BATCH_SECONDS,
+    rounds: int = ROUNDS,
+    report: Optional[Callable[[str], None]] = None,
+) -> Dict[str, object]:
+    """Times every case at every scale. Keys in `results` are `case[scale]`."""
+    results: Dict[str, Dict[str, float]] = {}
+    with _quiet_selection():
+        for scale in scales:
+            corpus = load_corpus(scale)
+            try:
+                available = _cases(corpus)
+                for name in cases:
+                    fn = available[name]
+                    if name == "context._fingerprint":
+                        with _content_dirs(corpus.content_dirs()):
+                            timing = time_callable(fn, min_batch_seconds, rounds)
+                    else:
+                        timing = time_callable(fn, min_batch_seconds, rounds)
+                    key = f"{name}[{scale}]"
+                    results[key] = timing
+                    if report is not None:
+                        report(f"{key:<48}{_format_seconds(timing['min']):>12}{_format_seconds(timing['median']):>12}")
+            finally:
+                corpus.cleanup()
+                selection._reset_cache()
+    return {
+        "version": RESULT_VERSION,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+
+
+def compare(
+    baseline: Dict[str, object],
+    current: Dict[str, object],
+    threshold: float = DEFAULT_THRESHOLD_PERCENT,
+) -> Tuple[List[str], List[str]]:
+    """(report lines, regressed case keys), comparing the fastest rounds.
+
+    A case in only one of the two runs is reported and not judged: a new case
+    has nothing to regress from, and a dropped one nothing to regress.
+    """
+    if baseline.get("version") != current.get("version"):
+        raise ValueError(
+            f"baseline is format v{baseline.get('version')}, this run v{current.get('version')}; "
+            "record a new baseline"
+        )
+    before: Dict[str, Dict[str, float]] = baseline.get("results") or {}
+    after: Dict[str, Dict[str, float]] = current.get("results") or {}
+    lines: List[str] = []
+    regressed: List[str] = []
+    for key in after:
+        if key not in before:
+            lines.append(f"{key:<48}{'new':>12}")
+            continue
+        old, new = before[key]["min"], after[key]["min"]
+        change = (new - old) / old * 100 if old else 0.0
+        flag = ""
+        if change > threshold:
+            regressed.append(key)
+            flag = "  REGRESSED"
+        lines.append(
+            f"{key:<48}{_format_seconds(old):>12}{_format_seconds(new):>12}{change:>+9.1f}%{flag}"
+        )
+    for key in before:
+        if key not in after:
+            lines.append(f"{key:<48}{'not run':>12}")
+    return lines, regressed
+
+
+def _format_seconds(seconds: float) -> str:
+    for unit, scale in (("s", 1.0), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f}{unit}"
+    return f"{seconds / 1e-9:.0f}ns"
@@ -10,7 +10,9 @@ Two properties are deliberate:
 markdown and PDF on each chat message is affordable at this size, but it leaves
 the cost of the corpus invisible - nothing reports how much context a request is
 paying for. Here it is loaded once, logged once with its token estimate, and
-rebuilt only when a file actually changes.
+rebuilt only when a file actually changes. While the app is serving, a
+background `CorpusWatcher` does the checking for changes, so a request reads the
+cached corpus without touching the filesystem at all.
 
 **An empty corpus is an error, not a fallback.** `docs/templates/` holds
 placeholder files (`[brief story]`, `[your main programming languages]`) as a
@@ -22,34 +24,63 @@ documentation; they are never sent to the model.
 
 from __future__ import annotations
 
+import hashlib
 import logging
+import math
 import os
+import re
+import threading
 from dataclasses import dataclass
-from typing import Dict, List, Tuple
+from functools import cached_property
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
 
+import metrics
 from docs_helper import (
     PROFILE_DIR,
     PROJECTS_DIR,
     WRITING_DIR,
-    get_all_projects,
-    get_all_writing,
+    parse_project_metadata,
+    parse_writing_metadata,
     read_markdown_file,
     read_pdf_file,
 )
 
 logger = logging.getLogger(__name__)
 
-# Rough characters-per-token for English prose. Used only for logging and for
-# deciding when selectivity is worth building - never for a hard limit, so an
-# approximation is fine.
+# Rough characters-per-token for English prose: the estimator's starting point
+# before any call has reported a real count.
 CHARS_PER_TOKEN = 4
 
+# How quickly a model's correction factor follows new measurements, and the
+# range it is held to. Real factors sit near 1; one far outside that is a
+# measurement gone wrong, and it must not let a single odd answer halve or
+# triple every budget decision after it.
+ESTIMATOR_ALPHA = 0.2
+ESTIMATOR_FACTOR_BOUNDS = (0.5, 3.0)
+
 # Purely advisory. If the logged estimate crosses this, the corpus has grown
 # past the point where sending all of it on every request is obviously correct,
 # and it is time to look at tag routing or retrieval. Nothing enforces it.
 CONTEXT_REVIEW_TOKENS = 20_000
 
 
+def _float_env(name: str, default: float) -> float:
+    raw = os.getenv(name)
+    if raw is None:
+        return default
+    try:
+        return max(0.0, float(raw))
+    except ValueError:
+        logger.warning("%s=%r is not a number, using default %s", name, raw, default)
+        return default
+
+
+# How often the corpus watcher re-lists the content directories. An edited doc
+# reaches the chat within this long of being saved. 0 turns the watcher off and
+# every get_knowledge call checks the disk itself, as it did before there was one.
+CORPUS_WATCH_INTERVAL_SECONDS = _float_env("CORPUS_WATCH_INTERVAL_SECONDS", 2.0)
+
+
 # The label prefixes `_build` writes, paired with the word the site uses for
 # that kind of document when it tells a visitor what an answer was grounded in.
 #
@@ -75,14 +106,86 @@ def kind_of(label: str) -> str:
     )
 
 
+class TokenEstimator:
+    """Characters-to-tokens, corrected by what the API actually counted.
+
+    Chars over four is a fair guess for English prose and a poor one for the
+    markdown, code and names this corpus is full of, and it is now used for a
+    hard limit - prompt.fit_to_budget - rather than only for a log line. Every
+    answer reports its exact `prompt_tokens` for a prompt whose length is known,
+    so each model keeps a correction factor: the measured tokens over the
+    chars-over-four estimate, averaged over recent answers.
+
+    Before a request has chosen its model, the largest factor any model has
+    shown is used, so an estimate is one every model in the chain can fit.
+    """
+
+    def __init__(self) -> None:
+        self._factors: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def factor(self, model_id: str | None = None) -> float:
+        with self._lock:
+            if model_id in self._factors:
+                return self._factors[model_id]
+            return max(self._factors.values(), default=1.0)
+
+    def estimate(self, text: str, model_id: str | None = None) -> int:
+        return self.estimate_chars(len(text), model_id)
+
+    def estimate_chars(self, chars: int, model_id: str | None = None) -> int:
+        """`estimate` for a text whose length is already known."""
+        return math.ceil(chars / CHARS_PER_TOKEN * self.factor(model_id))
+
+    def observe(self, model_id: str, chars: int, prompt_tokens: int | None) -> None:
+        """Folds in one call: `chars` of prompt sent, `prompt_tokens` counted."""
+        if not chars or not prompt_tokens:
+            return
+        low, high = ESTIMATOR_FACTOR_BOUNDS
+        measured = min(max(prompt_tokens / (chars / CHARS_PER_TOKEN), low), high)
+        with self._lock:
+            previous = self._factors.get(model_id)
+            self._factors[model_id] = (
+                measured
+                if previous is None
+                else ESTIMATOR_ALPHA * measured + (1 - ESTIMATOR_ALPHA) * previous
+            )
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {model_id: round(f, 3) for model_id, f in self._factors.items()}
+
+    def clear(self) -> None:
+        """For tests."""
+        with self._lock:
+            self._factors.clear()
+
+
+token_estimator = TokenEstimator()
+
+
+# Separates a document's label from the heading of a passage within it:
+# "Writing / title § heading".
+HEADING_SEPARATOR = " § "
+
+# Documents are split at their `## ` headings. A passage shorter than this is
+# folded into the one before it: a heading over two lines of prose, or the
+# `## Date` and `## Source` metadata closing a post, is not worth a fence and a
+# label of its own, and a question cannot usefully match it alone.
+MIN_CHUNK_CHARS = 300
+
+
 @dataclass(frozen=True)
 class Section:
-    """One document in the corpus, kept whole.
+    """One passage of a document in the corpus: its lead, or one `## ` section.
 
     The corpus used to exist only as one joined string, which was enough while
     every request got all of it. Selecting documents per question needs them
     addressable individually, so the join moved from build time to `Knowledge.text`
-    and this is what it joins.
+    and this is what it joins. Selecting passages needs the same one level
+    down - a question matching one paragraph of a long post should not pay for
+    the whole post - so a document is now split at its headings, and each
+    passage after the lead is labelled "<document> § <heading>".
     """
 
     label: str
@@ -92,6 +195,16 @@ class Section:
     def kind(self) -> str:
         return kind_of(self.label)
 
+    @property
+    def document(self) -> str:
+        """The label of the document this passage belongs to."""
+        return self.label.split(HEADING_SEPARATOR, 1)[0]
+
+    @property
+    def heading(self) -> str:
+        """The heading this passage starts at; empty for a document's lead."""
+        return self.label.partition(HEADING_SEPARATOR)[2]
+
     @property
     def is_profile(self) -> bool:
         """Yanir's own documents, as opposed to published projects and writing.
@@ -103,13 +216,57 @@ class Section:
         return self.label.startswith("Profile / ")
 
 
+def chunk(label: str, body: str) -> Tuple[Section, ...]:
+    """A document as its heading-bounded passages, in order.
+
+    The first passage is always the lead and carries the document's own label,
+    so every document has exactly one passage that names it alone. Headings
+    inside fenced code blocks are code, not structure.
+    """
+    parts: List[Tuple[str, List[str]]] = [("", [])]
+    in_code = False
+    for line in body.split("\n"):
+        if line.lstrip().startswith("```"):
+            in_code = not in_code
+        if not in_code and line.startswith("## "):
+            parts.append((line[3:].strip(), []))
+        parts[-1][1].append(line)
+
+    merged: List[Tuple[str, str]] = []
+    for heading, lines in parts:
+        text = "\n".join(lines).strip()
+        if merged and (len(text) < MIN_CHUNK_CHARS or len(merged[-1][1]) < MIN_CHUNK_CHARS):
+            merged[-1] = (merged[-1][0], f"{merged[-1][1]}\n\n{text}".strip())
+        else:
+            merged.append((heading, text))
+
+    sections: List[Section] = []
+    seen: Dict[str, int] = {}
+    for heading, text in merged:
+        chunk_label = f"{label}{HEADING_SEPARATOR}{heading}" if heading else label
+        # Labels key the selection scores and the instruction cache, so two
+        # passages under the same heading text must not share one.
+        seen[chunk_label] = seen.get(chunk_label, 0) + 1
+        if seen[chunk_label] > 1:
+            chunk_label = f"{chunk_label} ({seen[chunk_label]})"
+        sections.append(Section(label=chunk_label, body=text))
+    return tuple(sections)
+
+
 @dataclass(frozen=True)
 class Knowledge:
-    """The corpus, plus enough metadata to reason about its cost."""
+    """The corpus, plus enough metadata to reason about its cost.
+
+    Immutable, so everything derived from the sections is computed on first
+    use and kept with the instance. A request reads `text`, `approx_tokens`
+    and `source_counts` several times over - for the prompt, the budget and
+    the trace - and every narrowed selection is a new instance paying for its
+    own join once rather than per read.
+    """
 
     sections: Tuple[Section, ...]
 
-    @property
+    @cached_property
     def text(self) -> str:
         """The corpus as the model sees it.
 
@@ -119,19 +276,26 @@ class Knowledge:
         """
         return "\n\n".join(f"### {s.label}\n{s.body}" for s in self.sections)
 
-    @property
+    @cached_property
     def sources(self) -> Tuple[str, ...]:
         return tuple(s.label for s in self.sections)
 
     @property
     def approx_tokens(self) -> int:
-        return len(self.text) // CHARS_PER_TOKEN
+        # Only the length is kept: the estimator's correction factor keeps
+        # learning, and a stored estimate would stop following it.
+        return token_estimator.estimate_chars(len(self.text))
 
-    @property
+    @cached_property
+    def documents(self) -> Tuple[str, ...]:
+        """The label of each document with a passage here, in corpus order."""
+        return tuple(dict.fromkeys(s.document for s in self.sections))
+
+    @cached_property
     def is_empty(self) -> bool:
         return not any(s.body.strip() for s in self.sections)
 
-    @property
+    @cached_property
     def source_counts(self) -> Tuple[Tuple[str, int], ...]:
         """How many documents of each kind are here, as (kind, count).
 
@@ -140,11 +304,13 @@ class Knowledge:
         step exists, so a per-answer source list would describe machinery this
         project does not have.
 
-        Kinds with no documents are omitted rather than reported as zero.
+        Counts documents, not passages: three passages of one post are one
+        post. Kinds with no documents are omitted rather than reported as zero.
         """
         counts: Dict[str, int] = {}
-        for section in self.sections:
-            counts[section.kind] = counts.get(section.kind, 0) + 1
+        for document in dict.fromkeys(s.document for s in self.sections):
+            kind = kind_of(document)
+            counts[kind] = counts.get(kind, 0) + 1
 
         ordered = [word for _, word in SECTION_KINDS] + [UNKNOWN_KIND]
         return tuple((kind, counts[kind]) for kind in ordered if kind in counts)
@@ -155,9 +321,6 @@ EMPTY = Knowledge(sections=())
 _CONTENT_DIRS = (PROFILE_DIR, PROJECTS_DIR, WRITING_DIR)
 _READABLE_SUFFIXES = (".md", ".pdf")
 
-# (fingerprint, knowledge) of the last successful build.
-_cache: Tuple[Tuple, Knowledge] | None = None
-
 
 def _fingerprint() -> Tuple:
     """Identity of the content on disk: path, size and mtime of each file.
@@ -181,42 +344,192 @@ def _fingerprint() -> Tuple:
     return tuple(entries)
 
 
+class CorpusWatcher:
+    """Notices changes to the content directories off the request path.
+
+    Every chat request and every /api/chat/status hit used to run `_fingerprint`
+    - three directory listings and a stat per file - only to learn, nearly
+    always, that nothing had changed. This runs the same fingerprint on a
+    background thread every `interval` seconds and bumps `generation` when it
+    differs from the last one seen. `get_knowledge` then checks the disk only
+    when the generation has moved past the one its cached corpus was confirmed
+    against; the rest of the time it is a reference read.
+
+    A poller rather than inotify: the docs live in the container image and
+    change on deploy or in a local checkout, nowhere near often enough to be
+    worth a platform-specific dependency, and stat-polling a dozen files every
+    couple of seconds costs nothing measurable.
+
+    Not running is a supported mode, not an error. Until `start` is called - in
+    tests, scripts, or with the interval set to 0 - `get_knowledge` keeps
+    fingerprinting on every call, exactly as before.
+    """
+
+    def __init__(self, interval: float = CORPUS_WATCH_INTERVAL_SECONDS) -> None:
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_seen: Optional[Tuple] = None
+        self._generation = 0
+        self._clean_generation: Optional[int] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def generation(self) -> int:
+        with self._lock:
+            return self._generation
+
+    @property
+    def dirty(self) -> bool:
+        """True until the cached corpus has been checked against the latest change."""
+        with self._lock:
+            return self._clean_generation != self._generation
+
+    def mark_clean(self, generation: int) -> None:
+        """Records that the cache matches the disk as of `generation`.
+
+        Takes the generation read before the check began, so a change the
+        watcher saw while a rebuild was underway leaves the cache dirty.
+        """
+        with self._lock:
+            if generation == self._generation:
+                self._clean_generation = generation
+
+    def poll(self) -> bool:
+        """One check of the disk. True if it changed since the last one."""
+        fingerprint = _fingerprint()
+        with self._lock:
+            if fingerprint == self._last_seen:
+                return False
+            first = self._last_seen is None
+            self._last_seen = fingerprint
+            self._generation += 1
+        if not first:
+            logger.info("Corpus changed on disk; rebuilding on the next request")
+        return True
+
+    def start(self) -> bool:
+        """Starts polling, unless the interval is 0 or it is already running."""
+        if self.interval <= 0 or self.running:
+            return False
+        self._stop.clear()
+        self.poll()
+        self._thread = threading.Thread(target=self._run, name="corpus-watcher", daemon=True)
+        self._thread.start()
+        logger.info("Watching the corpus for changes every %.1fs", self.interval)
+        return True
+
+    def stop(self) -> None:
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout=self.interval + 1)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception:
+                # A failed listing must not end the thread: with no watcher the
+                # cache would never be marked dirty again and edits would go
+                # unseen until a restart.
+                logger.exception("Corpus watcher poll failed")
+
+    def clear(self) -> None:
+        """For tests."""
+        self.stop()
+        with self._lock:
+            self._last_seen = None
+            self._generation = 0
+            self._clean_generation = None
+
+
+corpus_watcher = CorpusWatcher()
+
+
+def corpus_version() -> str | None:
+    """A short digest of the fingerprint the served corpus was built from.
+
+    For anything holding state derived from the corpus outside this module - a
+    cached system instruction upstream, for one - to tell when it has gone
+    stale. Unlike `Corpus.version` it names the files rather than the rebuild,
+    so two processes serving the same docs agree on it. None until a corpus
+    has been built and installed.
+    """
+    corpus = corpus_holder.current
+    return corpus.digest if corpus is not None else None
+
+
 def _read(path: str) -> str:
     return read_pdf_file(path) if path.endswith(".pdf") else read_markdown_file(path)
 
 
-def _profile_sections() -> List[Tuple[str, str]]:
-    """Yanir's own documents, as (label, body) pairs."""
-    sections: List[Tuple[str, str]] = []
-    if not os.path.isdir(PROFILE_DIR):
-        logger.warning("Profile directory %s does not exist", PROFILE_DIR)
-        return sections
+@dataclass(frozen=True)
+class _Parsed:
+    """One file's passages in the corpus, as of the stat it was read at.
+
+    `order` is what the file's directory sorts on: nothing for the profile,
+    whether a project is featured, a post's date.
+    """
+
+    sections: Tuple[Section, ...]
+    order: Tuple = ()
 
-    for name in sorted(os.listdir(PROFILE_DIR)):
-        if not name.endswith(_READABLE_SUFFIXES):
+
+# (path, size, mtime_ns) -> what that file parsed to, for every file the last
+# build read successfully. A rebuild re-reads only the files whose entry is
+# missing here, so editing one post no longer sends every PDF back through pypdf.
+_parsed: Dict[Tuple[str, int, int], _Parsed] = {}
+
+
+def _listing(directory: str, suffixes: Tuple[str, ...]) -> List[Tuple[str, Tuple[str, int, int]]]:
+    """(name, fingerprint entry) for each readable file in `directory`, sorted by name."""
+    if not os.path.isdir(directory):
+        return []
+    files = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(suffixes):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
             continue
-        body = _read(os.path.join(PROFILE_DIR, name))
-        if body.strip():
-            sections.append((f"Profile / {os.path.splitext(name)[0]}", body.strip()))
-    return sections
+        files.append((name, (path, stat.st_size, int(stat.st_mtime_ns))))
+    return files
 
 
-def _project_sections() -> List[Tuple[str, str]]:
-    """The project write-ups the site already publishes, reused as chat context.
+def _parse_profile(name: str, path: str) -> _Parsed | None:
+    """One of Yanir's own documents."""
+    body = _read(path).strip()
+    if not body:
+        return None
+    return _Parsed(chunk(f"Profile / {os.path.splitext(name)[0]}", body))
+
+
+def _parse_project(name: str, path: str) -> _Parsed | None:
+    """A project write-up the site already publishes, reused as chat context.
 
     The blog and the chat answer from the same files on purpose: two corpora
-    would eventually disagree with each other about the same project.
+    would eventually disagree with each other about the same project. Parsed
+    with the same metadata reader /api/projects uses.
     """
-    sections: List[Tuple[str, str]] = []
-    for project in get_all_projects():
-        body = (project.get("content") or "").strip()
-        if body:
-            title = project.get("title") or project.get("slug") or "Untitled"
-            sections.append((f"Project / {title}", body))
-    return sections
+    body = read_markdown_file(path).strip()
+    if not body:
+        return None
+    metadata = parse_project_metadata(body)
+    title = metadata.get("title") or name[:-3] or "Untitled"
+    return _Parsed(
+        chunk(f"Project / {title}", body),
+        order=(not metadata.get("featured", False),),
+    )
 
 
-def _writing_sections() -> List[Tuple[str, str]]:
+def _parse_writing(name: str, path: str) -> _Parsed | None:
     """Published writing, on the same terms as the project write-ups.
 
     This is what makes the claim on the writing page true rather than
@@ -224,19 +537,163 @@ def _writing_sections() -> List[Tuple[str, str]]:
     model, so the two cannot drift. It also means the chat can answer "what have
     you written about evals?" from the actual posts instead of declining.
     """
-    sections: List[Tuple[str, str]] = []
-    for entry in get_all_writing():
-        body = (entry.get("content") or "").strip()
-        if body:
-            title = entry.get("title") or entry.get("slug") or "Untitled"
-            sections.append((f"Writing / {title}", body))
-    return sections
+    body = read_markdown_file(path).strip()
+    if not body:
+        return None
+    metadata = parse_writing_metadata(body)
+    title = metadata.get("title") or name[:-3] or "Untitled"
+    return _Parsed(chunk(f"Writing / {title}", body), order=(metadata.get("date") or "",))
+
+
+def _sections(
+    directory: str,
+    suffixes: Tuple[str, ...],
+    parse: Callable[[str, str], _Parsed | None],
+    parsed: Dict[Tuple[str, int, int], _Parsed],
+    counts: Dict[str, int],
+) -> List[_Parsed]:
+    """Every file in `directory` parsed, reusing what the last build already read."""
+    results: List[_Parsed] = []
+    for name, key in _listing(directory, suffixes):
+        result = _parsed.get(key)
+        if result is None:
+            counts["reread"] += 1
+            result = parse(name, key[0])
+        else:
+            counts["reused"] += 1
+        if result is not None:
+            # A failed read is not remembered, so the next build tries it again.
+            parsed[key] = result
+            results.append(result)
+    return results
+
+
+# Paragraphs shorter than this are never treated as repeats. A heading, a date
+# or a one-line bullet recurs across documents legitimately and costs nothing.
+MIN_DEDUP_WORDS = 12
+
+# Paragraphs are compared as sets of overlapping word runs of this length, so a
+# fact restated with a word changed here and there still matches.
+SHINGLE_WORDS = 4
+
+# The share of a paragraph's word runs that must appear in one earlier paragraph
+# for it to count as a repeat. Measured against the later paragraph only: one
+# that repeats a fact and then adds to it falls under this and is kept whole.
+NEAR_DUPLICATE_SHARE = 0.8
+
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+_WORD = re.compile(r"\w+")
+
+
+def _shingles(paragraph: str) -> frozenset:
+    words = _WORD.findall(paragraph.lower())
+    if len(words) < MIN_DEDUP_WORDS:
+        return frozenset()
+    return frozenset(
+        tuple(words[i : i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)
+    )
+
+
+def deduplicate(sections: Sequence[Section]) -> Tuple[List[Section], int, int]:
+    """Replaces paragraphs another document already states with a reference to it.
+
+    The profile, the resume and the project write-ups describe the same work in
+    overlapping prose, and every copy is paid for on every request that carries
+    it. The first copy in corpus order is kept - profile documents come first,
+    so Yanir's own account of a fact is the one that survives - and a later
+    near-copy in a different document becomes "[Repeats <label>.]", so the
+    model can still see the passage it would otherwise have read here.
+
+    Applied to the passages one request carries, when its instruction is
+    rendered, never to the corpus as a whole. A reference is only as good as
+    the passage it points at being in the same prompt, and selection sends a
+    document's passages without the others - deduplicated up front, a project
+    passage chosen alone could arrive as "[Repeats Profile / resume § ...]"
+    with that resume passage left out, and the fact gone from the request.
+
+    Exact comparison of word-run sets, with an inverted index to find the
+    candidates. MinHash approximates the same measure, and earns its keep at
+    millions of paragraphs, not the few hundred here.
+
+    Returns the sections, the number of paragraphs replaced and the characters
+    saved. A section with nothing replaced is returned as the same object.
+    """
+    index: Dict[tuple, List[int]] = {}
+    owners: List[Section] = []
+    result: List[Section] = []
+    replaced = saved = 0
+
+    for section in sections:
+        kept: List[str] = []
+        mine: List[frozenset] = []
+        changed = False
+        for paragraph in _PARAGRAPH_BREAK.split(section.body):
+            shingles = _shingles(paragraph)
+            canonical = None
+            if shingles:
+                overlap: Dict[int, int] = {}
+                for shingle in shingles:
+                    for owner in index.get(shingle, ()):
+                        if owners[owner].document != section.document:
+                            overlap[owner] = overlap.get(owner, 0) + 1
+                best = max(overlap, key=overlap.__getitem__, default=None)
+                if best is not None and overlap[best] / len(shingles) >= NEAR_DUPLICATE_SHARE:
+                    canonical = owners[best]
+            if canonical is None:
+                kept.append(paragraph)
+                if shingles:
+                    mine.append(shingles)
+                continue
+
+            changed = True
+            replaced += 1
+            reference = f"[Repeats {canonical.label}.]"
+            saved += len(paragraph)
+            # A run of repeats of one passage needs only one pointer to it.
+            if kept and kept[-1] == reference:
+                continue
+            kept.append(reference)
+            saved -= len(reference)
+
+        # Registered once the section is done. Only other documents match
+        # against it: passages of one document are not repeats of each other.
+        for shingles in mine:
+            owners.append(section)
+            for shingle in shingles:
+                index.setdefault(shingle, []).append(len(owners) - 1)
+        result.append(Section(label=section.label, body="\n\n".join(kept)) if changed else section)
+
+    return result, replaced, saved
 
 
 def _build() -> Knowledge:
-    profile = _profile_sections()
-    sections = profile + _project_sections() + _writing_sections()
+    global _parsed
+
+    if not os.path.isdir(PROFILE_DIR):
+        logger.warning("Profile directory %s does not exist", PROFILE_DIR)
+
+    parsed: Dict[Tuple[str, int, int], _Parsed] = {}
+    counts = {"reread": 0, "reused": 0}
+    profile = _sections(PROFILE_DIR, _READABLE_SUFFIXES, _parse_profile, parsed, counts)
+    # Featured projects first and posts newest first, as the site lists them.
+    # Both sorts are stable, so ties keep filename order.
+    projects = sorted(
+        _sections(PROJECTS_DIR, (".md",), _parse_project, parsed, counts), key=lambda p: p.order
+    )
+    writing = sorted(
+        _sections(WRITING_DIR, (".md",), _parse_writing, parsed, counts),
+        key=lambda p: p.order,
+        reverse=True,
+    )
+    # Replaced rather than updated, so a deleted or edited file's old entry goes.
+    _parsed = parsed
+    logger.info(
+        "Corpus rebuild read %d files and reused %d already parsed",
+        counts["reread"],
+        counts["reused"],
+    )
 
+    sections = [section for p in profile + projects + writing for section in p.sections]
     if not sections:
         return EMPTY
 
@@ -256,62 +713,186 @@ def _build() -> Knowledge:
         )
         return EMPTY
 
-    return Knowledge(
-        sections=tuple(Section(label=label, body=content) for label, content in sections)
-    )
+    return Knowledge(sections=tuple(sections))
 
 
-def get_knowledge() -> Knowledge:
-    """Returns the corpus, rebuilding only when the files on disk have changed."""
-    global _cache
+# name -> how to compute it from a Knowledge, for state other modules derive
+# from the corpus (the selection index, the cached system instructions). Each is
+# computed once per installed corpus and kept with it; see `Corpus`.
+_derivers: Dict[str, Callable[[Knowledge], object]] = {}
 
-    fingerprint = _fingerprint()
-    if _cache is not None and _cache[0] == fingerprint:
-        return _cache[1]
 
-    knowledge = _build()
+def register_derived(name: str, derive: Callable[[Knowledge], object]) -> None:
+    """Declares state computed from each corpus, kept and replaced along with it."""
+    _derivers[name] = derive
 
-    # A read failure becomes an empty string, the section is skipped, and the
-    # thinner corpus would otherwise be cached under a fingerprint that has not
-    # changed - so the lost document is not retried until its size or mtime does,
-    # or the process restarts.
-    #
-    # The fingerprint lists every readable file, so it doubles as the expected
-    # section count. Fewer sections than files means something on disk produced
-    # nothing, and the result is used for this request but deliberately not
-    # cached, so the next request tries again.
-    expected = len(fingerprint)
-    if knowledge.sources and len(knowledge.sources) < expected:
-        logger.error(
-            "Corpus built %d sections from %d files; a source failed to read. "
-            "Serving it for this request but not caching, so the next one retries.",
-            len(knowledge.sources),
-            expected,
-        )
+
+class Corpus:
+    """One installed build: the knowledge, what it was built from, what derives from it.
+
+    The unit that is swapped. State computed from a corpus used to live in
+    module globals of its own - the index in selection, the cached instructions
+    in prompt - each keyed and invalidated separately, so a request could read
+    a new corpus beside an index built from the old one. Kept here, they are
+    replaced in the same assignment as the knowledge they came from.
+    """
+
+    def __init__(self, version: int, fingerprint: Tuple, knowledge: Knowledge) -> None:
+        self.version = version
+        self.fingerprint = fingerprint
+        self.knowledge = knowledge
+        self.digest = hashlib.sha256(repr(fingerprint).encode()).hexdigest()[:12]
+        self._derived: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def derived(self, name: str) -> object:
+        """The registered `name` for this corpus, computed on first use."""
+        try:
+            return self._derived[name]
+        except KeyError:
+            pass
+        with self._lock:
+            if name not in self._derived:
+                self._derived[name] = _derivers[name](self.knowledge)
+            return self._derived[name]
+
+    def derive_all(self) -> None:
+        for name in list(_derivers):
+            self.derived(name)
+
+
+class CorpusHolder:
+    """The corpus being served, refreshed by one caller while the rest keep serving.
+
+    When the files change, the first request to notice rebuilds - parse, index,
+    everything registered - and installs the result with a single reference
+    assignment. Requests arriving meanwhile do not queue behind it and do not
+    start rebuilds of their own: they are answered from the corpus already
+    installed, one edit behind for the moment the rebuild takes. Only a process
+    with nothing installed yet makes callers wait, since there is nothing to
+    serve in the meantime.
+
+    Reads take no lock. `current` is replaced, never mutated, so a request
+    holding one Corpus sees one consistent build for as long as it holds it.
+    """
+
+    def __init__(self) -> None:
+        self._current: Optional[Corpus] = None
+        self._rebuilding = threading.Lock()
+        self._installed = 0
+
+    @property
+    def current(self) -> Optional[Corpus]:
+        return self._current
+
+    def get(self) -> Knowledge:
+        current = self._current
+        if corpus_watcher.running and current is not None and not corpus_watcher.dirty:
+            return current.knowledge
+
+        # Read before the fingerprint, so a change landing mid-check is not
+        # marked clean along with it.
+        generation = corpus_watcher.generation
+        fingerprint = _fingerprint()
+        if current is not None and current.fingerprint == fingerprint:
+            corpus_watcher.mark_clean(generation)
+            return current.knowledge
+
+        if current is None:
+            self._rebuilding.acquire()
+        elif not self._rebuilding.acquire(blocking=False):
+            return current.knowledge
+        try:
+            # Installed by whoever held the lock while this caller waited.
+            latest = self._current
+            if latest is not None and latest is not current and latest.fingerprint == fingerprint:
+                corpus_watcher.mark_clean(generation)
+                return latest.knowledge
+            return self._rebuild(fingerprint, generation)
+        finally:
+            self._rebuilding.release()
+
+    def _rebuild(self, fingerprint: Tuple, generation: int) -> Knowledge:
+        knowledge = _build()
+
+        # A read failure becomes an empty string, the section is skipped, and the
+        # thinner corpus would otherwise be installed under a fingerprint that has
+        # not changed - so the lost document is not retried until its size or
+        # mtime does, or the process restarts.
+        #
+        # The fingerprint lists every readable file, so it doubles as the expected
+        # document count - one lead passage each. Fewer documents than files means
+        # something on disk produced nothing, and the result is used for this
+        # request but deliberately not installed, so the next request tries again.
+        expected = len(fingerprint)
+        built = sum(1 for section in knowledge.sections if not section.heading)
+        if knowledge.sources and built < expected:
+            metrics.corpus_rebuilds.inc(result="partial")
+            logger.error(
+                "Corpus built %d documents from %d files; a source failed to read. "
+                "Serving it for this request but not installing it, so the next one retries.",
+                built,
+                expected,
+            )
+            return knowledge
+
+        corpus = Corpus(self._installed + 1, fingerprint, knowledge)
+        # Everything derived is computed before the swap, so no request reads a
+        # corpus whose index is still being built.
+        corpus.derive_all()
+        self._installed = corpus.version
+        self._current = corpus
+        corpus_watcher.mark_clean(generation)
+
+        metrics.corpus_rebuilds.inc(result="empty" if knowledge.is_empty else "ok")
+        metrics.corpus_version.set(corpus.version)
+        _log_installed(corpus)
         return knowledge
 
-    _cache = (fingerprint, knowledge)
+    def clear(self) -> None:
+        """For tests."""
+        with self._rebuilding:
+            self._current = None
+            self._installed = 0
+
+
+corpus_holder = CorpusHolder()
 
+
+def _log_installed(corpus: Corpus) -> None:
+    knowledge = corpus.knowledge
     if knowledge.is_empty:
         logger.error(
-            "Knowledge corpus is empty - no readable files in %s. "
+            "Knowledge corpus v%d is empty - no readable files in %s. "
             "Chat will decline to answer questions about Yanir.",
+            corpus.version,
             PROFILE_DIR,
         )
-    else:
-        logger.info(
-            "Knowledge corpus loaded: %d sections, ~%d tokens per request (%s)",
-            len(knowledge.sources),
+        return
+
+    logger.info(
+        "Knowledge corpus v%d (%s) loaded: %d documents in %d passages, ~%d tokens in full (%s)",
+        corpus.version,
+        corpus.digest,
+        len(knowledge.documents),
+        len(knowledge.sections),
+        knowledge.approx_tokens,
+        ", ".join(knowledge.documents),
+    )
+    if knowledge.approx_tokens > CONTEXT_REVIEW_TOKENS:
+        logger.warning(
+            "Corpus is ~%d tokens, past the ~%d review threshold. Every chat "
+            "request now pays for all of it; consider selecting sections per "
+            "question instead of sending the whole corpus.",
             knowledge.approx_tokens,
-            ", ".join(knowledge.sources),
+            CONTEXT_REVIEW_TOKENS,
         )
-        if knowledge.approx_tokens > CONTEXT_REVIEW_TOKENS:
-            logger.warning(
-                "Corpus is ~%d tokens, past the ~%d review threshold. Every chat "
-                "request now pays for all of it; consider selecting sections per "
-                "question instead of sending the whole corpus.",
-                knowledge.approx_tokens,
-                CONTEXT_REVIEW_TOKENS,
-            )
 
-    return knowledge
+
+def get_knowledge() -> Knowledge:
+    """Returns the corpus, rebuilding only when the files on disk have changed.
+
+    With the watcher running and nothing changed since the corpus was last
+    confirmed, this touches neither the disk nor a lock beyond the watcher's.
+    """
+    return corpus_holder.get()
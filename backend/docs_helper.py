@@ -5,10 +5,11 @@ is assembled and cached, is context.py's job.
 """
 
 from pypdf import PdfReader
+import copy
 import logging
 import os
 import re
-from typing import List, Optional, Dict, Any
+from typing import Callable, List, Optional, Dict, Any, Tuple
 
 logger = logging.getLogger(__name__)
 
@@ -42,6 +43,50 @@ PROJECT_METADATA_SECTIONS = frozenset({
 })
 
 
+# directory -> (fingerprint, entries) of the last listing parsed from it, so
+# /api/projects and /api/writing parse the directory when a file in it changes
+# rather than on every request. snapshot.py fills this at startup.
+_listings: Dict[str, Tuple[Tuple, List[Dict[str, Any]]]] = {}
+
+
+def directory_fingerprint(directory: str, suffix: str = '.md') -> Tuple:
+    """(path, size, mtime_ns) for each `suffix` file in `directory`, sorted by name."""
+    if not os.path.isdir(directory):
+        return ()
+    entries = []
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith(suffix):
+            continue
+        path = os.path.join(directory, filename)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((path, stat.st_size, int(stat.st_mtime_ns)))
+    return tuple(entries)
+
+
+def _cached_listing(directory: str, parse: Callable[[], List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    # Copies both ways: callers edit what they are given (the project listing
+    # drops `content`), and that must not reach the next request's answer.
+    fingerprint = directory_fingerprint(directory)
+    cached = _listings.get(directory)
+    if cached is not None and cached[0] == fingerprint:
+        return copy.deepcopy(cached[1])
+    entries = parse()
+    _listings[directory] = (fingerprint, copy.deepcopy(entries))
+    return entries
+
+
+def prime_listing(directory: str, fingerprint: Tuple, entries: List[Dict[str, Any]]) -> None:
+    """Seeds the listing cache with entries parsed elsewhere - the corpus snapshot.
+
+    Used only while `directory` still matches `fingerprint`, so a snapshot
+    older than the files is parsed over rather than served.
+    """
+    _listings[directory] = (tuple(fingerprint), copy.deepcopy(entries))
+
+
 def read_markdown_file(file_path: str) -> str:
     """Read content from markdown file"""
     try:
@@ -129,6 +174,11 @@ def parse_project_metadata(content: str) -> Dict[str, Any]:
 
 def get_all_projects() -> List[Dict[str, Any]]:
     """Get all projects with their metadata"""
+    return _cached_listing(PROJECTS_DIR, parse_all_projects)
+
+
+def parse_all_projects() -> List[Dict[str, Any]]:
+    """`get_all_projects`, read from disk."""
     projects = []
 
     if not os.path.exists(PROJECTS_DIR):
@@ -253,6 +303,11 @@ def get_all_writing() -> List[Dict[str, Any]]:
     Sorted on the `date` string, which is ISO so it sorts correctly as text.
     Anything missing a date sorts last rather than crashing the list.
     """
+    return _cached_listing(WRITING_DIR, parse_all_writing)
+
+
+def parse_all_writing() -> List[Dict[str, Any]]:
+    """`get_all_writing`, read from disk."""
     if not os.path.exists(WRITING_DIR):
         logger.warning("Writing directory %s does not exist", WRITING_DIR)
         return []
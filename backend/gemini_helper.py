@@ -8,19 +8,37 @@ Failure handling turns on the SDK's structured status code rather than the text
 of the message. Which codes are worth falling back on is the whole question: a
 chain that treats only 503 as retryable never falls back at all, because a
 retired model answers 404.
+
+The chain runs on the SDK's async surface (`client.aio`). The app is one
+uvicorn process per instance, and a blocking call inside an `async def` handler
+holds the event loop for the whole ~16s of an answer - /health, the content
+endpoints and every other chat wait behind it. Awaiting the call instead gives
+the loop back while the answer is in flight.
 """
 
-from dataclasses import dataclass
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
 from google import genai
 from google.genai import errors as genai_errors
 from google.genai import types
-from typing import Dict, Iterable, Optional
+import httpx
+from typing import AsyncIterator, Deque, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+import asyncio
+import hashlib
 import logging
+import math
+import os
+import random
 import threading
 import time
 
+import context
 from context import Knowledge
 from prompt import NO_KNOWLEDGE_MESSAGE, build_contents, build_system_instruction
+import metrics
+from quota_ledger import quota_ledger
+from selection import CONVERSATIONAL, NARROWED, UNFOCUSED
 
 logger = logging.getLogger(__name__)
 
@@ -60,41 +78,622 @@ REQUEST_TIMEOUT_MS = 45_000
 #
 # The frontend sets no timeout of its own, so this is the only bound a visitor
 # actually experiences. It sits well under Cloud Run's 300s request ceiling.
+#
+# Enforced by cancelling the call in flight, not only by declining to start the
+# next one. Checking between attempts alone lets a call that starts at 69s run
+# on for the whole per-call timeout.
 TOTAL_DEADLINE_SECONDS = 70
 
-# How long a model is left alone after it refuses.
+
+@dataclass(frozen=True)
+class Deadline:
+    """The visitor's ceiling for one chat request, counted from its arrival.
+
+    Started by the route as the request comes in and handed down, so selection,
+    prompt assembly and every model attempt spend from the same budget rather
+    than each starting a clock of its own. Its main job is the per-call timeout:
+    a call started with 10s left gets 10s, not the full REQUEST_TIMEOUT_MS, so
+    the last attempt in the chain cannot overrun the ceiling by half a minute.
+    """
+
+    started: float
+    expires: float
+
+    @classmethod
+    def start(cls, seconds: Optional[float] = None) -> "Deadline":
+        now = time.monotonic()
+        return cls(
+            started=now, expires=now + (TOTAL_DEADLINE_SECONDS if seconds is None else seconds)
+        )
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires - time.monotonic())
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires
+
+    def call_timeout_ms(self, cap_ms: Optional[int] = None) -> int:
+        """What one upstream call may take: the per-call cap or what is left, whichever is less."""
+        cap_ms = REQUEST_TIMEOUT_MS if cap_ms is None else cap_ms
+        return max(1, min(cap_ms, int(self.remaining() * 1000)))
+
+# How long a model is left alone after it refuses, by the kind of refusal.
 #
-# Without it, every request re-attempts every exhausted model and pays the
+# Without this, every request re-attempts every failing model and pays the
 # round-trip to be told "no" again, so a spent daily quota becomes queued
 # requests and a starved service instead of a fast, honest "I'm getting more
-# questions than I can keep up with".
+# questions than I can keep up with". A model answering 503 on every call is
+# the same problem with a different status code: a full round-trip per request,
+# each one spent learning what the last one already said.
 #
-# Deliberately short, and deliberately not parsed from the quota metadata. A
-# 429 may mean the per-minute burst or the per-day allowance, and distinguishing
-# them means reading a quotaId string out of an error body that Google is free
-# to reword. A minute of cooldown is right for the transient case and, for an
-# exhausted day, costs one wasted call a minute instead of one per request.
-MODEL_COOLDOWN_SECONDS = 60
-
-# model id -> monotonic time before which it should not be tried again.
-_model_cooldowns: Dict[str, float] = {}
-_cooldown_lock = threading.Lock()
-
-
-def _model_is_cooling(model_id: str, now: float) -> bool:
-    with _cooldown_lock:
-        until = _model_cooldowns.get(model_id)
-        if until is None:
-            return False
-        if now >= until:
-            del _model_cooldowns[model_id]
+# A 429 opens the circuit on the first refusal - quota does not come back
+# mid-request - while a 5xx needs a run of them, because a single one is usually
+# a blip and sidelining a healthy model over it would cost more than the retry.
+# A 404 is not here at all: it means the model is retired, which no amount of
+# waiting fixes, and it already costs only the one fast round-trip.
+#
+# A call that runs out of time - the per-call timeout, or the visitor's deadline
+# landing mid-call - is the costliest failure of all: it is the whole wait, not
+# a round-trip. Two in a row open the circuit, so a model that has started to
+# hang stops being handed every visitor's first forty-five seconds.
+#
+# Each time a probe fails the wait doubles, up to the ceiling, with jitter so
+# that instances which tripped together do not all probe together.
+@dataclass(frozen=True)
+class BreakerPolicy:
+    # Consecutive failures of this class that open the circuit.
+    failure_threshold: int
+    # First open interval; doubles on each failed probe.
+    base_seconds: float
+    max_seconds: float
+
+
+BREAKER_POLICIES: Dict[str, BreakerPolicy] = {
+    "rate_limited": BreakerPolicy(failure_threshold=1, base_seconds=60, max_seconds=15 * 60),
+    "server_error": BreakerPolicy(failure_threshold=3, base_seconds=15, max_seconds=5 * 60),
+    "timeout": BreakerPolicy(failure_threshold=2, base_seconds=30, max_seconds=5 * 60),
+}
+
+
+def _is_timeout(error: BaseException) -> bool:
+    """Whether a call ended by running out of time rather than with an answer or a refusal."""
+    return isinstance(error, (asyncio.TimeoutError, TimeoutError, httpx.TimeoutException))
+
+
+def _failure_class(error: BaseException) -> Optional[str]:
+    """Which breaker policy a failed call falls under, or None if it is not the model's fault."""
+    status_code = error.code if isinstance(error, genai_errors.APIError) else None
+    if status_code == 429:
+        return "rate_limited"
+    if status_code in (500, 502, 503, 504):
+        return "server_error"
+    if _is_timeout(error):
+        return "timeout"
+    return None
+
+
+def _retry_after_seconds(error: BaseException) -> Optional[float]:
+    """How long upstream asked us to wait, when it said.
+
+    Two places carry it: an HTTP `Retry-After` header in delta-seconds form, and
+    the `google.rpc.RetryInfo` entry Gemini puts in a 429 body as `retryDelay`
+    ("37s"). Both are structured fields rather than prose, which is the line
+    this module draws - the quotaId strings beside them are not read, because
+    Google is free to reword them. The HTTP-date form of the header is ignored;
+    nothing upstream sends it.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if headers is not None:
+        raw = headers.get("retry-after")
+        if raw is not None:
+            try:
+                return max(0.0, float(raw))
+            except ValueError:
+                pass
+
+    details = getattr(error, "details", None)
+    if isinstance(details, dict):
+        for entry in (details.get("error") or {}).get("details") or ():
+            if not isinstance(entry, dict) or not str(entry.get("@type", "")).endswith("RetryInfo"):
+                continue
+            delay = str(entry.get("retryDelay", ""))
+            if delay.endswith("s"):
+                try:
+                    return max(0.0, float(delay[:-1]))
+                except ValueError:
+                    pass
+    return None
+
+
+@dataclass
+class _Circuit:
+    state: str = "closed"
+    # Consecutive failures per class while closed.
+    failures: Dict[str, int] = field(default_factory=dict)
+    # Times the circuit has opened since it last closed; drives the backoff.
+    trips: int = 0
+    open_until: float = 0.0
+    # Whether the one half-open probe is out.
+    probing: bool = False
+    last_failure: Optional[str] = None
+
+
+class CircuitBreakers:
+    """Per-model circuit breakers: closed, open, half-open.
+
+    Closed lets every call through and counts consecutive failures by class.
+    Reaching a policy's threshold opens the circuit: the model is skipped
+    without a call until the backoff, or upstream's `Retry-After`, runs out.
+    After that it is half-open, and exactly one request is let through as a
+    probe while the rest keep skipping it. The probe's success closes the
+    circuit; its failure opens it again for twice as long.
+
+    `allow` claims a call and every claim must be settled with `settle`, or the
+    half-open probe would stay out forever. A call that ends without a verdict -
+    cancelled as a hedge loser or by the deadline, or failed for a reason that
+    is not the model's - releases its claim without changing the state.
+
+    State lives in-process and per instance, like the rate limiter.
+    """
+
+    def __init__(self, policies: Optional[Dict[str, BreakerPolicy]] = None):
+        self._policies = BREAKER_POLICIES if policies is None else policies
+        self._circuits: Dict[str, _Circuit] = {}
+        self._lock = threading.Lock()
+
+    def _circuit(self, model_id: str, now: float) -> _Circuit:
+        circuit = self._circuits.setdefault(model_id, _Circuit())
+        if circuit.state == "open" and now >= circuit.open_until:
+            circuit.state = "half_open"
+            circuit.probing = False
+        return circuit
+
+    def state(self, model_id: str, now: Optional[float] = None) -> str:
+        """`closed`, `open` or `half_open`. Cheap enough to ask on every request."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            return self._circuit(model_id, now).state
+
+    def allow(self, model_id: str, now: Optional[float] = None) -> bool:
+        """Whether a call to this model may go out now. Claims the probe when half-open."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            circuit = self._circuit(model_id, now)
+            if circuit.state == "closed":
+                return True
+            if circuit.state == "half_open" and not circuit.probing:
+                circuit.probing = True
+                logger.info("Circuit for %s half-open; letting one probe through", model_id)
+                return True
             return False
-        return True
+
+    def settle(
+        self, model_id: str, error: Optional[BaseException], now: Optional[float] = None
+    ) -> None:
+        """Records how a claimed call ended: None for success, else what it raised."""
+        now = time.monotonic() if now is None else now
+        failure = None if error is None else _failure_class(error)
+        with self._lock:
+            circuit = self._circuit(model_id, now)
+            was_probe = circuit.probing
+            circuit.probing = False
+
+            if error is None:
+                if circuit.state != "closed":
+                    logger.info("Circuit for %s closed after a successful call", model_id)
+                self._circuits[model_id] = _Circuit()
+                return
+            if failure is None:
+                # No verdict on the model; only the claim is handed back.
+                return
+
+            circuit.last_failure = failure
+            if circuit.state == "closed":
+                circuit.failures[failure] = circuit.failures.get(failure, 0) + 1
+                if circuit.failures[failure] < self._policies[failure].failure_threshold:
+                    return
+            elif circuit.state == "open" or not was_probe:
+                # A call that went out before the circuit opened, failing late.
+                return
+
+            self._open(model_id, circuit, failure, _retry_after_seconds(error), now)
+
+    def _open(
+        self,
+        model_id: str,
+        circuit: _Circuit,
+        failure: str,
+        retry_after: Optional[float],
+        now: float,
+    ) -> None:
+        policy = self._policies[failure]
+        if retry_after is not None:
+            # Upstream said when; guessing longer wastes a recovered model and
+            # guessing shorter spends a probe on a known refusal.
+            wait = min(retry_after, policy.max_seconds)
+        else:
+            backoff = min(policy.base_seconds * 2 ** circuit.trips, policy.max_seconds)
+            wait = random.uniform(backoff / 2, backoff)
+        circuit.state = "open"
+        circuit.trips += 1
+        circuit.failures = {}
+        circuit.open_until = now + wait
+        logger.warning(
+            "Circuit for %s open for %.0fs after %s (trip %d)", model_id, wait, failure, circuit.trips
+        )
+
+    @contextmanager
+    def guard(self, model_id: str) -> Iterator[None]:
+        """Settles a claimed call by how the block exits, however it exits."""
+        try:
+            yield
+        except BaseException as e:
+            self.settle(model_id, e)
+            raise
+        self.settle(model_id, None)
+
+    def snapshot(self, now: Optional[float] = None) -> Dict[str, Dict[str, object]]:
+        """Every model's state and, when open, how long until it is probed."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            report = {}
+            for model_id in MODELS:
+                circuit = self._circuit(model_id, now)
+                report[model_id] = {
+                    "state": circuit.state,
+                    "retry_in_seconds": (
+                        round(circuit.open_until - now, 1) if circuit.state == "open" else None
+                    ),
+                    "trips": circuit.trips,
+                    "last_failure": circuit.last_failure,
+                }
+            return report
+
+    def clear(self) -> None:
+        """For tests."""
+        with self._lock:
+            self._circuits.clear()
+
+
+circuit_breakers = CircuitBreakers()
+
+
+def _float_env(name: str, default: float) -> float:
+    raw = os.getenv(name)
+    if raw is None:
+        return default
+    try:
+        return float(raw)
+    except ValueError:
+        logger.warning("%s=%r is not a number, using default %s", name, raw, default)
+        return default
+
+
+# Hedged requests: when the model being waited on has taken longer than it
+# usually does, start the next one alongside it and keep whichever answers
+# first.
+#
+# The sequential chain only moves on when a model errors. A model that hangs
+# without erroring costs the visitor the whole per-call timeout before anything
+# else is tried, and nothing about a hang is distinguishable from a slow answer
+# until it is over. A percentile of the model's own recent latencies is the
+# line past which "slow" has become "unusually slow" for that model.
+#
+# Off by default, deliberately. A hedge is a second upstream call, and on a free
+# tier of twenty requests per model per day every one that fires spends quota a
+# later visitor would have been answered with. It is for a deployment where
+# latency matters more than the daily allowance.
+HEDGING_ENABLED = os.getenv("GEMINI_HEDGING", "").strip().lower() in ("1", "true", "yes")
+
+# Which of the model's recent latencies the wait is allowed to reach before a
+# hedge starts. 0.9 means one answer in ten would have been slow enough to
+# trigger one.
+HEDGE_PERCENTILE = _float_env("GEMINI_HEDGE_PERCENTILE", 0.9)
+
+# No hedging on a model without this many observed answers. A percentile of two
+# samples is one of the two samples, and would fire hedges on guesswork.
+HEDGE_MIN_SAMPLES = 5
+
+# Recent successful latencies kept per model. Bounded so the percentile tracks
+# how the model behaves now, not how it behaved at startup.
+LATENCY_SAMPLES = 50
+
+_latency_samples: Dict[str, Deque[int]] = {}
+_latency_lock = threading.Lock()
+
+
+def _record_latency(model_id: str, latency_ms: int) -> None:
+    with _latency_lock:
+        samples = _latency_samples.setdefault(model_id, deque(maxlen=LATENCY_SAMPLES))
+        samples.append(latency_ms)
+
+
+def _hedge_delay(model_id: str) -> Optional[float]:
+    """Seconds to wait on `model_id` before hedging, or None for no evidence yet."""
+    with _latency_lock:
+        samples = sorted(_latency_samples.get(model_id, ()))
+
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return None
+
+    # Nearest-rank: an observed latency rather than an interpolated one.
+    percentile = min(max(HEDGE_PERCENTILE, 0.0), 1.0)
+    rank = max(1, math.ceil(percentile * len(samples)))
+    return samples[rank - 1] / 1000
+
+
+# The order models are tried in, learned from how they have been answering.
+#
+# MODELS is a preference, not a measurement: every request pays the first
+# model's latency even when the second has been faster and more reliable all
+# afternoon. Each model keeps an exponentially weighted average of its latency
+# and of its success rate, and a request tries models by expected cost - the
+# latency divided by the chance of getting an answer at all, so a fast model
+# that fails half the time costs what it should.
+#
+# A model with no history is assumed to be average: as fast as the mean of the
+# models that have some, and reliable. With no history at all, or while the
+# numbers are within a few percent of each other, the preference order
+# decides, so a fresh process behaves exactly like the fixed tuple.
+#
+# Once a model is demoted it is rarely tried first, so nothing would ever tell
+# us it recovered. A small share of requests therefore lead with a demoted
+# model instead - each such request risks one slower answer, which is the
+# price of finding out.
+RANKING_ALPHA = 0.2
+# How much one step down the preference list counts against a model's score.
+RANKING_PREFERENCE_WEIGHT = 0.1
+# Below this a model's success rate stops mattering more; it is already last.
+RANKING_MIN_SUCCESS = 0.05
+RANKING_EXPLORATION_RATE = _float_env("GEMINI_RANKING_EXPLORATION_RATE", 0.05)
 
 
-def _start_cooldown(model_id: str, now: float) -> None:
-    with _cooldown_lock:
-        _model_cooldowns[model_id] = now + MODEL_COOLDOWN_SECONDS
+@dataclass
+class _ModelRecord:
+    latency_ms: Optional[float] = None
+    success_rate: float = 1.0
+    samples: int = 0
+
+
+class ModelRanking:
+    """Per-model EWMA latency and success rate, and the order they imply."""
+
+    def __init__(self, exploration_rate: float = RANKING_EXPLORATION_RATE):
+        self.exploration_rate = exploration_rate
+        self._records: Dict[str, _ModelRecord] = {}
+        self._last_order: Tuple[str, ...] = MODELS
+        self._lock = threading.Lock()
+
+    def record_success(self, model_id: str, latency_ms: int) -> None:
+        with self._lock:
+            record = self._records.setdefault(model_id, _ModelRecord())
+            self._fold_latency(record, latency_ms)
+            record.success_rate = RANKING_ALPHA + (1 - RANKING_ALPHA) * record.success_rate
+            record.samples += 1
+
+    def record_failure(self, model_id: str) -> None:
+        with self._lock:
+            record = self._records.setdefault(model_id, _ModelRecord())
+            record.success_rate = (1 - RANKING_ALPHA) * record.success_rate
+            record.samples += 1
+
+    def record_timeout(self, model_id: str, waited_ms: int) -> None:
+        """A call that ran out of time: a failure, and a latency of at least the wait.
+
+        Only a failure, and a hung model keeps its fast average from the
+        answers it gave before it hung - still ranked first, still handed every
+        visitor. The wait is folded in as a latency sample so it is not.
+        """
+        with self._lock:
+            record = self._records.setdefault(model_id, _ModelRecord())
+            self._fold_latency(record, waited_ms)
+            record.success_rate = (1 - RANKING_ALPHA) * record.success_rate
+            record.samples += 1
+
+    def record_unfinished(self, model_id: str, waited_ms: int) -> None:
+        """A call abandoned for another model's answer - the loser of a hedge.
+
+        No verdict on whether it would have answered, but it had taken at least
+        `waited_ms` without doing so, which is a latency sample, if a low one.
+        """
+        with self._lock:
+            self._fold_latency(self._records.setdefault(model_id, _ModelRecord()), waited_ms)
+
+    @staticmethod
+    def _fold_latency(record: _ModelRecord, latency_ms: int) -> None:
+        record.latency_ms = (
+            latency_ms
+            if record.latency_ms is None
+            else RANKING_ALPHA * latency_ms + (1 - RANKING_ALPHA) * record.latency_ms
+        )
+
+    def _scores(self) -> Dict[str, float]:
+        known = [r.latency_ms for r in self._records.values() if r.latency_ms is not None]
+        assumed_latency = sum(known) / len(known) if known else 1.0
+        scores = {}
+        for position, model_id in enumerate(MODELS):
+            record = self._records.get(model_id, _ModelRecord())
+            latency = assumed_latency if record.latency_ms is None else record.latency_ms
+            # A zero latency would erase the success rate from the product.
+            latency = max(latency, 1.0)
+            scores[model_id] = (
+                latency
+                / max(record.success_rate, RANKING_MIN_SUCCESS)
+                * (1 + RANKING_PREFERENCE_WEIGHT * position)
+            )
+        return scores
+
+    def order(self) -> Tuple[str, ...]:
+        """MODELS, cheapest expected answer first, occasionally led by a demoted model."""
+        with self._lock:
+            scores = self._scores()
+            ranked = sorted(MODELS, key=scores.__getitem__)
+            if ranked != list(self._last_order):
+                logger.info(
+                    "Model order now %s (scores %s)",
+                    ", ".join(ranked),
+                    ", ".join(f"{m}={scores[m]:.0f}" for m in ranked),
+                )
+                self._last_order = tuple(ranked)
+
+        demoted = [m for m in ranked if ranked.index(m) > MODELS.index(m)]
+        if demoted and random.random() < self.exploration_rate:
+            explored = random.choice(demoted)
+            logger.info("Exploring: trying demoted model %s first", explored)
+            ranked.remove(explored)
+            ranked.insert(0, explored)
+        return tuple(ranked)
+
+    def stats(self) -> Dict[str, object]:
+        """The current order and the numbers behind it."""
+        with self._lock:
+            scores = self._scores()
+            models = {}
+            for model_id in MODELS:
+                record = self._records.get(model_id, _ModelRecord())
+                models[model_id] = {
+                    "latency_ewma_ms": (
+                        None if record.latency_ms is None else round(record.latency_ms)
+                    ),
+                    "success_rate": round(record.success_rate, 3),
+                    "samples": record.samples,
+                    "score": round(scores[model_id], 1),
+                }
+            return {"order": list(sorted(MODELS, key=scores.__getitem__)), "models": models}
+
+    def clear(self) -> None:
+        """For tests."""
+        with self._lock:
+            self._records.clear()
+            self._last_order = MODELS
+
+
+model_ranking = ModelRanking()
+
+
+# Where the SDK sends requests, when not to Google. For capacity runs against
+# loadtest/fake_gemini.py; unset in every deployed environment.
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "").strip() or None
+if GEMINI_BASE_URL:
+    logger.warning("Gemini requests go to %s, not the Gemini API", GEMINI_BASE_URL)
+
+
+def _new_client(api_key: str, timeout_ms: int) -> genai.Client:
+    # The per-call timeout is what keeps a hung upstream call from holding a
+    # worker. Cloud Run runs at most four instances, each a single uvicorn
+    # process, so a handful of stalled calls occupy the whole service and
+    # endpoints that never touch Gemini - /api/chat/status among them - start
+    # timing out behind them. Chat being unavailable is a degradation; taking the
+    # rest of the site with it is an outage.
+    return genai.Client(
+        api_key=api_key,
+        http_options=types.HttpOptions(timeout=timeout_ms, base_url=GEMINI_BASE_URL),
+    )
+
+
+async def _aclose_client(client: genai.Client) -> None:
+    """Closes both transports. The SDK's sync and async halves close separately."""
+    try:
+        await client.aio.aclose()
+    finally:
+        client.close()
+
+
+class ClientPool:
+    """Long-lived Gemini clients, one per (API key, timeout).
+
+    A `genai.Client` owns its HTTP connection pool, so building one per request
+    meant a fresh TCP and TLS handshake in front of every answer - a few hundred
+    milliseconds of latency and CPU that bought nothing, since the key and the
+    timeout never change between requests. Kept here, the connection stays warm
+    and each answer reuses it.
+
+    The pool is opened by the app at startup and closed on shutdown. Clients are
+    created lazily as well, so a caller that never went through startup - a
+    script, a test - still gets one rather than an error.
+
+    The async transport belongs to the event loop that first used it, so this is
+    for the app's loop. `get_gemini_response` runs on a loop of its own and
+    builds a throwaway client instead.
+    """
+
+    def __init__(self):
+        self._clients: Dict[Tuple[str, int], genai.Client] = {}
+        self._lock = threading.Lock()
+        self._created = 0
+        self._reused = 0
+        self._closed = 0
+
+    def get(self, api_key: str, timeout_ms: int = REQUEST_TIMEOUT_MS) -> genai.Client:
+        key = (api_key, timeout_ms)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._reused += 1
+                return client
+
+            client = _new_client(api_key, timeout_ms)
+            self._clients[key] = client
+            self._created += 1
+            return client
+
+    async def aclose(self) -> None:
+        """Closes every client. The next `get` starts a fresh one."""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+
+        for client in clients:
+            try:
+                await _aclose_client(client)
+            except Exception:
+                # Shutdown carries on regardless; a connection that fails to
+                # close cleanly is about to be torn down with the process.
+                logger.exception("Failed to close a Gemini client")
+            self._closed += 1
+
+    def stats(self) -> Dict[str, int]:
+        """Counts only. The pool is keyed by API key, which never leaves it."""
+        with self._lock:
+            return {
+                "clients": len(self._clients),
+                "created": self._created,
+                "reused": self._reused,
+                "closed": self._closed,
+            }
+
+    def _reset(self) -> None:
+        """Forgets every client and count without closing anything. For tests."""
+        with self._lock:
+            self._clients.clear()
+            self._created = self._reused = self._closed = 0
+
+
+client_pool = ClientPool()
+
+# Whether startup also opens the pooled client's connection to the API, so the
+# first chat does not pay for DNS, TCP and TLS either. Off by default: it is an
+# API request on every cold start, and GEMINI_API_KEY may be one somebody else's
+# quota is tracked against.
+PREWARM_ENABLED = os.getenv("GEMINI_PREWARM", "").strip().lower() in ("1", "true", "yes")
+
+# How long startup waits on the prewarm before giving up on it. A slow upstream
+# must not hold an instance out of service; the first chat just pays as before.
+PREWARM_TIMEOUT_SECONDS = 5.0
+
+
+async def prewarm(client: genai.Client) -> None:
+    """Opens `client`'s connection upstream with a request that spends no quota.
+
+    A model metadata lookup: it crosses the same host and connection pool as a
+    generate call, and is not a generation, so the daily request budget is
+    untouched.
+    """
+    await asyncio.wait_for(client.aio.models.get(model=MODELS[0]), PREWARM_TIMEOUT_SECONDS)
 
 # Low but not zero: answers should be stable and factual across reloads, while
 # still reading as conversation rather than a canned response.
@@ -111,6 +710,310 @@ TEMPERATURE = 0.3
 # is ~600 thinking + ~110 answer.
 MAX_OUTPUT_TOKENS = 1_500
 
+
+@dataclass(frozen=True)
+class GenerationProfile:
+    """How much one reply may think and write, and which model it would rather have.
+
+    One config for every request meant a greeting answered from the profile
+    alone paid for the same ~600 thinking tokens as a question spanning the
+    whole corpus - most of its latency and most of its output cost, spent
+    deliberating over "hi". What the selection concluded is a fair proxy for
+    how much reasoning a reply needs, so that picks the profile; see
+    GENERATION_PROFILES.
+    """
+
+    name: str
+    # None leaves thinking to the model's own default.
+    thinking_budget: Optional[int]
+    # Shared with thinking on the models in MODELS, so it has to hold the
+    # thinking budget plus a normal answer - see MAX_OUTPUT_TOKENS.
+    max_output_tokens: int
+    # Moved to the front of the learned order, in this order. The ranking still
+    # orders everything else, and a preferred model with an open circuit or a
+    # spent quota is skipped like any other.
+    prefer: Tuple[str, ...] = ()
+    temperature: float = TEMPERATURE
+
+    def order(self, ranked: Iterable[str]) -> List[str]:
+        ranked = list(ranked)
+        preferred = [model_id for model_id in self.prefer if model_id in ranked]
+        return preferred + [model_id for model_id in ranked if model_id not in preferred]
+
+    def thinking_config(self) -> Optional[types.ThinkingConfig]:
+        if self.thinking_budget is None:
+            return None
+        return types.ThinkingConfig(thinking_budget=self.thinking_budget)
+
+
+# For callers with no selection to go on - scripts, tests. Exactly the config
+# every request used before profiles existed.
+DEFAULT_PROFILE = GenerationProfile(name="default", thinking_budget=None, max_output_tokens=MAX_OUTPUT_TOKENS)
+
+# Keyed by Selection.outcome.
+#
+# Budgets rather than thinking levels: every model in MODELS is Flash-family,
+# which takes a token budget (Gemini 3 maps it onto its levels) and accepts
+# zero to switch thinking off. A Pro model would refuse a zero budget, so
+# adding one to MODELS means revisiting the conversational profile.
+#
+# - conversational: a greeting or small talk, answered from the profile alone.
+#   No thinking, a short cap, and the lite model first - it is the fastest and
+#   the cheapest, and nothing here needs more.
+# - narrowed: a question selection could place. The documents are already the
+#   relevant ones, so the model needs to compose rather than search.
+# - unfocused: the whole corpus, because nothing singled out a document. The
+#   model has to find the answer as well as write it, so it keeps the most
+#   room - capped near what it was observed to spend anyway.
+GENERATION_PROFILES: Dict[str, GenerationProfile] = {
+    CONVERSATIONAL: GenerationProfile(
+        name="conversational",
+        thinking_budget=0,
+        max_output_tokens=400,
+        prefer=("gemini-flash-lite-latest",),
+    ),
+    NARROWED: GenerationProfile(name="focused", thinking_budget=512, max_output_tokens=1_200),
+    UNFOCUSED: GenerationProfile(
+        name="broad", thinking_budget=1_024, max_output_tokens=MAX_OUTPUT_TOKENS
+    ),
+}
+
+
+def profile_for(outcome: Optional[str]) -> GenerationProfile:
+    """The profile for a selection outcome; the default for one with none."""
+    return GENERATION_PROFILES.get(outcome or "", DEFAULT_PROFILE)
+
+
+# Explicit context caching of the system instruction.
+#
+# The rules plus the corpus are the bulk of every request's prompt_tokens, and
+# they are identical between requests that selected the same documents. Gemini
+# can hold that prefix server-side as a cached-content entry and bill the tokens
+# read from it at a fraction of the input rate, so each distinct instruction -
+# profile-only, the whole corpus, each narrowed subset - is uploaded once per
+# model and referenced by name after that.
+#
+# Off by default. Explicit caching is a paid-tier feature with a storage charge
+# per token-hour, and on the free tier a create call is refused outright; a
+# deployment on the free tier still sees implicit cache hits in the
+# cached_tokens figure every answer now reports.
+CONTEXT_CACHE_ENABLED = os.getenv("GEMINI_CONTEXT_CACHE", "").strip().lower() in ("1", "true", "yes")
+
+# How long an entry lives upstream. Long enough to outlast a burst of visitors,
+# short enough that an idle site is not paying to store a prompt nobody sends.
+CONTEXT_CACHE_TTL_SECONDS = int(_float_env("GEMINI_CONTEXT_CACHE_TTL_SECONDS", 3600))
+
+# An entry is treated as gone this long before it actually expires, so a request
+# never names one that lapses while the call is in flight.
+CONTEXT_CACHE_EXPIRY_MARGIN_SECONDS = 60
+
+# Instructions shorter than this are sent inline. The API refuses to cache
+# content under a per-model minimum, so asking would only be a failed round-trip
+# in front of the real call.
+CONTEXT_CACHE_MIN_TOKENS = 1_024
+
+# After a create fails, how long before the same instruction is tried again.
+# Without it a refusal - the free tier, a model without caching - would be
+# re-asked on every request.
+CONTEXT_CACHE_RETRY_SECONDS = 600
+
+# The longest a create may hold up the request that asked for it. The create
+# sits in front of the real call and the client's own timeout is sized for a
+# generation, so without this a hanging create could spend the visitor's whole
+# deadline before the question is even sent. Past it, the instruction goes
+# inline - the answer costs more input tokens, not more waiting.
+CONTEXT_CACHE_CREATE_TIMEOUT_MS = 5_000
+
+
+@dataclass(frozen=True)
+class _CacheEntry:
+    # The server-generated resource name, or None for a create that failed and
+    # is not to be retried until `expires_at`.
+    name: Optional[str]
+    expires_at: float
+
+
+class ContextCache:
+    """Cached-content entries upstream, one per (model, system instruction).
+
+    Keyed by a hash of the instruction rather than by the selection that
+    produced it, so two selections that happen to assemble the same text share
+    one entry and no bookkeeping has to know what a selection is.
+
+    Everything is invalidated when the corpus fingerprint in context.py moves:
+    an entry built from an older corpus would answer from documents that no
+    longer say the same thing. Concurrent first requests for one instruction
+    may each create an entry; the extra one is harmless and lapses at its TTL.
+    """
+
+    def __init__(self):
+        self._entries: Dict[Tuple[str, str], _CacheEntry] = {}
+        self._version: Optional[str] = None
+        self._lock = threading.Lock()
+        self._created = 0
+        self._reused = 0
+        self._failed = 0
+        # Deletes of entries from an older corpus, still running. Held so the
+        # event loop does not collect a task nobody awaits.
+        self._deleting: Set[asyncio.Task] = set()
+
+    async def name_for(
+        self,
+        client: genai.Client,
+        model_id: str,
+        instruction: str,
+        deadline: Optional[Deadline] = None,
+    ) -> Optional[str]:
+        """The cached-content name to send `instruction` as, or None to send it inline.
+
+        A create is bounded by CONTEXT_CACHE_CREATE_TIMEOUT_MS or what is left
+        of `deadline`, whichever is less.
+        """
+        if context.token_estimator.estimate(instruction, model_id) < CONTEXT_CACHE_MIN_TOKENS:
+            return None
+
+        version = context.corpus_version()
+        if version is None:
+            # A corpus that was not cached - a partial build - is not worth
+            # uploading either; it will be rebuilt on the next request.
+            return None
+
+        # Deleting is housekeeping, not part of answering: the request that
+        # notices the corpus moved starts the deletes and carries on rather than
+        # paying a round-trip per stale entry in front of its own call.
+        for name in self._invalidate_if_changed(version):
+            task = asyncio.create_task(self._delete(client, name))
+            self._deleting.add(task)
+            task.add_done_callback(self._deleting.discard)
+
+        key = (model_id, hashlib.sha256(instruction.encode()).hexdigest())
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now < entry.expires_at:
+                if entry.name is not None:
+                    self._reused += 1
+                return entry.name
+
+        if deadline is None:
+            timeout_ms = CONTEXT_CACHE_CREATE_TIMEOUT_MS
+        else:
+            timeout_ms = deadline.call_timeout_ms(CONTEXT_CACHE_CREATE_TIMEOUT_MS)
+        try:
+            # The http timeout ends the request upstream; wait_for holds the
+            # bound whatever the transport makes of it.
+            created = await asyncio.wait_for(
+                client.aio.caches.create(
+                    model=model_id,
+                    config=types.CreateCachedContentConfig(
+                        system_instruction=instruction,
+                        ttl=f"{CONTEXT_CACHE_TTL_SECONDS}s",
+                        display_name=f"portfolio-{version}",
+                        http_options=types.HttpOptions(timeout=timeout_ms),
+                    ),
+                ),
+                timeout=timeout_ms / 1000,
+            )
+        except Exception:
+            logger.warning(
+                "Could not cache the system instruction for %s; sending it inline "
+                "for the next %ds",
+                model_id,
+                CONTEXT_CACHE_RETRY_SECONDS,
+                exc_info=True,
+            )
+            with self._lock:
+                self._failed += 1
+                self._entries[key] = _CacheEntry(None, now + CONTEXT_CACHE_RETRY_SECONDS)
+            return None
+
+        expires_at = now + CONTEXT_CACHE_TTL_SECONDS - CONTEXT_CACHE_EXPIRY_MARGIN_SECONDS
+        with self._lock:
+            self._created += 1
+            self._entries[key] = _CacheEntry(created.name, expires_at)
+        logger.info("Cached the system instruction for %s as %s", model_id, created.name)
+        return created.name
+
+    def _invalidate_if_changed(self, version: str) -> List[str]:
+        """Forgets every entry built from another corpus. Returns their names."""
+        with self._lock:
+            if self._version == version:
+                return []
+            stale = [entry.name for entry in self._entries.values() if entry.name]
+            self._entries.clear()
+            self._version = version
+        if stale:
+            logger.info("Corpus changed; dropping %d cached system instructions", len(stale))
+        return stale
+
+    async def _delete(self, client: genai.Client, name: str) -> None:
+        # Best-effort. An entry that fails to delete still lapses at its TTL.
+        try:
+            await client.aio.caches.delete(name=name)
+        except Exception:
+            logger.warning("Could not delete stale cached content %s", name, exc_info=True)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": sum(1 for entry in self._entries.values() if entry.name),
+                "created": self._created,
+                "reused": self._reused,
+                "failed": self._failed,
+            }
+
+    def _reset(self) -> None:
+        """Forgets every entry and count without deleting anything. For tests."""
+        with self._lock:
+            self._entries.clear()
+            self._version = None
+            self._created = self._reused = self._failed = 0
+
+
+context_cache = ContextCache()
+
+
+async def _generation_config(
+    client: genai.Client,
+    model_id: str,
+    instruction: str,
+    deadline: Optional[Deadline] = None,
+    profile: GenerationProfile = DEFAULT_PROFILE,
+) -> types.GenerateContentConfig:
+    """The config for one call: the instruction by cache reference where possible.
+
+    With a `deadline`, the pooled client's per-call timeout is overridden for
+    this call alone by what the deadline allows - worked out after any cache
+    create, so the time that took is not handed to the call a second time.
+    `profile` sets the thinking budget and output cap.
+    """
+    name = None
+    if CONTEXT_CACHE_ENABLED:
+        name = await context_cache.name_for(client, model_id, instruction, deadline)
+
+    http_options = (
+        None if deadline is None else types.HttpOptions(timeout=deadline.call_timeout_ms())
+    )
+
+    if name is not None:
+        # The instruction lives in the cached entry, and the API refuses a
+        # request that names one and also carries its own.
+        return types.GenerateContentConfig(
+            cached_content=name,
+            temperature=profile.temperature,
+            max_output_tokens=profile.max_output_tokens,
+            thinking_config=profile.thinking_config(),
+            http_options=http_options,
+        )
+
+    return types.GenerateContentConfig(
+        system_instruction=instruction,
+        temperature=profile.temperature,
+        max_output_tokens=profile.max_output_tokens,
+        thinking_config=profile.thinking_config(),
+        http_options=http_options,
+    )
+
 # User-facing copy per failure category, so an auth or configuration problem is
 # not reported to visitors as if the service were merely busy.
 #
@@ -151,7 +1054,7 @@ class Answer:
 
     Everything past `text` is optional because not every reply comes from a
     model. A refusal to answer without a corpus, or a busy message returned
-    while every model is still cooling down, never reaches the API at all -
+    while every model's circuit is open, never reaches the API at all -
     those arrive with `model` unset and no counts behind them.
 
     That distinction is the point. The site's argument is that it does not
@@ -164,11 +1067,30 @@ class Answer:
     text: str
     model: Optional[str] = None
     prompt_tokens: Optional[int] = None
+    cached_tokens: Optional[int] = None
     thinking_tokens: Optional[int] = None
     output_tokens: Optional[int] = None
     total_tokens: Optional[int] = None
     finish_reason: Optional[str] = None
     latency_ms: Optional[int] = None
+    # Measured only when the answer was streamed. A whole-reply call has no
+    # first token to time separately from its last.
+    first_token_ms: Optional[int] = None
+    # Whether a second model was started alongside the first. `model` is the
+    # one that won.
+    hedged: bool = False
+    # Replayed from answer_cache.py rather than produced by a call for this
+    # request. Every count above then describes the call that originally
+    # produced it; this request made none.
+    from_cache: bool = False
+    # Shared from an identical request's call that was already in flight, on
+    # the same terms: the counts are that call's, and this request made none.
+    coalesced: bool = False
+    # What was left of the request's deadline when the answer arrived. How
+    # close a slow answer came to being a busy message.
+    deadline_remaining_ms: Optional[int] = None
+    # The GenerationProfile the answering call ran under, by name.
+    profile: Optional[str] = None
 
     @property
     def from_model(self) -> bool:
@@ -181,6 +1103,43 @@ def get_gemini_response(
     user_question: str,
     knowledge: Knowledge,
     conversation_history: Optional[Iterable[Dict[str, str]]] = None,
+) -> Answer:
+    """The same chain as `get_gemini_response_async`, for callers with no event loop.
+
+    Scripts and tests. It runs the async chain to completion on a loop of its
+    own, so there is one implementation of the fallback rules rather than two
+    that drift. Never call it from inside a request handler - that would block
+    the very loop the async version exists to keep free.
+
+    The client is its own rather than the pool's: the pool's connections belong
+    to the app's loop, and this one ends when the call does.
+    """
+
+    async def run() -> Answer:
+        if knowledge.is_empty:
+            # Refused before any client is needed, so none is built.
+            return await get_gemini_response_async(api_key, user_question, knowledge)
+
+        client = _new_client(api_key, REQUEST_TIMEOUT_MS)
+        try:
+            return await get_gemini_response_async(
+                api_key, user_question, knowledge, conversation_history, client=client
+            )
+        finally:
+            await _aclose_client(client)
+
+    return asyncio.run(run())
+
+
+async def get_gemini_response_async(
+    api_key: str,
+    user_question: str,
+    knowledge: Knowledge,
+    conversation_history: Optional[Iterable[Dict[str, str]]] = None,
+    client: Optional[genai.Client] = None,
+    hedge: Optional[bool] = None,
+    deadline: Optional[Deadline] = None,
+    profile: Optional[GenerationProfile] = None,
 ) -> Answer:
     """Answers a visitor's question in Yanir's voice, grounded in `knowledge`.
 
@@ -188,6 +1147,10 @@ def get_gemini_response(
     user-facing copy, so callers render it as the assistant's reply rather than
     distinguishing error paths. The metadata is what separates them - a failure
     carries no model and no counts.
+
+    `client` defaults to the pooled one for `api_key`, `hedge` to
+    HEDGING_ENABLED, `deadline` to TOTAL_DEADLINE_SECONDS from now, and
+    `profile` to DEFAULT_PROFILE.
     """
     if knowledge.is_empty:
         # Nothing to ground an answer in. Calling the model here would produce
@@ -195,132 +1158,472 @@ def get_gemini_response(
         logger.error("Refusing to answer: knowledge corpus is empty")
         return Answer(text=NO_KNOWLEDGE_MESSAGE)
 
-    # The per-call timeout is what keeps a hung upstream call from holding a
-    # worker. Cloud Run runs at most four instances, each a single uvicorn
-    # process, so a handful of stalled calls occupy the whole service and
-    # endpoints that never touch Gemini - /api/chat/status among them - start
-    # timing out behind them. Chat being unavailable is a degradation; taking the
-    # rest of the site with it is an outage.
-    client = genai.Client(
-        api_key=api_key,
-        http_options=types.HttpOptions(timeout=REQUEST_TIMEOUT_MS),
-    )
-    config = types.GenerateContentConfig(
-        system_instruction=build_system_instruction(knowledge),
-        temperature=TEMPERATURE,
-        max_output_tokens=MAX_OUTPUT_TOKENS,
-    )
+    if client is None:
+        client = client_pool.get(api_key, REQUEST_TIMEOUT_MS)
+    if hedge is None:
+        hedge = HEDGING_ENABLED
+    if profile is None:
+        profile = DEFAULT_PROFILE
+    instruction = build_system_instruction(knowledge)
     contents = build_contents(user_question, conversation_history)
+    sent_chars = _prompt_chars(instruction, contents)
+
+    if deadline is None:
+        deadline = Deadline.start()
+
+    async def attempt(model_id: str):
+        config = await _generation_config(client, model_id, instruction, deadline, profile)
+        logger.info(
+            "Calling %s with %.1fs of the deadline left (call timeout %dms)",
+            model_id,
+            deadline.remaining(),
+            config.http_options.timeout,
+        )
+        # Counted as it is sent: Google counts the call whether it is answered,
+        # refused, or cancelled by the deadline or a winning hedge.
+        quota_ledger.record_request(model_id)
+        return await client.aio.models.generate_content(
+            model=model_id,
+            contents=contents,
+            config=config,
+        )
+
+    # Calls in flight, each with its model and start time. One at a time unless
+    # a hedge fires, in which case two.
+    in_flight: Dict[asyncio.Task, Tuple[str, float]] = {}
+    timed_out: Set[asyncio.Task] = set()
+    untried = iter(profile.order(model_ranking.order()))
+
+    def launch_next() -> bool:
+        """Starts the next model whose circuit lets it through. False when none is left."""
+        for model_id in untried:
+            # A model that keeps refusing is skipped without a call. Asking
+            # again while its circuit is open buys nothing and costs the
+            # round-trip, which is how an exhausted quota queues requests up
+            # behind it.
+            if quota_ledger.is_spent(model_id):
+                logger.info("Skipping %s: today's quota is spent", model_id)
+                metrics.model_skips.inc(model=model_id, reason="quota_spent")
+                continue
+            if not circuit_breakers.allow(model_id):
+                logger.info("Skipping %s: circuit %s", model_id, circuit_breakers.state(model_id))
+                metrics.model_skips.inc(model=model_id, reason="circuit_open")
+                continue
+
+            task = asyncio.ensure_future(attempt(model_id))
+            # Settled from the task rather than inside it, so a call cancelled
+            # before it ever ran still hands back a half-open probe. One the
+            # deadline cancelled settles as the timeout it was, not as a
+            # cancellation, which carries no verdict.
+            task.add_done_callback(
+                lambda t, model_id=model_id: circuit_breakers.settle(
+                    model_id,
+                    asyncio.TimeoutError()
+                    if t in timed_out
+                    else asyncio.CancelledError() if t.cancelled() else t.exception(),
+                )
+            )
+            in_flight[task] = (model_id, time.monotonic())
+            return True
+        return False
 
     last_error: Optional[Exception] = None
     skipped_all = True
-    started = time.monotonic()
-    for model_id in MODELS:
-        now = time.monotonic()
+    hedged = False
+    # Whether the one hedge a request gets has been used, including when it
+    # came due with no model left to start.
+    hedge_spent = False
+    try:
+        while True:
+            # Out of time for the visitor. Trying another model can only make
+            # the wait longer for an answer that is already late.
+            if not in_flight and deadline.expired:
+                logger.warning(
+                    "Giving up after %.1fs without an answer; remaining models not tried",
+                    deadline.elapsed(),
+                )
+                break
+
+            if not in_flight:
+                if not launch_next():
+                    break
+                skipped_all = False
+
+            # Wait for an answer, bounded by what is left of the visitor's
+            # deadline - and, while hedging is still possible, by the moment the
+            # model in flight becomes slower than it usually is.
+            wait = deadline.remaining()
+            hedge_due = False
+            if hedge and not hedge_spent and len(in_flight) == 1 and wait > 0:
+                (model_id, call_started), = in_flight.values()
+                delay = _hedge_delay(model_id)
+                if delay is not None and call_started + delay - time.monotonic() < wait:
+                    wait = max(0.0, call_started + delay - time.monotonic())
+                    hedge_due = True
+
+            done, _ = await asyncio.wait(
+                in_flight, timeout=max(0.0, wait), return_when=asyncio.FIRST_COMPLETED
+            )
+
+            if not done:
+                if hedge_due:
+                    hedge_spent = True
+                    (slow_model, _), = in_flight.values()
+                    if launch_next():
+                        hedged = True
+                        logger.info(
+                            "Hedging: %s is past its p%d latency, racing the next model",
+                            slow_model,
+                            round(HEDGE_PERCENTILE * 100),
+                        )
+                    continue
+
+                # The deadline landed first. The calls in flight are cancelled
+                # outright rather than abandoned, so their connections stop
+                # holding anything - and counted against their models as the
+                # timeouts they are.
+                last_error = asyncio.TimeoutError()
+                for task, (model_id, call_started) in in_flight.items():
+                    timed_out.add(task)
+                    model_ranking.record_timeout(
+                        model_id, int((time.monotonic() - call_started) * 1000)
+                    )
+                logger.warning(
+                    "Cancelled %s after %.1fs: the deadline ran out mid-call",
+                    ", ".join(model for model, _ in in_flight.values()),
+                    deadline.elapsed(),
+                )
+                break
+
+            for task in done:
+                model_id, call_started = in_flight.pop(task)
+                error = task.exception()
+                if error is None:
+                    # Measured around the call itself rather than the whole
+                    # function, so it reports what the model took and not how
+                    # long a model with an open circuit was skipped for.
+                    latency_ms = int((time.monotonic() - call_started) * 1000)
+                    answer = _to_answer(model_id, task.result(), latency_ms, profile)
+                    context.token_estimator.observe(model_id, sent_chars, answer.prompt_tokens)
+                    if answer.text != EMPTY_RESPONSE_MESSAGE:
+                        _record_latency(model_id, latency_ms)
+                        model_ranking.record_success(model_id, latency_ms)
+                    if hedged:
+                        logger.info("Hedged request won by %s", model_id)
+                        answer = replace(answer, hedged=True)
+                        # The loser was past its usual latency and still going.
+                        for loser, loser_started in in_flight.values():
+                            model_ranking.record_unfinished(
+                                loser, int((time.monotonic() - loser_started) * 1000)
+                            )
+                    return replace(
+                        answer, deadline_remaining_ms=int(deadline.remaining() * 1000)
+                    )
+
+                last_error = error
+                if _is_retryable(model_id, error):
+                    if _is_timeout(error):
+                        model_ranking.record_timeout(
+                            model_id, int((time.monotonic() - call_started) * 1000)
+                        )
+                    else:
+                        model_ranking.record_failure(model_id)
+                    continue
+
+                # Anything else (auth, malformed request, network) is not a
+                # model-availability problem, so trying another model won't
+                # help.
+                #
+                # No usage travels with this: the call raised, so there are no
+                # counts to report and inventing any would describe work that
+                # never happened.
+                return Answer(text=_failure_message(error))
+    finally:
+        # The loser of a hedge, or whatever the deadline caught mid-call.
+        for task in in_flight:
+            task.cancel()
+        if in_flight:
+            await asyncio.gather(*in_flight, return_exceptions=True)
+
+    if skipped_all:
+        # Every model's circuit was open or its quota spent, so nothing was
+        # even attempted. That is the busy case by definition, and saying so
+        # immediately is the point of both - the visitor gets an honest answer
+        # in milliseconds instead of waiting out three refusals.
+        logger.warning("No model available; answering busy without calling upstream")
+        return Answer(text=BUSY_MESSAGE)
+
+    # Every candidate model failed; report the category of the last failure.
+    return Answer(text=_failure_message(last_error))
+
 
-        # Out of time for the visitor. Trying another model can only make the
-        # wait longer for an answer that is already late.
-        if now - started >= TOTAL_DEADLINE_SECONDS:
+async def stream_gemini_response(
+    api_key: str,
+    user_question: str,
+    knowledge: Knowledge,
+    conversation_history: Optional[Iterable[Dict[str, str]]] = None,
+    client: Optional[genai.Client] = None,
+    deadline: Optional[Deadline] = None,
+    profile: Optional[GenerationProfile] = None,
+) -> AsyncIterator[Union[str, Answer]]:
+    """The fallback chain, yielding text as the model writes it.
+
+    Yields `str` deltas, then exactly one `Answer` as the last item. The Answer
+    is the authority on what the visitor should end up reading: it is built by
+    the same rules as `get_gemini_response_async`, so a stream that finishes on
+    MAX_TOKENS ends in the truncation message even though the fragment has
+    already been relayed.
+
+    Fallback only happens before the first delta. Once text has reached the
+    visitor, switching to another model would splice two answers into one
+    bubble, so a failure from then on ends the stream with the failure copy.
+    """
+    if knowledge.is_empty:
+        logger.error("Refusing to answer: knowledge corpus is empty")
+        yield Answer(text=NO_KNOWLEDGE_MESSAGE)
+        return
+
+    if client is None:
+        client = client_pool.get(api_key, REQUEST_TIMEOUT_MS)
+    if profile is None:
+        profile = DEFAULT_PROFILE
+    instruction = build_system_instruction(knowledge)
+    contents = build_contents(user_question, conversation_history)
+    sent_chars = _prompt_chars(instruction, contents)
+
+    last_error: Optional[Exception] = None
+    skipped_all = True
+    if deadline is None:
+        deadline = Deadline.start()
+    for model_id in profile.order(model_ranking.order()):
+        now = time.monotonic()
+        if deadline.expired:
             logger.warning(
                 "Giving up after %.1fs without an answer; %s and any models after it not tried",
-                now - started,
+                deadline.elapsed(),
                 model_id,
             )
             break
 
-        # A model that just refused is skipped without a call. Asking again
-        # inside the cooldown buys nothing and costs the round-trip, which is
-        # how an exhausted quota queues requests up behind it.
-        if _model_is_cooling(model_id, now):
-            logger.info("Skipping %s: still cooling down after a recent refusal", model_id)
+        if quota_ledger.is_spent(model_id):
+            logger.info("Skipping %s: today's quota is spent", model_id)
+            metrics.model_skips.inc(model=model_id, reason="quota_spent")
+            continue
+        if not circuit_breakers.allow(model_id, now):
+            logger.info("Skipping %s: circuit %s", model_id, circuit_breakers.state(model_id, now))
+            metrics.model_skips.inc(model=model_id, reason="circuit_open")
             continue
 
         skipped_all = False
         call_started = time.monotonic()
+        first_token_ms: Optional[int] = None
+        parts: List[str] = []
+        last_chunk = None
         try:
-            response = client.models.generate_content(
-                model=model_id,
-                contents=contents,
-                config=config,
-            )
-            # Measured around the call itself rather than the whole function, so
-            # it reports what the model took and not how long a cooling-down
-            # model was skipped for.
-            latency_ms = int((time.monotonic() - call_started) * 1000)
-            usage = _read_usage(model_id, response)
-
-            text = (response.text or "").strip()
-            if not text:
-                return Answer(
-                    text=EMPTY_RESPONSE_MESSAGE,
-                    model=model_id,
-                    latency_ms=latency_ms,
-                    **usage,
-                )
+            # Settles the claim `allow` made by how the stream ends, including
+            # a visitor disconnecting mid-answer.
+            with circuit_breakers.guard(model_id):
+                async def open_stream():
+                    config = await _generation_config(
+                        client, model_id, instruction, deadline, profile
+                    )
+                    logger.info(
+                        "Streaming from %s with %.1fs of the deadline left (call timeout %dms)",
+                        model_id,
+                        deadline.remaining(),
+                        config.http_options.timeout,
+                    )
+                    quota_ledger.record_request(model_id)
+                    return await client.aio.models.generate_content_stream(
+                        model=model_id,
+                        contents=contents,
+                        config=config,
+                    )
 
-            # A MAX_TOKENS finish means the visitor is looking at half a
-            # sentence. The call succeeded and `response.text` is a plausible
-            # string, which is exactly why this has to be checked rather than
-            # trusted: handing over a truncated answer in Yanir's voice presents
-            # an incomplete claim as a complete one.
-            #
-            # The prompt asks for two to four sentences, so hitting a 1,500
-            # token ceiling means something already went wrong - usually
-            # thinking tokens consuming the shared budget. Saying so is more use
-            # than a fragment.
-            if usage["finish_reason"] == "MAX_TOKENS":
-                return Answer(
-                    text=TRUNCATED_RESPONSE_MESSAGE,
-                    model=model_id,
-                    latency_ms=latency_ms,
-                    **usage,
-                )
+                stream = await asyncio.wait_for(open_stream(), timeout=deadline.remaining())
+                try:
+                    # The deadline applies to each wait for the next chunk rather
+                    # than around the loop, so time the consumer spends relaying a
+                    # delta is not mistaken for upstream slowness - and so a
+                    # cancellation never lands while control is outside this
+                    # generator.
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(
+                                stream.__anext__(), timeout=deadline.remaining()
+                            )
+                        except StopAsyncIteration:
+                            break
 
-            return Answer(
-                text=text,
-                model=model_id,
-                latency_ms=latency_ms,
-                **usage,
+                        last_chunk = chunk
+                        text = getattr(chunk, "text", None) or ""
+                        if not text:
+                            continue
+                        if first_token_ms is None:
+                            first_token_ms = int((time.monotonic() - call_started) * 1000)
+                        parts.append(text)
+                        yield text
+                finally:
+                    # However this ends - the deadline, the visitor going away
+                    # while a delta is being relayed, an error - the upstream
+                    # stream is closed here rather than left suspended holding
+                    # its connection until the garbage collector finds it.
+                    await _aclose_stream(stream)
+        except asyncio.TimeoutError as e:
+            last_error = e
+            logger.warning(
+                "Cancelled %s after %.1fs: the deadline ran out mid-stream",
+                model_id,
+                deadline.elapsed(),
             )
-
+            model_ranking.record_timeout(model_id, int((time.monotonic() - call_started) * 1000))
+            break
         except Exception as e:
             last_error = e
-            logger.exception("Gemini API error with model %s", model_id)
-
-            # Decide from the SDK's structured status code rather than substring
-            # matching, so an unrelated message containing "404" cannot be
-            # mistaken for a retired model.
-            status_code = e.code if isinstance(e, genai_errors.APIError) else None
-
-            if status_code in RETRYABLE_STATUS_CODES:
-                # Rate limiting and exhausted quota are the cases worth
-                # remembering. A 404 means the model is retired, which no
-                # cooldown fixes, and a 5xx is usually a one-off.
-                if status_code == 429:
-                    _start_cooldown(model_id, time.monotonic())
-                logger.warning(
-                    "Model %s unavailable (HTTP %s), trying next model", model_id, status_code
-                )
+            if parts:
+                # Text is already on the visitor's screen; see the docstring.
+                logger.exception("Gemini stream from %s failed part-way through", model_id)
+                yield Answer(text=_failure_message(e))
+                return
+            if _is_retryable(model_id, e):
+                if _is_timeout(e):
+                    model_ranking.record_timeout(
+                        model_id, int((time.monotonic() - call_started) * 1000)
+                    )
+                else:
+                    model_ranking.record_failure(model_id)
                 continue
+            yield Answer(text=_failure_message(e))
+            return
 
-            # Anything else (auth, malformed request, network) is not a
-            # model-availability problem, so trying another model won't help.
-            #
-            # No usage travels with this: the call raised, so there are no
-            # counts to report and inventing any would describe work that never
-            # happened.
-            return Answer(text=_failure_message(e))
+        latency_ms = int((time.monotonic() - call_started) * 1000)
+        # Usage and the finish reason arrive on the final chunk, so that is what
+        # is read. Reading them from the first would report a reply that had
+        # not finished yet.
+        usage = _read_usage(model_id, last_chunk)
+        _account(model_id, usage, latency_ms, profile)
+        context.token_estimator.observe(model_id, sent_chars, usage["prompt_tokens"])
+        if parts:
+            model_ranking.record_success(model_id, latency_ms)
+        answer = _build_answer(model_id, "".join(parts), usage, latency_ms, first_token_ms)
+        yield replace(
+            answer,
+            deadline_remaining_ms=int(deadline.remaining() * 1000),
+            profile=profile.name,
+        )
+        return
 
     if skipped_all:
-        # Every model was still cooling down, so nothing was even attempted.
-        # That is the busy case by definition, and saying so immediately is the
-        # point of the cooldown - the visitor gets an honest answer in
-        # milliseconds instead of waiting out three refusals.
-        logger.warning("All models cooling down; answering busy without calling upstream")
-        return Answer(text=BUSY_MESSAGE)
+        logger.warning("No model available; answering busy without calling upstream")
+        yield Answer(text=BUSY_MESSAGE)
+        return
 
-    # Every candidate model failed; report the category of the last failure.
-    return Answer(text=_failure_message(last_error))
+    yield Answer(text=_failure_message(last_error))
+
+
+async def _aclose_stream(stream) -> None:
+    """Closes an upstream chunk iterator, if it can be closed."""
+    aclose = getattr(stream, "aclose", None)
+    if aclose is None:
+        return
+    try:
+        await aclose()
+    except Exception:
+        # Already broken by whatever ended it; there is nothing left to release.
+        logger.debug("Closing an upstream stream failed", exc_info=True)
+
+
+def _prompt_chars(instruction: str, contents: List[Dict]) -> int:
+    """Characters of prompt sent, for calibrating the token estimate against."""
+    return len(instruction) + sum(
+        len(part.get("text") or "") for turn in contents for part in turn["parts"]
+    )
+
+
+def _to_answer(
+    model_id: str, response, latency_ms: int, profile: GenerationProfile = DEFAULT_PROFILE
+) -> Answer:
+    """The reply a successful call produced, with what it cost attached."""
+    usage = _read_usage(model_id, response)
+    _account(model_id, usage, latency_ms, profile)
+    answer = _build_answer(model_id, response.text or "", usage, latency_ms)
+    return replace(answer, profile=profile.name)
+
+
+def _account(
+    model_id: str,
+    usage: Dict[str, Optional[object]],
+    latency_ms: int,
+    profile: GenerationProfile = DEFAULT_PROFILE,
+) -> None:
+    """Books an answered call's tokens against the day's quota and into the metrics.
+
+    The request itself was counted when it was sent.
+
+    A count the API did not report is left out of its histogram rather than
+    observed as zero, which would drag the distribution toward a number that
+    was never measured. The profile is a label so that what each one saves in
+    thinking tokens and latency can be read off directly.
+    """
+    quota_ledger.record_tokens(model_id, usage["total_tokens"])
+    metrics.answer_latency_ms.observe(latency_ms, model=model_id, profile=profile.name)
+    for kind in ("prompt", "thinking", "output"):
+        tokens = usage[f"{kind}_tokens"]
+        if tokens is not None:
+            metrics.answer_tokens.observe(tokens, model=model_id, profile=profile.name, kind=kind)
+
+
+def _build_answer(
+    model_id: str,
+    text: str,
+    usage: Dict[str, Optional[object]],
+    latency_ms: int,
+    first_token_ms: Optional[int] = None,
+) -> Answer:
+    measured = dict(usage, latency_ms=latency_ms, first_token_ms=first_token_ms)
+
+    text = text.strip()
+    if not text:
+        return Answer(text=EMPTY_RESPONSE_MESSAGE, model=model_id, **measured)
+
+    # A MAX_TOKENS finish means the visitor is looking at half a sentence. The
+    # call succeeded and `response.text` is a plausible string, which is exactly
+    # why this has to be checked rather than trusted: handing over a truncated
+    # answer in Yanir's voice presents an incomplete claim as a complete one.
+    #
+    # The prompt asks for two to four sentences, so hitting a 1,500 token
+    # ceiling means something already went wrong - usually thinking tokens
+    # consuming the shared budget. Saying so is more use than a fragment.
+    if usage["finish_reason"] == "MAX_TOKENS":
+        return Answer(text=TRUNCATED_RESPONSE_MESSAGE, model=model_id, **measured)
+
+    return Answer(text=text, model=model_id, **measured)
+
+
+def _is_retryable(model_id: str, error: Exception) -> bool:
+    """Logs a failed call and decides whether the next model is worth trying."""
+    logger.exception("Gemini API error with model %s", model_id, exc_info=error)
+
+    # Decide from the SDK's structured status code rather than substring
+    # matching, so an unrelated message containing "404" cannot be mistaken for
+    # a retired model.
+    if _is_timeout(error):
+        # The model hung rather than refused. What is left of the deadline may
+        # still be enough for the next one; Deadline.call_timeout_ms keeps that
+        # call inside it.
+        logger.warning("Model %s timed out, trying next model", model_id)
+        return True
+
+    status_code = error.code if isinstance(error, genai_errors.APIError) else None
+    if status_code not in RETRYABLE_STATUS_CODES:
+        return False
+
+    # Remembering the failure is the circuit breaker's job, settled by whoever
+    # claimed the call; this only decides whether to move on.
+    logger.warning(
+        "Model %s unavailable (HTTP %s), trying next model", model_id, status_code
+    )
+    return True
 
 
 def _read_usage(model_id: str, response) -> Dict[str, Optional[object]]:
@@ -344,6 +1647,10 @@ def _read_usage(model_id: str, response) -> Dict[str, Optional[object]]:
     usage = getattr(response, "usage_metadata", None)
     fields: Dict[str, Optional[object]] = {
         "prompt_tokens": getattr(usage, "prompt_token_count", None),
+        # The part of prompt_tokens served from a cached prefix - an explicit
+        # cached-content entry or Gemini's own implicit cache. Included in
+        # prompt_tokens, not added to it.
+        "cached_tokens": getattr(usage, "cached_content_token_count", None),
         "thinking_tokens": getattr(usage, "thoughts_token_count", None),
         "output_tokens": getattr(usage, "candidates_token_count", None),
         "total_tokens": getattr(usage, "total_token_count", None),
@@ -351,9 +1658,10 @@ def _read_usage(model_id: str, response) -> Dict[str, Optional[object]]:
 
     if usage is not None:
         logger.info(
-            "Gemini usage model=%s prompt=%s thinking=%s output=%s total=%s",
+            "Gemini usage model=%s prompt=%s cached=%s thinking=%s output=%s total=%s",
             model_id,
             fields["prompt_tokens"],
+            fields["cached_tokens"],
             fields["thinking_tokens"],
             fields["output_tokens"],
             fields["total_tokens"],
@@ -370,9 +1678,9 @@ def _read_usage(model_id: str, response) -> Dict[str, Optional[object]]:
     if name == "MAX_TOKENS":
         logger.warning(
             "Model %s hit MAX_TOKENS - the answer was truncated mid-sentence. "
-            "Thinking tokens share MAX_OUTPUT_TOKENS (%d); raise it.",
+            "Thinking tokens share the output cap; raise the generation profile's "
+            "max_output_tokens or lower its thinking_budget.",
             model_id,
-            MAX_OUTPUT_TOKENS,
         )
 
     return fields
@@ -0,0 +1 @@
+"""Offline capacity tooling: a load generator and a fake Gemini API to run the real app against."""
@@ -0,0 +1,99 @@
+"""`python -m loadtest`: drive the app and write a result file. See harness.py."""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import sys
+from typing import List, Optional
+
+from loadtest import harness
+from loadtest.harness import LoadConfig, compare, format_report, parse_mix, run_load, serve
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m loadtest", description=harness.__doc__.split("\n\n")[0])
+    parser.add_argument("--target", default=LoadConfig.target, help="base URL of a running app")
+    parser.add_argument("--serve", action="store_true", help="start the fake Gemini API and the app in-process")
+    parser.add_argument("--unlimited", action="store_true", help="with --serve, switch the chat rate limit off")
+    parser.add_argument("--fake-latency-median-ms", type=float, default=2_500)
+    parser.add_argument("--fake-rate-429", type=float, default=0.0)
+    parser.add_argument("--fake-rate-503", type=float, default=0.0)
+    parser.add_argument("--duration", type=float, default=LoadConfig.duration_seconds, help="seconds")
+    parser.add_argument("--rate", type=float, default=LoadConfig.rate, help="arrivals per second; 0 for closed-loop")
+    parser.add_argument("--concurrency", type=int, default=LoadConfig.concurrency)
+    parser.add_argument("--mix", default=",".join(f"{k}={v:g}" for k, v in harness.DEFAULT_MIX.items()))
+    parser.add_argument("--clients", type=int, default=LoadConfig.clients)
+    parser.add_argument("--allow-replays", action="store_true")
+    parser.add_argument("--timeout", type=float, default=LoadConfig.timeout_seconds)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--out", help="write the result JSON here")
+    parser.add_argument("--compare", help="a previous result JSON to compare against")
+    parser.add_argument(
+        "--tolerance", type=float, default=harness.REGRESSION_TOLERANCE_PERCENT,
+        help="percent change before a worsened metric is called a regression",
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    config = LoadConfig(
+        target=args.target,
+        duration_seconds=args.duration,
+        rate=args.rate,
+        concurrency=args.concurrency,
+        mix=mix,
+        clients=args.clients,
+        allow_replays=args.allow_replays,
+        timeout_seconds=args.timeout,
+        seed=args.seed,
+    )
+
+    servers = ()
+    app_loop = None
+    fake_stats = None
+    if args.serve:
+        from loadtest.fake_gemini import FakeConfig
+
+        fake_config = FakeConfig(
+            latency_median_ms=args.fake_latency_median_ms,
+            rate_429=args.fake_rate_429,
+            rate_503=args.fake_rate_503,
+            seed=args.seed,
+        )
+        servers = serve(fake_config, unlimited=args.unlimited)
+        fake, app = servers
+        config.target = app.url
+        app_loop = app.loop
+
+    try:
+        result = asyncio.run(run_load(config, app_loop=app_loop))
+    finally:
+        if servers:
+            fake_stats = servers[0].server.config.app.state.fake.stats()
+            for server in reversed(servers):
+                server.stop()
+
+    if fake_stats is not None:
+        result["fake_gemini"] = fake_stats
+    print(format_report(result))
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"Result written to {args.out}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)
+        print(f"\nCompared with {args.compare} ({previous.get('revision')}):")
+        print("\n".join(compare(previous, result, args.tolerance)) or "no differences")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,307 @@
+"""A local stand-in for the Gemini API, for capacity runs that spend no quota.
+
+tests/conftest.py replaces `genai.Client` inside pytest, which is right for
+pinning behaviour and useless for measuring it: nothing crosses a socket, so
+nothing about connection reuse, the event loop under concurrency, or the
+limiters in front of a real call is exercised. This serves the same REST
+surface the SDK calls, so the real app, the real SDK and the real fallback
+chain run unmodified against it:
+
+    python -m loadtest.fake_gemini --port 8090 --latency-median-ms 3000 --rate-429 0.05
+    GEMINI_BASE_URL=http://127.0.0.1:8090 GEMINI_API_KEY=fake uvicorn main:app
+
+What it answers with is shaped like the real thing where the backend reads it:
+`usageMetadata` with prompt, thinking, output and total counts (thinking capped
+by a request's thinking budget, and the latency with it), finish reasons
+including an occasional MAX_TOKENS, and errors carrying Google's status names
+and a RetryInfo delay - because those are what the trace, the quota ledger and
+the circuit breakers act on. The text itself is filler.
+
+Latency is drawn from a log-normal distribution, which is what upstream
+latencies look like: most answers near the median and a long right tail. 429s
+and 503s are injected at configurable rates, and `--quota-per-model` makes a
+model answer 429 for the rest of the run once it has served that many, the way
+a spent free-tier day does. All of it can be changed mid-run by POSTing to
+`/_fake/config`, and `/_fake/stats` reports what was served.
+
+Nothing here is imported by the app. It ships in the image only because the
+image copies the backend directory whole.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import threading
+from dataclasses import asdict, dataclass, fields
+from typing import Dict, List, Optional
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Roughly what the real models report per character of English prompt.
+CHARS_PER_TOKEN = 4
+
+# How much of a reply's latency is thinking. Observed replies spend ~600 tokens
+# thinking to ~110 answering, so most of the wait is deliberation.
+THINKING_LATENCY_SHARE = 0.6
+
+_FILLER = (
+    "I built that with a small team, and most of the work was in making the "
+    "failure cases boring. The interesting part was deciding what not to build. "
+    "I wrote about it at the time, and the short version is that measuring first "
+    "saved more than any clever optimisation did later."
+)
+
+
+@dataclass
+class FakeConfig:
+    """Everything a run can tune. Rates are probabilities per request."""
+
+    latency_median_ms: float = 2_500
+    # Log-normal sigma: 0.5 puts p95 at roughly 2.3x the median.
+    latency_sigma: float = 0.5
+    rate_429: float = 0.0
+    rate_503: float = 0.0
+    rate_max_tokens: float = 0.0
+    # Requests each model serves before answering 429 for the rest of the run.
+    # 0 means no daily quota is simulated.
+    quota_per_model: int = 0
+    retry_after_seconds: int = 30
+    # Streaming: how many chunks an answer is split into.
+    stream_chunks: int = 6
+    thinking_tokens_min: int = 100
+    thinking_tokens_max: int = 600
+    seed: Optional[int] = None
+
+
+class FakeGemini:
+    """The state behind the app: configuration, a seeded RNG and counters."""
+
+    def __init__(self, config: Optional[FakeConfig] = None):
+        self._lock = threading.Lock()
+        self.configure(config or FakeConfig())
+
+    def configure(self, config: FakeConfig) -> None:
+        with self._lock:
+            self.config = config
+            self._random = random.Random(config.seed)
+            self._served: Dict[str, int] = {}
+            self._outcomes: Dict[str, Dict[str, int]] = {}
+            self._caches = 0
+
+    def _count(self, model: str, outcome: str) -> None:
+        per_model = self._outcomes.setdefault(model, {})
+        per_model[outcome] = per_model.get(outcome, 0) + 1
+
+    def decide(self, model: str) -> Optional[int]:
+        """The error status this request gets, or None to answer it."""
+        with self._lock:
+            config = self.config
+            served = self._served.get(model, 0)
+            if config.quota_per_model and served >= config.quota_per_model:
+                self._count(model, "429")
+                return 429
+            roll = self._random.random()
+            if roll < config.rate_429:
+                self._count(model, "429")
+                return 429
+            if roll < config.rate_429 + config.rate_503:
+                self._count(model, "503")
+                return 503
+            self._served[model] = served + 1
+            self._count(model, "200")
+            return None
+
+    def latency_seconds(self) -> float:
+        with self._lock:
+            config = self.config
+            draw = self._random.lognormvariate(math.log(config.latency_median_ms), config.latency_sigma)
+        return draw / 1000
+
+    def finish_reason(self) -> str:
+        with self._lock:
+            return "MAX_TOKENS" if self._random.random() < self.config.rate_max_tokens else "STOP"
+
+    def thinking_tokens(self) -> int:
+        with self._lock:
+            config = self.config
+            return self._random.randint(config.thinking_tokens_min, config.thinking_tokens_max)
+
+    def new_cache_name(self) -> str:
+        with self._lock:
+            self._caches += 1
+            return f"cachedContents/fake-{self._caches}"
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {"config": asdict(self.config), "outcomes": dict(self._outcomes)}
+
+
+def _text_of(payload: Dict) -> str:
+    """All the text a request carries: system instruction and every turn."""
+    parts: List[str] = []
+    system = payload.get("systemInstruction") or payload.get("system_instruction") or {}
+    for part in system.get("parts") or []:
+        parts.append(part.get("text") or "")
+    for turn in payload.get("contents") or []:
+        for part in turn.get("parts") or []:
+            parts.append(part.get("text") or "")
+    return "\n".join(parts)
+
+
+def _thinking_budget(payload: Dict) -> Optional[int]:
+    config = (payload.get("generationConfig") or {}).get("thinkingConfig") or {}
+    # The SDK sends this one field in snake_case; the API accepts either.
+    budget = config.get("thinkingBudget", config.get("thinking_budget"))
+    return budget if isinstance(budget, int) and budget >= 0 else None
+
+
+def _usage(prompt_chars: int, answer: str, thinking: int, cached: bool) -> Dict[str, int]:
+    prompt_tokens = max(1, math.ceil(prompt_chars / CHARS_PER_TOKEN))
+    output_tokens = max(1, math.ceil(len(answer) / CHARS_PER_TOKEN))
+    usage = {
+        "promptTokenCount": prompt_tokens,
+        "candidatesTokenCount": output_tokens,
+        "thoughtsTokenCount": thinking,
+        "totalTokenCount": prompt_tokens + output_tokens + thinking,
+    }
+    if cached:
+        usage["cachedContentTokenCount"] = int(prompt_tokens * 0.9)
+    return usage
+
+
+def _response(model: str, text: str, finish_reason: Optional[str], usage: Optional[Dict]) -> Dict:
+    candidate: Dict[str, object] = {"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}
+    if finish_reason is not None:
+        candidate["finishReason"] = finish_reason
+    body: Dict[str, object] = {"candidates": [candidate], "modelVersion": model}
+    if usage is not None:
+        body["usageMetadata"] = usage
+    return body
+
+
+_STATUS_NAMES = {429: "RESOURCE_EXHAUSTED", 503: "UNAVAILABLE"}
+
+
+def _error(status: int, retry_after_seconds: int) -> JSONResponse:
+    error: Dict[str, object] = {
+        "code": status,
+        "message": "Injected by loadtest.fake_gemini",
+        "status": _STATUS_NAMES[status],
+    }
+    if status == 429:
+        error["details"] = [
+            {
+                "@type": "type.googleapis.com/google.rpc.RetryInfo",
+                "retryDelay": f"{retry_after_seconds}s",
+            }
+        ]
+    return JSONResponse({"error": error}, status_code=status)
+
+
+def create_app(fake: Optional[FakeGemini] = None) -> FastAPI:
+    fake = fake or FakeGemini()
+    app = FastAPI(title="fake-gemini")
+    app.state.fake = fake
+
+    @app.get("/{version}/models/{model}")
+    async def model_info(version: str, model: str):
+        # What a startup prewarm asks for. Metadata only: no latency, no quota.
+        return {"name": f"models/{model}", "displayName": model}
+
+    @app.post("/{version}/models/{target}")
+    async def models(version: str, target: str, request: Request):
+        model, _, method = target.partition(":")
+        if method not in ("generateContent", "streamGenerateContent"):
+            raise HTTPException(status_code=404, detail=f"unknown method {method!r}")
+        payload = await request.json()
+        status = fake.decide(model)
+        if status is not None:
+            await asyncio.sleep(0.05)
+            return _error(status, fake.config.retry_after_seconds)
+
+        # A thinking budget caps the thinking and takes its share of the
+        # latency with it, the way the real models behave.
+        thinking = fake.thinking_tokens()
+        latency = fake.latency_seconds()
+        budget = _thinking_budget(payload)
+        if budget is not None and budget < thinking:
+            latency *= 1 - THINKING_LATENCY_SHARE * (1 - budget / thinking)
+            thinking = budget
+        await asyncio.sleep(latency)
+
+        prompt_chars = len(_text_of(payload))
+        cached = bool(payload.get("cachedContent"))
+        finish = fake.finish_reason()
+        text = _FILLER if finish == "STOP" else _FILLER[: len(_FILLER) // 3]
+        usage = _usage(prompt_chars, text, thinking, cached)
+
+        if method == "generateContent":
+            return _response(model, text, finish, usage)
+
+        chunks = max(1, fake.config.stream_chunks)
+        size = math.ceil(len(text) / chunks)
+        pieces = [text[i : i + size] for i in range(0, len(text), size)]
+
+        async def events():
+            for i, piece in enumerate(pieces):
+                last = i == len(pieces) - 1
+                # Usage and the finish reason ride on the last chunk, as upstream.
+                body = _response(model, piece, finish if last else None, usage if last else None)
+                yield f"data: {json.dumps(body)}\r\n\r\n"
+                if not last:
+                    await asyncio.sleep(0.02)
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/{version}/cachedContents")
+    async def create_cache(version: str, request: Request):
+        payload = await request.json()
+        return {"name": fake.new_cache_name(), "model": payload.get("model"), "expireTime": None}
+
+    @app.delete("/{version}/cachedContents/{name}")
+    async def delete_cache(version: str, name: str):
+        return {}
+
+    @app.get("/_fake/stats")
+    async def stats():
+        return fake.stats()
+
+    @app.post("/_fake/config")
+    async def configure(request: Request):
+        """Replaces the configuration and resets the counters. Unnamed fields keep their defaults."""
+        known = {f.name for f in fields(FakeConfig)}
+        updates = {k: v for k, v in (await request.json()).items() if k in known}
+        fake.configure(FakeConfig(**updates))
+        return fake.stats()
+
+    return app
+
+
+app = create_app()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    for field in fields(FakeConfig):
+        default = field.default
+        kind = int if field.type in ("int", "Optional[int]") else float
+        parser.add_argument(
+            f"--{field.name.replace('_', '-')}", type=kind, default=default, dest=field.name
+        )
+    args = parser.parse_args(argv)
+
+    config = FakeConfig(**{f.name: getattr(args, f.name) for f in fields(FakeConfig)})
+    uvicorn.run(create_app(FakeGemini(config)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,520 @@
+"""A load generator for the chat and content endpoints.
+
+The instance sizing in rate_limit.py is arithmetic about quota; it says nothing
+about how many visitors one Cloud Run instance can hold before latency goes,
+because nothing has ever measured that. This drives the endpoints a visitor
+actually hits, at a set arrival rate and concurrency, and reports what came
+back:
+
+    python -m loadtest --serve --duration 60 --rate 20 --concurrency 32 --out before.json
+    python -m loadtest --serve --duration 60 --rate 20 --concurrency 32 --compare before.json
+
+`--serve` starts the fake Gemini API and the app in this process, each on its
+own thread and event loop, so the app's event-loop lag can be sampled directly.
+Its numbers include the harness sharing the GIL with the app; for a faithful
+measurement start the app yourself against the fake (see the README) and point
+`--target` at it, which reports only the harness's own loop lag.
+
+Arrivals are open-loop: a Poisson process at `--rate` per second, whatever the
+app is doing, because visitors do not wait for each other. `--concurrency`
+caps the requests in flight, and time an arrival spent waiting for a slot is
+reported separately as `queued_ms` - if that grows, the harness rather than the
+app was the bottleneck. `--rate 0` runs closed-loop instead: `--concurrency`
+workers sending back to back.
+
+Everything arrives from one address, so the per-visitor chat budget is spent
+almost at once. `--clients N` spreads requests over N invented addresses
+through X-Forwarded-For, which is what client_key reads on a direct request;
+`--unlimited` (with `--serve`) switches the chat limiter off altogether.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import datetime
+import math
+import os
+import random
+import socket
+import subprocess
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+# Bumped when the result file changes shape, so compare can refuse a mismatch.
+RESULT_VERSION = 1
+
+ENDPOINTS: Dict[str, Tuple[str, str]] = {
+    "chat": ("POST", "/chat-with-files"),
+    "projects": ("GET", "/api/projects"),
+    "writing": ("GET", "/api/writing"),
+    "status": ("GET", "/api/chat/status"),
+}
+
+# Roughly what the site sees: a page load fetches the content lists and the
+# chat status, and a fraction of visitors then ask something.
+DEFAULT_MIX = {"chat": 1.0, "projects": 2.0, "writing": 2.0, "status": 2.0}
+
+QUESTIONS = (
+    "What do you build?",
+    "Tell me about your most recent project.",
+    "Which languages do you use day to day?",
+    "What have you written about?",
+    "How did you build the chat on this site?",
+    "What kind of role are you looking for?",
+    "What was the hardest problem in ReelSensei?",
+    "Do you have backend experience?",
+)
+
+# How often the lag probe wakes. Lag is how late it wakes, so the interval only
+# sets the resolution.
+LAG_INTERVAL_SECONDS = 0.05
+
+
+@dataclass
+class LoadConfig:
+    target: str = "http://127.0.0.1:8000"
+    duration_seconds: float = 30.0
+    # Arrivals per second; 0 runs closed-loop at `concurrency`.
+    rate: float = 20.0
+    concurrency: int = 32
+    mix: Dict[str, float] = field(default_factory=lambda: dict(DEFAULT_MIX))
+    # Distinct X-Forwarded-For addresses to spread requests over.
+    clients: int = 1
+    # Every chat question is made unique unless replays are allowed, so the
+    # answer cache does not turn a chat load test into a cache benchmark.
+    allow_replays: bool = False
+    timeout_seconds: float = 60.0
+    seed: Optional[int] = None
+
+
+@dataclass
+class Sample:
+    endpoint: str
+    # 0 when no response arrived at all: a timeout or a refused connection.
+    status: int
+    latency_ms: float
+    queued_ms: float
+    # For chat, what produced the reply; see _chat_outcome.
+    outcome: Optional[str] = None
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """`chat=1,projects=2` to weights, rejecting endpoints that do not exist."""
+    mix: Dict[str, float] = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, weight = item.partition("=")
+        if name not in ENDPOINTS:
+            raise ValueError(f"unknown endpoint {name!r}; expected one of {', '.join(ENDPOINTS)}")
+        mix[name] = float(weight) if weight else 1.0
+    if not any(weight > 0 for weight in mix.values()):
+        raise ValueError("the mix needs at least one endpoint with a positive weight")
+    return mix
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """Nearest-rank percentile: always a value that was actually observed."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return round(ordered[rank - 1], 1)
+
+
+def _distribution(values: List[float]) -> Dict[str, Optional[float]]:
+    return {
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": round(max(values), 1) if values else None,
+    }
+
+
+def _chat_outcome(status: int, body: object) -> Optional[str]:
+    """Which path answered a chat request.
+
+    A 200 is not the same as an answer: the busy reply and the contact flow both
+    come back 200 without a trace. Counting them as successes would make a run
+    where every model was refusing look healthy.
+    """
+    if status != 200 or not isinstance(body, dict):
+        return None
+    trace = body.get("trace")
+    if not trace:
+        return "no_model"
+    if trace.get("from_cache"):
+        return "replayed"
+    if trace.get("coalesced"):
+        return "coalesced"
+    return "model"
+
+
+class LagProbe:
+    """Samples how late an event loop runs a timer it was given.
+
+    A loop blocked by synchronous work - a corpus rebuild, a regex over a long
+    document - wakes every timer late by however long it was blocked, and every
+    request on it waits the same.
+    """
+
+    def __init__(self, interval: float = LAG_INTERVAL_SECONDS):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._running = True
+
+    async def run(self) -> None:
+        while self._running:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, (time.perf_counter() - expected) * 1000))
+
+    def stop(self) -> None:
+        self._running = False
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        return _distribution(self.samples)
+
+
+def summarise(samples: List[Sample], elapsed: float) -> Dict[str, Dict[str, object]]:
+    """Per-endpoint counts, rates and latency percentiles."""
+    endpoints: Dict[str, Dict[str, object]] = {}
+    for name in ENDPOINTS:
+        mine = [s for s in samples if s.endpoint == name]
+        if not mine:
+            continue
+        ok = [s for s in mine if 200 <= s.status < 300]
+        limited = [s for s in mine if s.status == 429]
+        errors = len(mine) - len(ok) - len(limited)
+        summary: Dict[str, object] = {
+            "requests": len(mine),
+            "ok": len(ok),
+            "rate_limited": len(limited),
+            "errors": errors,
+            "error_rate": round(errors / len(mine), 4),
+            "rate_limited_rate": round(len(limited) / len(mine), 4),
+            "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else None,
+            # Successful requests only: a 429 is answered in microseconds, and
+            # mixing it in would make a saturated run look fast.
+            "latency_ms": _distribution([s.latency_ms for s in ok]),
+            "queued_ms": _distribution([s.queued_ms for s in mine]),
+        }
+        outcomes: Dict[str, int] = {}
+        for s in mine:
+            if s.outcome is not None:
+                outcomes[s.outcome] = outcomes.get(s.outcome, 0) + 1
+        if outcomes:
+            summary["outcomes"] = outcomes
+        endpoints[name] = summary
+    return endpoints
+
+
+class _Driver:
+    """Sends one run's requests and collects a Sample for each."""
+
+    def __init__(self, config: LoadConfig, client: httpx.AsyncClient, edge_secret: str):
+        self.config = config
+        self.client = client
+        self.edge_secret = edge_secret
+        self.random = random.Random(config.seed)
+        self.samples: List[Sample] = []
+        self._sent = 0
+        self._names = [name for name, weight in config.mix.items() if weight > 0]
+        self._weights = [config.mix[name] for name in self._names]
+
+    def _headers(self) -> Dict[str, str]:
+        headers: Dict[str, str] = {}
+        if self.edge_secret:
+            headers["x-edge-auth"] = self.edge_secret
+        if self.config.clients > 1:
+            n = self.random.randrange(self.config.clients)
+            headers["x-forwarded-for"] = f"10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}"
+        return headers
+
+    def _chat_body(self) -> Dict[str, object]:
+        question = self.random.choice(QUESTIONS)
+        if not self.config.allow_replays:
+            # Makes every question distinct to the answer cache, which keys on
+            # answer_cache.normalise_question: case, spacing and trailing
+            # punctuation fold away there, but the run number does not, so the
+            # run measures upstream calls rather than collapsing into replays.
+            question = f"{question} (run{self._sent:06d})"
+        return {"message": question, "conversation_history": []}
+
+    async def send(self, arrived: float, slot: Optional[asyncio.Semaphore]) -> None:
+        name = self.random.choices(self._names, self._weights)[0]
+        method, path = ENDPOINTS[name]
+        self._sent += 1
+        body = self._chat_body() if name == "chat" else None
+
+        if slot is not None:
+            await slot.acquire()
+        started = time.perf_counter()
+        status, payload = 0, None
+        try:
+            response = await self.client.request(method, path, json=body, headers=self._headers())
+            status = response.status_code
+            if name == "chat" and status == 200:
+                payload = response.json()
+        except (httpx.HTTPError, ValueError):
+            pass
+        finally:
+            if slot is not None:
+                slot.release()
+        finished = time.perf_counter()
+
+        self.samples.append(
+            Sample(
+                endpoint=name,
+                status=status,
+                latency_ms=(finished - started) * 1000,
+                queued_ms=(started - arrived) * 1000,
+                outcome=_chat_outcome(status, payload) if name == "chat" else None,
+            )
+        )
+
+    async def open_loop(self) -> None:
+        slot = asyncio.Semaphore(self.config.concurrency)
+        tasks = set()
+        end = time.perf_counter() + self.config.duration_seconds
+        next_arrival = time.perf_counter()
+        while next_arrival < end:
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = asyncio.create_task(self.send(next_arrival, slot))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            next_arrival += self.random.expovariate(self.config.rate)
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    async def closed_loop(self) -> None:
+        end = time.perf_counter() + self.config.duration_seconds
+
+        async def worker() -> None:
+            while time.perf_counter() < end:
+                await self.send(time.perf_counter(), None)
+
+        await asyncio.gather(*(worker() for _ in range(self.config.concurrency)))
+
+
+async def run_load(
+    config: LoadConfig,
+    transport: Optional[httpx.AsyncBaseTransport] = None,
+    app_loop: Optional[asyncio.AbstractEventLoop] = None,
+    edge_secret: Optional[str] = None,
+) -> Dict[str, object]:
+    """Drives `config.target` for the configured duration and returns the result.
+
+    `app_loop`, when the app runs in this process, is sampled for lag alongside
+    the harness's own loop. `transport` replaces the socket, for tests.
+    """
+    if edge_secret is None:
+        edge_secret = os.getenv("ORIGIN_SHARED_SECRET", "").strip()
+    harness_probe = LagProbe()
+    app_probe = LagProbe() if app_loop is not None else None
+    limits = httpx.Limits(max_connections=config.concurrency, max_keepalive_connections=config.concurrency)
+
+    async with httpx.AsyncClient(
+        base_url=config.target,
+        transport=transport,
+        timeout=config.timeout_seconds,
+        limits=limits,
+    ) as client:
+        driver = _Driver(config, client, edge_secret)
+        probe_task = asyncio.create_task(harness_probe.run())
+        app_probe_future = (
+            asyncio.run_coroutine_threadsafe(app_probe.run(), app_loop) if app_probe else None
+        )
+        started = time.perf_counter()
+        try:
+            if config.rate > 0:
+                await driver.open_loop()
+            else:
+                await driver.closed_loop()
+        finally:
+            elapsed = time.perf_counter() - started
+            harness_probe.stop()
+            if app_probe is not None:
+                app_probe.stop()
+            await probe_task
+            if app_probe_future is not None:
+                await asyncio.wrap_future(app_probe_future)
+
+    return {
+        "version": RESULT_VERSION,
+        "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "revision": _revision(),
+        "config": asdict(config),
+        "elapsed_seconds": round(elapsed, 2),
+        "endpoints": summarise(driver.samples, elapsed),
+        "event_loop_lag_ms": {
+            "app": app_probe.summary() if app_probe is not None else None,
+            "harness": harness_probe.summary(),
+        },
+    }
+
+
+def _revision() -> Optional[str]:
+    """The commit under test, so two result files say which releases they were."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            timeout=5,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+# Compared between runs, with whether a rise is good news.
+_COMPARED = (
+    ("latency_ms.p50", False),
+    ("latency_ms.p95", False),
+    ("latency_ms.p99", False),
+    ("throughput_rps", True),
+    ("error_rate", False),
+    ("rate_limited_rate", False),
+)
+
+
+def _lookup(summary: Dict[str, object], path: str) -> Optional[float]:
+    value: object = summary
+    for key in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value if isinstance(value, (int, float)) else None
+
+
+# Run-to-run noise on a laptop is easily a few percent either way; a change
+# smaller than this is reported but not called a regression.
+REGRESSION_TOLERANCE_PERCENT = 10.0
+
+
+def compare(
+    previous: Dict[str, object],
+    current: Dict[str, object],
+    tolerance: float = REGRESSION_TOLERANCE_PERCENT,
+) -> List[str]:
+    """One line per endpoint metric that changed, with the worsened ones marked.
+
+    Only meaningful between runs with the same settings, so a mismatch is said
+    up front rather than left for the reader to notice.
+    """
+    if previous.get("version") != current.get("version"):
+        return [f"Result format differs (v{previous.get('version')} vs v{current.get('version')}); not compared"]
+    lines: List[str] = []
+    ignored = ("seed",)
+    before_config = {k: v for k, v in (previous.get("config") or {}).items() if k not in ignored}
+    after_config = {k: v for k, v in (current.get("config") or {}).items() if k not in ignored}
+    if before_config != after_config:
+        lines.append("Warning: the runs used different settings; differences may not be regressions")
+
+    before_endpoints = previous.get("endpoints") or {}
+    for name, after in (current.get("endpoints") or {}).items():
+        before = before_endpoints.get(name)
+        if before is None:
+            lines.append(f"{name}: not in the previous run")
+            continue
+        for path, higher_is_better in _COMPARED:
+            old, new = _lookup(before, path), _lookup(after, path)
+            if old is None or new is None or old == new:
+                continue
+            change = (new - old) / old * 100 if old else math.inf
+            worse = abs(change) > tolerance and ((new < old) if higher_is_better else (new > old))
+            lines.append(
+                f"{name} {path}: {old} -> {new} ({change:+.1f}%){' WORSE' if worse else ''}"
+            )
+    return lines
+
+
+def format_report(result: Dict[str, object]) -> str:
+    lines = [f"{'endpoint':<10}{'reqs':>7}{'ok':>7}{'429':>6}{'err':>6}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}"]
+    for name, s in result["endpoints"].items():
+        latency = s["latency_ms"]
+        lines.append(
+            f"{name:<10}{s['requests']:>7}{s['ok']:>7}{s['rate_limited']:>6}{s['errors']:>6}"
+            f"{s['throughput_rps'] or 0:>8}{latency['p50'] or '-':>9}{latency['p95'] or '-':>9}"
+            f"{latency['p99'] or '-':>9}"
+        )
+        if "outcomes" in s:
+            lines.append(f"{'':<10}outcomes: {s['outcomes']}")
+    for loop, lag in result["event_loop_lag_ms"].items():
+        if lag is not None:
+            lines.append(f"event-loop lag ({loop}): p50 {lag['p50']}ms, p99 {lag['p99']}ms, max {lag['max']}ms")
+    return "\n".join(lines)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class ServerThread(threading.Thread):
+    """A uvicorn server on its own thread and event loop."""
+
+    def __init__(self, app, port: int):
+        import uvicorn
+
+        super().__init__(daemon=True)
+        self.port = port
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.server = uvicorn.Server(
+            uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="on")
+        )
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def run(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.server.serve())
+
+    def start_and_wait(self, timeout: float = 30.0) -> "ServerThread":
+        self.start()
+        deadline = time.monotonic() + timeout
+        while not self.server.started:
+            if not self.is_alive() or time.monotonic() > deadline:
+                raise RuntimeError(f"server on port {self.port} did not start")
+            time.sleep(0.05)
+        return self
+
+    def stop(self) -> None:
+        self.server.should_exit = True
+        self.join(timeout=10)
+
+
+def serve(fake_config, unlimited: bool) -> Tuple[ServerThread, ServerThread]:
+    """Starts the fake Gemini API and the app against it, in this process.
+
+    The environment is set before `main` is imported, because the app reads it
+    at import time. The quota ledger is kept in memory and its daily limit off,
+    so a run neither reads nor spends the real ledger; the fake's own
+    `quota_per_model` is the way to simulate a spent day.
+    """
+    from loadtest.fake_gemini import FakeGemini, create_app
+
+    fake = ServerThread(create_app(FakeGemini(fake_config)), _free_port()).start_and_wait()
+
+    os.environ["GEMINI_BASE_URL"] = fake.url
+    os.environ.setdefault("GEMINI_API_KEY", "fake")
+    os.environ["GEMINI_QUOTA_LEDGER_PATH"] = ""
+    os.environ.setdefault("GEMINI_QUOTA_REQUESTS_PER_DAY", "0")
+    if unlimited:
+        os.environ["RATE_LIMIT_CHAT_PER_IP_PER_DAY"] = "0"
+        os.environ["RATE_LIMIT_CHAT_GLOBAL_PER_DAY"] = "0"
+
+    import main
+
+    app = ServerThread(main.app, _free_port()).start_and_wait()
+    return fake, app
@@ -1,20 +1,40 @@
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from contextlib import aclosing, asynccontextmanager
+from dataclasses import replace
 from hmac import compare_digest
 from dotenv import load_dotenv
-from gemini_helper import Answer, get_gemini_response
-from context import get_knowledge
-from selection import Selection, select
+from gemini_helper import (
+    Answer,
+    Deadline,
+    PREWARM_ENABLED,
+    client_pool,
+    get_gemini_response_async,
+    model_ranking,
+    prewarm,
+    profile_for,
+    stream_gemini_response,
+)
+from answer_cache import answer_cache, cache_key, single_flight
+from quota_ledger import quota_ledger
+import snapshot
+from context import corpus_watcher, get_knowledge
+from selection import Selection, select, warm_index
+from prompt import build_system_instruction, fit_to_budget
 from docs_helper import (
     read_markdown_file, PROFILE_DIR,
     get_all_projects, get_project_by_slug, get_featured_projects,
     get_all_writing, get_writing_by_slug
 )
 from rate_limit import chat_limiter, contact_limiter, enforce_rate_limit
+import metrics
 from pydantic import BaseModel, EmailStr, Field
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import json
 import os
+import time
 import datetime
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
@@ -249,11 +269,11 @@ def _answer_trace(answer: Answer, selection: Selection) -> Optional[Dict[str, ob
     of them went" are different facts. Rendering both as a bare number would
     collapse them into a claim of selectivity the second case cannot support.
 
-    `Knowledge.approx_tokens` is deliberately absent. It is a chars-over-four
-    estimate of the same quantity `prompt_tokens` reports exactly, and showing a
-    guess beside the measurement of the same thing only invites a reader to work
-    out which one to believe. It stays a server-side signal for deciding when
-    the corpus needs trimming.
+    `Knowledge.approx_tokens` is deliberately absent. It is an estimate -
+    calibrated, but an estimate - of the same quantity `prompt_tokens` reports
+    exactly, and showing a guess beside the measurement of the same thing only
+    invites a reader to work out which one to believe. It stays a server-side
+    signal for deciding when the corpus needs trimming.
     """
     if not answer.from_model:
         return None
@@ -261,11 +281,33 @@ def _answer_trace(answer: Answer, selection: Selection) -> Optional[Dict[str, ob
     return {
         "model": answer.model,
         "prompt_tokens": answer.prompt_tokens,
+        # How much of prompt_tokens was read from a cached prefix rather than
+        # processed afresh - the measured saving, not an estimate of one.
+        "cached_tokens": answer.cached_tokens,
         "thinking_tokens": answer.thinking_tokens,
         "output_tokens": answer.output_tokens,
         "total_tokens": answer.total_tokens,
         "finish_reason": answer.finish_reason,
         "latency_ms": answer.latency_ms,
+        # Only a streamed answer has a first token to time. A whole-reply call
+        # reports None rather than pretending its first token came with its
+        # last.
+        "first_token_ms": answer.first_token_ms,
+        # Whether a second model was raced against a slow first one. `model` is
+        # whichever answered first.
+        "hedged": answer.hedged,
+        # Replayed rather than generated for this request. The counts above
+        # then describe the call that first produced the answer, and this flag
+        # is what stops a reader taking them as this request's cost.
+        "from_cache": answer.from_cache,
+        # Shared from an identical request already in flight, on the same terms.
+        "coalesced": answer.coalesced,
+        # What was left of the visitor's deadline when the answer arrived.
+        "deadline_remaining_ms": answer.deadline_remaining_ms,
+        # The generation profile the call ran under, chosen from
+        # context_outcome. Read beside thinking_tokens and latency_ms, it is
+        # what shows a greeting costing less than a question about the work.
+        "profile": answer.profile,
         # Counts, not names. The kind of document is safe to state; which one an
         # answer leaned on is not knowable here. Pluralisation is left to the
         # frontend, which is where the site's copy lives.
@@ -275,6 +317,10 @@ def _answer_trace(answer: Answer, selection: Selection) -> Optional[Dict[str, ob
         ],
         "context_outcome": selection.outcome,
         "context_available": selection.available,
+        # Passages the selection chose that were dropped to fit the token
+        # budget. `context` already counts only what was sent; this says the
+        # set is short of what was chosen.
+        "context_trimmed": selection.trimmed,
     }
 
 
@@ -302,7 +348,110 @@ async def _deliver_collected_email(
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
-app = FastAPI()
+
+class Warmup:
+    """What startup has prepared so far, for /ready to report.
+
+    Everything the first chat would otherwise build for itself is built in the
+    lifespan, before uvicorn opens the port. The upstream prewarm is the one
+    step that runs after: it is a network call with a timeout of its own, and
+    holding the port shut for it would leave Cloud Run's startup probe unable to
+    tell a slow API from a hung process.
+    """
+
+    def __init__(self) -> None:
+        self.local_done = False
+        self.upstream_pending = False
+        self.timings_ms: Dict[str, int] = {}
+
+    @property
+    def ready(self) -> bool:
+        return self.local_done and not self.upstream_pending
+
+    def step(self, name: str, fn) -> None:
+        """Runs one warmup step, timed, and logs rather than raises if it fails.
+
+        A step that fails leaves its work to the first request, exactly as if
+        there were no warmup; it is no reason to keep the instance from serving.
+        """
+        started = time.perf_counter()
+        try:
+            fn()
+        except Exception:
+            logger.exception("Warmup step %s failed; the first request will build it", name)
+        self.timings_ms[name] = round((time.perf_counter() - started) * 1000)
+
+    def clear(self) -> None:
+        """For tests."""
+        self.__init__()
+
+
+warmup = Warmup()
+
+
+def _warm_local() -> None:
+    # Loading the snapshot and building from it are timed apart, so a start
+    # without one shows its cost under "corpus" rather than under "snapshot".
+    warmup.step("snapshot", snapshot.load)
+    warmup.step("corpus", get_knowledge)
+    warmup.step("index", lambda: warm_index(get_knowledge()))
+    warmup.step("instruction", lambda: build_system_instruction(get_knowledge()))
+    if GEMINI_API_KEY:
+        warmup.step("client", lambda: client_pool.get(GEMINI_API_KEY))
+    warmup.local_done = True
+    logger.info("Warmup finished in %s ms", warmup.timings_ms)
+
+
+async def _warm_upstream() -> None:
+    started = time.perf_counter()
+    try:
+        await prewarm(client_pool.get(GEMINI_API_KEY))
+        logger.info("Gemini connection prewarmed in %d ms", (time.perf_counter() - started) * 1000)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        # The first chat opens the connection itself, as it did before prewarming.
+        logger.warning("Gemini prewarm failed (%s); serving without it", type(e).__name__)
+    finally:
+        warmup.upstream_pending = False
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Warms the instance before it takes traffic, and closes the Gemini client on the way out.
+
+    The corpus (from the snapshot the image was built with), its selection
+    index, the system instruction for it and the pooled client are all built
+    here, so the first visitor does not pay for them. uvicorn accepts no
+    connections until this yields, so none of that can be raced by a request.
+    The client is closed here so a scaled-down instance does not leave its
+    sockets to the garbage collector.
+
+    The watcher is started here too, so requests stop checking the docs
+    directories themselves only while there is something else checking them.
+    """
+    warmup.clear()
+    _warm_local()
+    corpus_watcher.start()
+    upstream = None
+    if PREWARM_ENABLED and GEMINI_API_KEY:
+        warmup.upstream_pending = True
+        upstream = asyncio.create_task(_warm_upstream())
+    try:
+        yield
+    finally:
+        if upstream is not None:
+            upstream.cancel()
+        corpus_watcher.stop()
+        logger.info("Closing Gemini clients: %s", client_pool.stats())
+        logger.info("Model ranking at shutdown: %s", model_ranking.stats())
+        # The last second of spend, which would otherwise wait on a timer
+        # thread the process is about to lose.
+        quota_ledger.flush()
+        await client_pool.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Shared secret proving a request arrived through Cloudflare rather than by
 # calling the run.app URL directly.
@@ -328,7 +477,7 @@ ORIGIN_SHARED_SECRET = os.getenv("ORIGIN_SHARED_SECRET", "").strip()
 # Paths that must stay reachable without the header. Cloud Run's own health
 # probing and any uptime check call these, and they neither cost quota nor
 # disclose anything.
-_UNGUARDED_PATHS = frozenset({"/", "/health"})
+_UNGUARDED_PATHS = frozenset({"/", "/health", "/ready"})
 
 
 @app.middleware("http")
@@ -385,6 +534,28 @@ async def health_check():
         "timestamp": datetime.datetime.now().isoformat()
     }
 
+
+# Liveness and readiness are different questions. /health answers whether the
+# process is up, and is green from the first request it can serve; /ready
+# answers whether warmup has finished, and is what a startup probe should ask
+# before the instance is given a visitor.
+@app.get("/ready")
+async def readiness_check():
+    if not warmup.ready:
+        return JSONResponse(status_code=503, content={"ready": False})
+    return {"ready": True}
+
+@app.get("/metrics")
+async def get_metrics():
+    """Running totals of chat cost and latency, in the Prometheus text format.
+
+    Behind the edge secret like every path but the health check. The counts
+    are not secret in themselves, but which models answer, how often they are
+    skipped and how often visitors are refused is an operational picture of the
+    service, and nobody outside it needs one.
+    """
+    return PlainTextResponse(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.get("/api/chat/status")
 async def chat_status():
     """Whether the chat has anything to ground its answers in.
@@ -397,97 +568,200 @@ async def chat_status():
     knowledge = get_knowledge()
     return {"knowledge_ready": not knowledge.is_empty}
 
-@app.post("/chat-with-files")
-async def chat_with_files(chat_request: ChatRequest, request: Request):
-    # Shape only. The visitor's message is their words, not ours to retain in
-    # log storage.
-    logger.info(
-        "Chat request: %d chars, %d history messages",
-        len(chat_request.message),
-        len(chat_request.conversation_history or []),
-    )
-    try:
-        enforce_rate_limit(request, chat_limiter, "chat-with-files")
+async def _contact_reply(chat_request: ChatRequest) -> Optional[Dict[str, object]]:
+    """The reply when the message belongs to the contact flow, else None.
 
-        if not GEMINI_API_KEY:
-            raise HTTPException(
-                status_code=500,
-                detail="GEMINI_API_KEY not found in environment variables"
-            )
+    Shared by both chat routes, so a visitor leaving an address is handled the
+    same way whether or not their client streams. None of these replies reach
+    Gemini.
+    """
+    # A message that is nothing but an address: the visitor is leaving it,
+    # whatever the conversation was doing before.
+    message = chat_request.message.strip()
+    if _EMAIL_ONLY_RE.match(message):
+        try:
+            email = validate_email(message).email
+        except EmailNotValidError:
+            return _chat_reply(EMAIL_INVALID_MESSAGE, is_email_collection=True)
+
+        return await _deliver_collected_email(
+            email,
+            "Address submitted in chat with no accompanying message",
+            "direct email submission",
+        )
+
+    # An address inside a sentence only counts while the previous turns were
+    # asking for one, so a message that merely mentions an address is not
+    # mistaken for the visitor leaving theirs.
+    in_email_collection = any(
+        msg.is_email_collection and not msg.email_collected
+        for msg in (chat_request.conversation_history or [])[-2:]
+    )
 
-        # A message that is nothing but an address: the visitor is leaving it,
-        # whatever the conversation was doing before.
-        message = chat_request.message.strip()
-        if _EMAIL_ONLY_RE.match(message):
+    if in_email_collection:
+        email_match = _EMAIL_IN_TEXT_RE.search(chat_request.message)
+        if email_match:
             try:
-                email = validate_email(message).email
+                email = validate_email(email_match.group(0)).email
             except EmailNotValidError:
                 return _chat_reply(EMAIL_INVALID_MESSAGE, is_email_collection=True)
 
+            # Whatever they wrote around the address is the message itself.
+            message_content = chat_request.message.replace(email, '').strip()
+            if not message_content:
+                message_content = "Email provided during chat interaction"
+
             return await _deliver_collected_email(
-                email,
-                "Address submitted in chat with no accompanying message",
-                "direct email submission",
+                email, message_content, "chat-collected address"
             )
 
-        # An address inside a sentence only counts while the previous turns were
-        # asking for one, so a message that merely mentions an address is not
-        # mistaken for the visitor leaving theirs.
-        in_email_collection = any(
-            msg.is_email_collection and not msg.email_collected
-            for msg in (chat_request.conversation_history or [])[-2:]
-        )
+    # Asking for an address, rather than receiving one. Matching on intent
+    # phrases rather than the bare words "contact"/"email"/"newsletter" is what
+    # keeps a question *about* the work from being answered with a request for
+    # the visitor's address - see CONTACT_INTENT_PHRASES.
+    lowered = chat_request.message.lower()
+    should_collect_email = (
+        not any(msg.email_collected for msg in chat_request.conversation_history or []) and
+        any(phrase in lowered for phrase in CONTACT_INTENT_PHRASES) and
+        not _TOPIC_QUESTION.search(chat_request.message)
+    )
 
-        if in_email_collection:
-            email_match = _EMAIL_IN_TEXT_RE.search(chat_request.message)
-            if email_match:
-                try:
-                    email = validate_email(email_match.group(0)).email
-                except EmailNotValidError:
-                    return _chat_reply(EMAIL_INVALID_MESSAGE, is_email_collection=True)
-
-                # Whatever they wrote around the address is the message itself.
-                message_content = chat_request.message.replace(email, '').strip()
-                if not message_content:
-                    message_content = "Email provided during chat interaction"
-
-                return await _deliver_collected_email(
-                    email, message_content, "chat-collected address"
-                )
+    if should_collect_email:
+        return _chat_reply(EMAIL_REQUEST_MESSAGE, is_email_collection=True)
 
-        # Asking for an address, rather than receiving one. Matching on intent
-        # phrases rather than the bare words "contact"/"email"/"newsletter" is
-        # what keeps a question *about* the work from being answered with a
-        # request for the visitor's address - see CONTACT_INTENT_PHRASES.
-        lowered = chat_request.message.lower()
-        should_collect_email = (
-            not any(msg.email_collected for msg in chat_request.conversation_history or []) and
-            any(phrase in lowered for phrase in CONTACT_INTENT_PHRASES) and
-            not _TOPIC_QUESTION.search(chat_request.message)
-        )
+    return None
 
-        if should_collect_email:
-            return _chat_reply(EMAIL_REQUEST_MESSAGE, is_email_collection=True)
-
-        # Normal chat flow - answer from the cached corpus (profile, projects,
-        # writing).
-        #
-        # Which documents this question needs, rather than all of them. The
-        # selection is held in a local so the trace describes the request that
-        # was actually made - calling select() again for the trace could
-        # describe a different one if the corpus rebuilt in between.
-        turns = _to_model_turns(chat_request.conversation_history)
-        selection = select(
-            chat_request.message,
-            get_knowledge(),
-            history=[turn["content"] for turn in turns],
+
+def _select_for(
+    chat_request: ChatRequest, deadline: Deadline
+) -> Tuple[List[Dict[str, str]], Selection]:
+    """The replayed turns, and which documents this question needs.
+
+    Answer from the cached corpus (profile, projects, writing), but only the
+    part of it the question calls for. The selection is returned rather than
+    recomputed for the trace, so the trace describes the request that was
+    actually made - calling select() again could describe a different one if
+    the corpus rebuilt in between.
+    """
+    turns = _to_model_turns(chat_request.conversation_history)
+    selection = select(
+        chat_request.message,
+        get_knowledge(),
+        history=[turn["content"] for turn in turns],
+    )
+    metrics.selection_outcomes.inc(outcome=selection.outcome)
+    # Trimmed here rather than inside the Gemini call so that the trace, the
+    # answer cache key and the request all describe the same trimmed prompt.
+    knowledge, turns = fit_to_budget(
+        chat_request.message, selection.knowledge, turns, selection.scores
+    )
+    # Normally milliseconds. Logged because a corpus rebuild lands here, and
+    # it spends from the same deadline the model call does.
+    logger.info(
+        "Prompt ready after %.0fms; %.1fs of the deadline left",
+        deadline.elapsed() * 1000,
+        deadline.remaining(),
+    )
+    # The selection is handed on describing what is sent, not what was chosen,
+    # so the trace cannot report passages the budget took out.
+    trimmed = len(selection.knowledge.sections) - len(knowledge.sections)
+    return turns, replace(selection, knowledge=knowledge, trimmed=trimmed)
+
+
+def _log_chat_request(chat_request: ChatRequest) -> None:
+    # Shape only. The visitor's message is their words, not ours to retain in
+    # log storage.
+    logger.info(
+        "Chat request: %d chars, %d history messages",
+        len(chat_request.message),
+        len(chat_request.conversation_history or []),
+    )
+
+
+def _require_api_key() -> str:
+    if not GEMINI_API_KEY:
+        raise HTTPException(
+            status_code=500,
+            detail="GEMINI_API_KEY not found in environment variables"
         )
-        answer = get_gemini_response(
-            GEMINI_API_KEY,
+    return GEMINI_API_KEY
+
+
+def _replayed_answer(key) -> Optional[Answer]:
+    """A stored answer for this exact request, or None.
+
+    A replay makes no upstream call, so it hands back the global rate-limit slot
+    the request took: that window exists to cap Gemini spend, and this spent
+    none. The visitor's own window keeps the slot.
+    """
+    answer = answer_cache.get(key)
+    if answer is not None:
+        chat_limiter.release_global()
+        logger.info("Answered from cache (%s)", answer_cache.stats())
+    return answer
+
+
+def _shared_answer(answer: Answer) -> Answer:
+    """An answer another request's call produced, released on the same terms as a replay."""
+    chat_limiter.release_global()
+    logger.info("Answered from an identical request in flight (%s)", single_flight.stats())
+    return replace(answer, coalesced=True)
+
+
+async def _answer(
+    api_key: str,
+    chat_request: ChatRequest,
+    selection: Selection,
+    turns: List[Dict[str, str]],
+    deadline: Deadline,
+) -> Answer:
+    """The answer for this request, spending an upstream call only when nothing else can.
+
+    A replay from the cache first; then a call already in flight for the same
+    request; only then a call of its own.
+    """
+    key = cache_key(chat_request.message, selection, turns)
+    answer = _replayed_answer(key)
+    if answer is not None:
+        return answer
+
+    async def ask() -> Answer:
+        # Awaited rather than called: the answer takes seconds, and a blocking
+        # call here would hold the only event loop on the instance for all of
+        # them.
+        answer = await get_gemini_response_async(
+            api_key,
             chat_request.message,
             selection.knowledge,
             turns,
+            deadline=deadline,
+            profile=profile_for(selection.outcome),
         )
+        # Stored by the call rather than by whoever awaited it, so the answer
+        # is kept even if the visitor who asked first has gone.
+        answer_cache.put(key, answer)
+        return answer
+
+    answer, shared = await single_flight.run(key, ask)
+    return _shared_answer(answer) if shared else answer
+
+
+@app.post("/chat-with-files")
+async def chat_with_files(chat_request: ChatRequest, request: Request):
+    # Started before anything else, so everything the request does on its way
+    # to the model spends from the visitor's one budget.
+    deadline = Deadline.start()
+    _log_chat_request(chat_request)
+    try:
+        enforce_rate_limit(request, chat_limiter, "chat-with-files")
+        api_key = _require_api_key()
+
+        contact = await _contact_reply(chat_request)
+        if contact is not None:
+            return contact
+
+        turns, selection = _select_for(chat_request, deadline)
+        answer = await _answer(api_key, chat_request, selection, turns, deadline)
 
         return _chat_reply(answer.text, trace=_answer_trace(answer, selection))
 
@@ -497,6 +771,113 @@ async def chat_with_files(chat_request: ChatRequest, request: Request):
         logger.exception("Error in chat_with_files")
         raise HTTPException(status_code=500, detail=INTERNAL_ERROR_DETAIL)
 
+
+def _sse(event: str, payload: Dict[str, object]) -> str:
+    """One server-sent event. JSON keeps newlines in the text off the wire."""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+@app.post("/chat-with-files/stream")
+async def chat_with_files_stream(chat_request: ChatRequest, request: Request):
+    """The same chat, relayed as server-sent events while the model writes.
+
+    `delta` events carry text as it arrives. Exactly one `done` event ends the
+    stream, carrying the same reply `/chat-with-files` would have returned -
+    and its `response` is the authority. Text already streamed is provisional:
+    a MAX_TOKENS finish or a failure part-way through is only known at the end,
+    and the final reply replaces what was shown rather than leaving half an
+    answer on the screen.
+
+    Rate limiting, configuration and the contact flow are settled before the
+    stream opens, so they still answer with ordinary status codes.
+    """
+    deadline = Deadline.start()
+    _log_chat_request(chat_request)
+    try:
+        enforce_rate_limit(request, chat_limiter, "chat-with-files")
+        api_key = _require_api_key()
+
+        contact = await _contact_reply(chat_request)
+        turns, selection = (
+            (None, None) if contact is not None else _select_for(chat_request, deadline)
+        )
+    except HTTPException:
+        raise
+    except Exception:
+        logger.exception("Error in chat_with_files_stream")
+        raise HTTPException(status_code=500, detail=INTERNAL_ERROR_DETAIL)
+
+    async def events():
+        if contact is not None:
+            yield _sse("done", contact)
+            return
+
+        try:
+            key = cache_key(chat_request.message, selection, turns)
+            ready = _replayed_answer(key)
+            if ready is None:
+                shared = await single_flight.follow(key)
+                if shared is not None:
+                    ready = _shared_answer(shared)
+            if ready is not None:
+                yield _sse("delta", {"text": ready.text})
+                yield _sse(
+                    "done",
+                    _chat_reply(ready.text, trace=_answer_trace(ready, selection)),
+                )
+                return
+
+            # This stream leads its key, so an identical request arriving while
+            # it runs waits for its answer rather than opening a second one.
+            flight = single_flight.lead(key)
+        except Exception:
+            logger.exception("Error in chat_with_files_stream")
+            yield _sse("error", {"detail": INTERNAL_ERROR_DETAIL})
+            return
+
+        # `async for` does not close what it iterates, so a visitor going away
+        # (which cancels this generator) would otherwise leave the answer stream
+        # - and the upstream stream inside it - suspended until collected.
+        try:
+            async with aclosing(
+                stream_gemini_response(
+                    api_key,
+                    chat_request.message,
+                    selection.knowledge,
+                    turns,
+                    deadline=deadline,
+                    profile=profile_for(selection.outcome),
+                )
+            ) as items:
+                async for item in items:
+                    if isinstance(item, Answer):
+                        answer_cache.put(key, item)
+                        flight.set_result(item)
+                        yield _sse(
+                            "done",
+                            _chat_reply(item.text, trace=_answer_trace(item, selection)),
+                        )
+                    else:
+                        yield _sse("delta", {"text": item})
+        except Exception:
+            # Headers are already sent, so a status code is no longer available.
+            # The stream still ends in an event the client can act on.
+            logger.exception("Error in chat_with_files_stream")
+            yield _sse("error", {"detail": INTERNAL_ERROR_DETAIL})
+        finally:
+            # Ended without an answer - an error, or the visitor went away.
+            # Anyone waiting on this flight makes their own call instead.
+            if not flight.done():
+                flight.cancel()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # No caching, and no proxy buffering - a buffered stream arrives all at
+        # once, which is the empty bubble this endpoint exists to remove.
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.get("/api/content/{file_name}")
 async def get_content(file_name: str):
     try:
@@ -0,0 +1,283 @@
+"""Counters and histograms for what the chat costs and how long it takes, served at /metrics.
+
+Until now the only record of usage was the log line `_read_usage` writes per
+answer, and a log line is something to grep after an incident, not something
+to plan capacity from. This keeps the same numbers as running totals, in the
+Prometheus text format, so any scraper - Cloud Monitoring's managed collector,
+a local Prometheus, curl - can turn them into rates and percentiles.
+
+In-process and hand-rolled rather than prometheus_client: the whole of what is
+needed is a counter, a histogram and the text format, and the deploy image
+should not carry a dependency for that. Like the rate limiter's windows, the
+numbers are per process and start from zero on every deploy; a scraper's
+rate() is built for exactly that.
+
+Every metric the app exposes is declared at the bottom of this module, so the
+list of what is measured is in one place rather than wherever a call site
+happened to need one.
+"""
+
+from __future__ import annotations
+
+import math
+import threading
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, object]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines.extend(self._samples())
+        return lines
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """A running total that only goes up, per combination of label values."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: object) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: object) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> Iterable[str]:
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}"
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values = {}
+
+
+class Gauge(_Metric):
+    """A value that is set rather than accumulated, per combination of label values."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: object) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels: object) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> Iterable[str]:
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}"
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values = {}
+
+
+class Histogram(_Metric):
+    """Observations counted into fixed buckets, plus their sum and count."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: Sequence[float],
+        labelnames: Sequence[str] = (),
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # Per label set: [count per bucket (not cumulative)], sum, count.
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: object) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, totals = self._values.setdefault(key, ([0] * len(self.buckets), [0.0, 0]))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            totals[0] += value
+            totals[1] += 1
+
+    def count(self, **labels: object) -> int:
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return int(entry[1][1]) if entry else 0
+
+    def _samples(self) -> Iterable[str]:
+        for key, (counts, (total, count)) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = f'le="{_format_number(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_number(total)}"
+            yield f"{self.name}_count{labels} {int(count)}"
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values = {}
+
+
+class Registry:
+    """Every metric the process exposes, rendered together."""
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def clear(self) -> None:
+        """For tests."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.clear()
+
+
+registry = Registry()
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return registry.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return registry.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(
+    name: str, documentation: str, buckets: Sequence[float], labelnames: Sequence[str] = ()
+) -> Histogram:
+    return registry.register(Histogram(name, documentation, buckets, labelnames))
+
+
+# Upstream latency runs from under a second for a warm flash model to the
+# 45-second per-call timeout, and a request across the fallback chain to the
+# 70-second total deadline (gemini_helper's REQUEST_TIMEOUT_MS and
+# TOTAL_DEADLINE_SECONDS). The buckets double across that range, with both
+# limits as bounds of their own, so a timed-out call is counted at its timeout
+# rather than vanishing into +Inf beside the merely slow.
+LATENCY_BUCKETS_MS = (
+    250, 500, 1_000, 2_000, 4_000, 8_000, 16_000, 32_000, 45_000, 64_000, 70_000
+)
+
+# Prompts are the corpus plus history, thousands of tokens; thinking and output
+# are hundreds. One set of buckets covers both with room either side.
+TOKEN_BUCKETS = (50, 100, 250, 500, 1_000, 2_500, 5_000, 10_000, 25_000, 50_000)
+
+answer_latency_ms = histogram(
+    "chat_answer_latency_ms",
+    "Time from calling a model to its complete answer, per model and generation profile.",
+    LATENCY_BUCKETS_MS,
+    ("model", "profile"),
+)
+
+answer_tokens = histogram(
+    "chat_answer_tokens",
+    "Tokens per answered call as the API reported them, per model, generation profile and kind "
+    "(prompt, thinking, output).",
+    TOKEN_BUCKETS,
+    ("model", "profile", "kind"),
+)
+
+selection_outcomes = counter(
+    "chat_selection_outcomes_total",
+    "Chat requests by what document selection concluded.",
+    ("outcome",),
+)
+
+model_skips = counter(
+    "gemini_model_skips_total",
+    "Models passed over without a call, per model and reason (circuit_open, quota_spent).",
+    ("model", "reason"),
+)
+
+rate_limit_rejections = counter(
+    "rate_limit_rejections_total",
+    "Requests answered 429 by a rate limiter, per route and per window that refused "
+    "them: per_key for one visitor over their share, global for the instance's ceiling.",
+    ("route", "window"),
+)
+
+corpus_rebuilds = counter(
+    "corpus_rebuilds_total",
+    "Times the knowledge corpus was rebuilt from disk, by result (ok, empty, partial).",
+    ("result",),
+)
+
+corpus_version = gauge(
+    "corpus_version",
+    "Version of the corpus being served: 1 for the first build, one more for each rebuild "
+    "installed since. Matches the v<N> in the corpus log lines.",
+)
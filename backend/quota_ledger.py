@@ -0,0 +1,229 @@
+"""How much of each model's daily allowance this instance has already spent.
+
+Gemini's free tier grants about twenty requests per model per day (see the
+rate_limit docstring), and until now the first sign that a model had used them
+was a 429: a full round-trip spent learning that the answer is no. The ledger
+counts requests and tokens per model per quota day, and the fallback chain
+skips a model the ledger says is spent before calling it.
+
+A request is counted when it is sent, not when it is answered. Google counts
+every call that reaches it - one refused with a 429 or 503, one that lost a
+hedge race, one the deadline cut off - so a ledger counting only answers would
+read lowest on exactly the days that run closest to the limit. Tokens are added
+only when an answer reports them.
+
+The quota day is Google's, not ours: allowances reset at midnight Pacific time,
+so that is where the ledger rolls over.
+
+It persists to a small JSON file so a restarted process does not forget the
+morning's spend and walk every model into a 429 again. On Cloud Run that file
+lives on the instance's in-memory disk: it survives a crash-restart of the
+process, not a new instance. Each instance keeps its own ledger, so the count is
+a floor on what the project has spent - a ledger that says "spent" is right,
+one that says "not yet" may still meet a 429, and the circuit breaker handles
+that one the way it always has.
+
+Recording runs on the event loop, once per call, so it never touches the
+disk itself. It schedules a write for SAVE_DELAY_SECONDS later on a timer
+thread, and every answer recorded in the meantime rides on that one write.
+A crash can lose that last second of spend; the lifespan flushes on a clean
+shutdown.
+"""
+
+from __future__ import annotations
+
+import datetime
+import json
+import logging
+import os
+import tempfile
+import threading
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _int_env(name: str, default: int) -> int:
+    """Reads a non-negative int from the environment; 0 disables that limit."""
+    raw = os.getenv(name)
+    if raw is None:
+        return default
+    try:
+        value = int(raw)
+    except ValueError:
+        logger.warning("%s=%r is not an integer, using default %d", name, raw, default)
+        return default
+    return max(0, value)
+
+
+# Per model, per quota day. The request count is the free tier's binding limit;
+# the token count is off by default and there for a paid tier with a daily token
+# budget of its own.
+REQUESTS_PER_DAY = _int_env("GEMINI_QUOTA_REQUESTS_PER_DAY", 20)
+TOKENS_PER_DAY = _int_env("GEMINI_QUOTA_TOKENS_PER_DAY", 0)
+
+# Where the ledger is kept. Set to an empty string to keep it in memory only.
+LEDGER_PATH = os.getenv(
+    "GEMINI_QUOTA_LEDGER_PATH", os.path.join(tempfile.gettempdir(), "gemini-quota-ledger.json")
+)
+
+# How long a recorded answer waits for others to share its write.
+SAVE_DELAY_SECONDS = 1.0
+
+try:
+    from zoneinfo import ZoneInfo
+
+    _QUOTA_TZ: datetime.tzinfo = ZoneInfo("America/Los_Angeles")
+except Exception:
+    # A slim image without tzdata. Standard time is off by an hour for half
+    # the year, which moves the rollover and nothing else.
+    _QUOTA_TZ = datetime.timezone(datetime.timedelta(hours=-8))
+
+
+def _quota_day() -> str:
+    return datetime.datetime.now(_QUOTA_TZ).date().isoformat()
+
+
+class QuotaLedger:
+    """Requests and tokens per model for the current quota day, optionally on disk."""
+
+    def __init__(
+        self,
+        path: Optional[str] = LEDGER_PATH,
+        requests_per_day: int = REQUESTS_PER_DAY,
+        tokens_per_day: int = TOKENS_PER_DAY,
+        save_delay_seconds: float = SAVE_DELAY_SECONDS,
+    ):
+        self.path = path or None
+        self.requests_per_day = requests_per_day
+        self.tokens_per_day = tokens_per_day
+        self.save_delay_seconds = save_delay_seconds
+        self._day = _quota_day()
+        self._models: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+        # Held across a whole write, so two flushes cannot interleave in the
+        # temporary file or land out of order. Never taken under `_lock`.
+        self._write_lock = threading.Lock()
+        self._pending: Optional[threading.Timer] = None
+        self._load()
+
+    def _load(self) -> None:
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                stored = json.load(f)
+            day, models = stored["day"], stored["models"]
+        except (OSError, ValueError, KeyError, TypeError):
+            # A torn or foreign file costs one day's memory, not startup.
+            logger.warning("Ignoring unreadable quota ledger at %s", self.path, exc_info=True)
+            return
+        if day != self._day or not isinstance(models, dict):
+            return
+        for model_id, counts in models.items():
+            # Entry by entry, so one hand-edited or half-written model costs
+            # that model's count and not the rest.
+            try:
+                if not isinstance(counts, dict):
+                    raise TypeError(f"expected an object, got {type(counts).__name__}")
+                self._models[model_id] = {
+                    "requests": int(counts.get("requests", 0)),
+                    "tokens": int(counts.get("tokens", 0)),
+                }
+            except (TypeError, ValueError):
+                logger.warning("Ignoring unreadable quota ledger entry for %s: %r", model_id, counts)
+        logger.info("Quota ledger restored for %s: %s", day, self._models)
+
+    def _schedule_save(self) -> None:
+        """Arranges a write unless one is already due. Called holding `_lock`."""
+        if self.path is None or self._pending is not None:
+            return
+        self._pending = threading.Timer(self.save_delay_seconds, self.flush)
+        self._pending.daemon = True
+        self._pending.start()
+
+    def flush(self) -> None:
+        """Writes the ledger now if a write is due. Blocks on disk: not for the event loop."""
+        with self._write_lock:
+            with self._lock:
+                pending, self._pending = self._pending, None
+                if pending is None:
+                    return
+                pending.cancel()
+                stored = {"day": self._day, "models": {m: dict(c) for m, c in self._models.items()}}
+            # Written beside the target and renamed over it, so a crash mid-write
+            # leaves the previous ledger rather than half of this one.
+            tmp = f"{self.path}.tmp"
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(stored, f)
+                os.replace(tmp, self.path)
+            except OSError:
+                logger.warning("Could not write quota ledger to %s", self.path, exc_info=True)
+
+    def _roll_over(self) -> None:
+        today = _quota_day()
+        if today != self._day:
+            logger.info("Quota day %s over: %s", self._day, self._models)
+            self._day = today
+            self._models = {}
+
+    def record_request(self, model_id: str) -> None:
+        """Counts one call sent upstream, however it turns out."""
+        self._add(model_id, requests=1, tokens=0)
+
+    def record_tokens(self, model_id: str, total_tokens: Optional[int]) -> None:
+        """Adds what an answer reported using. A count the API did not report adds nothing."""
+        if total_tokens:
+            self._add(model_id, requests=0, tokens=total_tokens)
+
+    def record(self, model_id: str, total_tokens: Optional[int]) -> None:
+        """Counts one call and the tokens it reported."""
+        self._add(model_id, requests=1, tokens=total_tokens or 0)
+
+    def _add(self, model_id: str, requests: int, tokens: int) -> None:
+        with self._lock:
+            self._roll_over()
+            counts = self._models.setdefault(model_id, {"requests": 0, "tokens": 0})
+            was_spent = self._spent(model_id)
+            counts["requests"] += requests
+            counts["tokens"] += tokens
+            self._schedule_save()
+            if self._spent(model_id) and not was_spent:
+                logger.warning(
+                    "Model %s has spent its quota for %s: %s", model_id, self._day, counts
+                )
+
+    def _spent(self, model_id: str) -> bool:
+        counts = self._models.get(model_id)
+        if counts is None:
+            return False
+        if self.requests_per_day and counts["requests"] >= self.requests_per_day:
+            return True
+        return bool(self.tokens_per_day and counts["tokens"] >= self.tokens_per_day)
+
+    def is_spent(self, model_id: str) -> bool:
+        """Whether calling `model_id` today can only be refused."""
+        with self._lock:
+            self._roll_over()
+            return self._spent(model_id)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            self._roll_over()
+            return {
+                "day": self._day,
+                "models": {m: dict(c, spent=self._spent(m)) for m, c in self._models.items()},
+            }
+
+    def clear(self) -> None:
+        """For tests."""
+        with self._lock:
+            if self._pending is not None:
+                self._pending.cancel()
+                self._pending = None
+            self._day = _quota_day()
+            self._models = {}
+
+
+quota_ledger = QuotaLedger()
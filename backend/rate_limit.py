@@ -40,10 +40,12 @@ import os
 import threading
 import time
 from collections import deque
-from typing import Deque, Dict, Tuple
+from typing import Deque, Dict, Optional, Tuple
 
 from fastapi import Request
 
+import metrics
+
 logger = logging.getLogger(__name__)
 
 WINDOW_SECONDS = 60
@@ -52,6 +54,13 @@ WINDOW_SECONDS = 60
 # memory so that spraying unique source addresses cannot exhaust the instance.
 MAX_TRACKED_KEYS = 10_000
 
+# Which window refused a request, as the rejection metric reports it. The
+# difference matters to whoever reads it: per_key rejections are one visitor
+# over their share, global ones are the instance at its cost ceiling turning
+# everyone away.
+PER_KEY_WINDOW = "per_key"
+GLOBAL_WINDOW = "global"
+
 
 def _int_env(name: str, default: int) -> int:
     """Reads a non-negative int from the environment; 0 disables that limit."""
@@ -96,6 +105,14 @@ class SlidingWindowLimiter:
 
     def check(self, key: str) -> Tuple[bool, int]:
         """Records a request. Returns (allowed, retry_after_seconds)."""
+        window, retry_after = self.check_window(key)
+        return window is None, retry_after
+
+    def check_window(self, key: str) -> Tuple[Optional[str], int]:
+        """Records a request. Returns (the window that refused it, retry_after_seconds).
+
+        The window is PER_KEY_WINDOW or GLOBAL_WINDOW, or None when allowed.
+        """
         now = time.monotonic()
 
         with self._lock:
@@ -103,7 +120,7 @@ class SlidingWindowLimiter:
                 self._prune(self._global, now)
                 if len(self._global) >= self.global_limit:
                     retry_after = int(self.window_seconds - (now - self._global[0])) + 1
-                    return False, max(1, retry_after)
+                    return GLOBAL_WINDOW, max(1, retry_after)
 
             if self.per_key_limit:
                 window = self._keys.get(key)
@@ -133,13 +150,25 @@ class SlidingWindowLimiter:
                     self._prune(window, now)
                     if len(window) >= self.per_key_limit:
                         retry_after = int(self.window_seconds - (now - window[0])) + 1
-                        return False, max(1, retry_after)
+                        return PER_KEY_WINDOW, max(1, retry_after)
                     window.append(now)
 
             if self.global_limit:
                 self._global.append(now)
 
-        return True, 0
+        return None, 0
+
+    def release_global(self) -> None:
+        """Hands back the most recent global slot, for a request that cost nothing upstream.
+
+        The global window is the cost guard, so a request answered without an
+        upstream call - a replayed answer - should not count against it. The
+        per-client window is untouched: it limits how much one visitor may ask,
+        whatever answering them costs.
+        """
+        with self._lock:
+            if self._global:
+                self._global.pop()
 
 
 def client_key(request: Request) -> str:
@@ -190,11 +219,14 @@ def enforce_rate_limit(request: Request, limiter: "SlidingWindowLimiter", label:
     from fastapi import HTTPException
 
     key = client_key(request)
-    allowed, retry_after = limiter.check(key)
-    if allowed:
+    window, retry_after = limiter.check_window(key)
+    if window is None:
         return
 
-    logger.warning("Rate limit hit on %s for %s (retry in %ss)", label, key, retry_after)
+    logger.warning(
+        "Rate limit hit on %s (%s window) for %s (retry in %ss)", label, window, key, retry_after
+    )
+    metrics.rate_limit_rejections.inc(route=label, window=window)
     raise HTTPException(
         status_code=429,
         detail="Too many requests. Please wait a moment before trying again.",
@@ -46,6 +46,7 @@ import re
 from dataclasses import dataclass
 from typing import Dict, FrozenSet, Iterable, Set, Tuple
 
+import context
 from context import Knowledge, Section
 
 logger = logging.getLogger(__name__)
@@ -166,22 +167,39 @@ class _Index:
     weights: Dict[str, float]
 
 
-# (sources, index) for the corpus this was last built from. The corpus is itself
-# cached against file mtimes, so this rebuilds only when that one does.
+# (sources, index) for a corpus that is not the installed one - a test's, a
+# benchmark's - or one the startup snapshot supplied ahead of the build. The
+# served corpus keeps its index with it; see `_index_for`.
 _index_cache: Tuple[Tuple[str, ...], _Index] | None = None
 
+# The name the index is registered under with context's corpus holder.
+INDEX = "selection.index"
+
+
+def _indexed_text(section: Section) -> str:
+    """What a passage is matched on: its own heading and text.
+
+    Only a document's lead carries the document's title. Giving the title to
+    every passage would let a question that names a post match all of it
+    equally, and send the whole post to answer about one paragraph - the cost
+    splitting documents exists to avoid. A question naming only the document
+    still reaches it, through the lead.
+    """
+    if section.heading:
+        return f"{section.heading}\n{section.body}"
+    return f"{section.label}\n{section.body}"
+
 
 def _build_index(knowledge: Knowledge) -> _Index:
-    """Weighs every term by how many documents it fails to distinguish.
+    """Weighs every term by how many passages it fails to distinguish.
 
-    A term in all ten documents scores zero - it cannot separate them, so
+    A term in every passage scores zero - it cannot separate them, so
     matching it is not evidence of anything. A term in one scores highest. This
     is the whole reason no keyword list is needed: the corpus states its own
     distinctive vocabulary, and restates it whenever a document is added.
     """
     per_section = tuple(
-        (section.label, frozenset(_terms(f"{section.label}\n{section.body}")))
-        for section in knowledge.sections
+        (section.label, frozenset(_terms(_indexed_text(section)))) for section in knowledge.sections
     )
 
     total = len(per_section)
@@ -195,12 +213,37 @@ def _build_index(knowledge: Knowledge) -> _Index:
     return _Index(terms=per_section, weights=weights)
 
 
+def _derive_index(knowledge: Knowledge) -> _Index:
+    seeded = _index_cache
+    if seeded is not None and seeded[0] == knowledge.sources:
+        return seeded[1]
+    return _build_index(knowledge)
+
+
+context.register_derived(INDEX, _derive_index)
+
+
+def warm_index(knowledge: Knowledge) -> None:
+    """Has the term index for `knowledge` ready before its first question."""
+    _index_for(knowledge)
+
+
 def _index_for(knowledge: Knowledge) -> _Index:
+    """The index for `knowledge`: the installed corpus's own, or one built here.
+
+    The installed corpus carries its index, built before the corpus was swapped
+    in, so the two cannot be read out of step and no request builds it.
+    """
     global _index_cache
 
+    corpus = context.corpus_holder.current
+    if corpus is not None and corpus.knowledge is knowledge:
+        return corpus.derived(INDEX)
+
     sources = knowledge.sources
-    if _index_cache is not None and _index_cache[0] == sources:
-        return _index_cache[1]
+    cached = _index_cache
+    if cached is not None and cached[0] == sources:
+        return cached[1]
 
     index = _build_index(knowledge)
     _index_cache = (sources, index)
@@ -228,7 +271,16 @@ class Selection:
 
     knowledge: Knowledge
     outcome: str
+    # Documents in the whole corpus, not passages: what "3 of 10" counts.
     available: int
+    # (label, score) for every passage that was scored, so that trimming a
+    # request to its token budget can drop the weakest match first. Empty when
+    # nothing was scored - a greeting, or no corpus.
+    scores: Tuple[Tuple[str, float], ...] = ()
+    # Passages chosen here that prompt.fit_to_budget then dropped to make the
+    # request fit. `knowledge` is what was sent; a non-zero count is what stops
+    # an unfocused outcome being reported as "all of them went".
+    trimmed: int = 0
 
     @property
     def narrowed(self) -> bool:
@@ -269,7 +321,7 @@ def select(
     if knowledge.is_empty:
         return Selection(knowledge=knowledge, outcome=NO_CORPUS, available=0)
 
-    available = len(knowledge.sections)
+    available = len(knowledge.documents)
     index = _index_for(knowledge)
     asked = _terms(question)
 
@@ -298,38 +350,49 @@ def select(
 
     # A subject this corpus has no distinctive vocabulary for. There is no basis
     # on which to exclude anything, so nothing is excluded.
+    ranked = tuple(scores.items())
     if best <= 0:
         logger.info("Selection: no distinguishing terms, sending all %d documents", available)
-        return Selection(knowledge=knowledge, outcome=UNFOCUSED, available=available)
+        return Selection(knowledge=knowledge, outcome=UNFOCUSED, available=available, scores=ranked)
 
     # The weight of everything asked that this corpus recognises at all, which
     # is what a document's score is a share of.
     asked_weight = sum(index.weights.get(term, 0.0) for term in asked)
     threshold = asked_weight * QUERY_COVERAGE
 
-    chosen = tuple(
-        section
+    matched = {
+        section.label
         for section in knowledge.sections
         # The best match is kept whatever its share. Spread a question's terms
-        # across enough documents and every one of them falls under the
+        # across enough passages and every one of them falls under the
         # threshold, which would drop the closest thing to an answer the corpus
-        # has - the one document guaranteed to be worth sending.
+        # has - the one passage guaranteed to be worth sending.
+        if scores[section.label] >= threshold or scores[section.label] == best
+    }
+    # A passage arrives with its document's lead: "## How we fixed it" means
+    # little to the model without the opening that says what was broken.
+    documents = {section.document for section in knowledge.sections if section.label in matched}
+    chosen = tuple(
+        section
+        for section in knowledge.sections
         if section.is_profile
-        or scores[section.label] >= threshold
-        or scores[section.label] == best
+        or section.label in matched
+        or (not section.heading and section.label in documents)
     )
 
-    if len(chosen) == available:
-        return Selection(knowledge=knowledge, outcome=UNFOCUSED, available=available)
+    if len(chosen) == len(knowledge.sections):
+        return Selection(knowledge=knowledge, outcome=UNFOCUSED, available=available, scores=ranked)
 
     selected = Knowledge(sections=chosen)
     logger.info(
-        "Selection: %d of %d documents (%s)",
+        "Selection: %d of %d passages from %d of %d documents (%s)",
         len(chosen),
+        len(knowledge.sections),
+        len(selected.documents),
         available,
         ", ".join(s.label for s in chosen),
     )
-    return Selection(knowledge=selected, outcome=NARROWED, available=available)
+    return Selection(knowledge=selected, outcome=NARROWED, available=available, scores=ranked)
 
 
 def _reset_cache() -> None:
@@ -0,0 +1,195 @@
+"""The corpus compiled once at image build time, so a cold start does not parse it.
+
+Every new Cloud Run instance used to read the whole docs tree before it could
+answer its first chat: pypdf extracting the resume page by page, the project
+and writing metadata parsers over every file, then the selection index over the
+result. None of that can differ between two instances of one image - the docs
+ship inside it - so the Dockerfile runs `python snapshot.py` after copying them
+in, and the instance loads the result instead.
+
+A snapshot is a head start, never a source of truth. What it primes is checked
+against the files actually on disk, the same way each cache is already checked
+against a rebuild:
+
+- context's per-file parse cache is keyed by (path, size, mtime_ns), so a
+  snapshot entry whose file has since changed is simply never looked up, and
+  that one file is parsed live;
+- docs_helper's listings are kept with the fingerprint of their directory and
+  reparsed when it differs;
+- the selection index is seeded only when the whole corpus fingerprint matches,
+  and taken by the corpus only if the sources it was built for are the ones
+  the build produced.
+
+A missing, unreadable or older-format snapshot means the live parse, exactly as
+before there were snapshots.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Sequence, Tuple
+
+import context
+import docs_helper
+import selection
+from context import Section
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever the layout below changes, so an image never loads a snapshot
+# written by different code.
+SNAPSHOT_VERSION = 2
+
+# Empty disables loading, for checking what a cold start costs without one.
+SNAPSHOT_PATH = os.getenv(
+    "CORPUS_SNAPSHOT_PATH", os.path.join(docs_helper.BASE_DIR, "corpus_snapshot.json")
+)
+
+# The directories whose parsed listings the API serves, by the name they are
+# stored under.
+_LISTINGS = (
+    ("projects", lambda: docs_helper.PROJECTS_DIR, docs_helper.parse_all_projects),
+    ("writing", lambda: docs_helper.WRITING_DIR, docs_helper.parse_all_writing),
+)
+
+FileKey = Tuple[str, int, int]
+
+
+# Paths are stored relative to the backend directory, so a snapshot compiled in
+# a checkout or an image means the same files wherever that tree is mounted.
+def _relative(key: Sequence) -> List:
+    return [os.path.relpath(key[0], docs_helper.BASE_DIR), key[1], key[2]]
+
+
+def _absolute(entry: Sequence) -> FileKey:
+    return (os.path.normpath(os.path.join(docs_helper.BASE_DIR, entry[0])), int(entry[1]), int(entry[2]))
+
+
+def compile_snapshot() -> Dict[str, Any]:
+    """Parses the docs tree from scratch into the snapshot's JSON layout."""
+    context._parsed = {}
+    fingerprint = context._fingerprint()
+    knowledge = context._build()
+    index = selection._build_index(knowledge)
+
+    return {
+        "version": SNAPSHOT_VERSION,
+        "compiled_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "fingerprint": [_relative(key) for key in fingerprint],
+        "files": [
+            {
+                "key": _relative(key),
+                "sections": [[section.label, section.body] for section in parsed.sections],
+                "order": list(parsed.order),
+            }
+            for key, parsed in context._parsed.items()
+        ],
+        "listings": {
+            name: {
+                "fingerprint": [_relative(key) for key in docs_helper.directory_fingerprint(directory())],
+                "entries": parse(),
+            }
+            for name, directory, parse in _LISTINGS
+        },
+        "index": {
+            "sources": list(knowledge.sources),
+            "terms": [[label, sorted(terms)] for label, terms in index.terms],
+            "weights": index.weights,
+        },
+    }
+
+
+def write(path: str = SNAPSHOT_PATH) -> Dict[str, Any]:
+    snapshot = compile_snapshot()
+    # Written beside the target and renamed over it, so a build interrupted
+    # mid-write leaves no half a snapshot for an instance to trip over.
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return snapshot
+
+
+def load(path: str = SNAPSHOT_PATH) -> bool:
+    """Primes the corpus caches from `path`. True if it matched the files on disk.
+
+    Nothing is built here: the next `context.get_knowledge()` builds the corpus
+    from what was primed, so startup can time loading the snapshot and building
+    from it (or, without one, parsing everything) as the separate steps they are.
+    A partial match still helps: every file the snapshot parsed and that has
+    not changed since is reused, and only the rest are read.
+    """
+    if not path or not os.path.isfile(path):
+        logger.info("No corpus snapshot at %s; parsing the docs tree live", path or "(disabled)")
+        return False
+    try:
+        with open(path, encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        logger.exception("Corpus snapshot %s is unreadable; parsing the docs tree live", path)
+        return False
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        logger.warning(
+            "Corpus snapshot %s is format %r, this code reads %d; parsing the docs tree live",
+            path,
+            snapshot.get("version"),
+            SNAPSHOT_VERSION,
+        )
+        return False
+
+    context._parsed = {
+        _absolute(entry["key"]): context._Parsed(
+            tuple(Section(label=label, body=body) for label, body in entry["sections"]),
+            order=tuple(entry["order"]),
+        )
+        for entry in snapshot["files"]
+    }
+    for name, directory, _ in _LISTINGS:
+        listing = snapshot["listings"][name]
+        docs_helper.prime_listing(
+            directory(), tuple(_absolute(key) for key in listing["fingerprint"]), listing["entries"]
+        )
+
+    matched = tuple(_absolute(key) for key in snapshot["fingerprint"]) == context._fingerprint()
+    index = snapshot["index"]
+    if matched:
+        # Seeded before the build, so the corpus installed by the next
+        # get_knowledge takes this index instead of computing its own.
+        selection._index_cache = (
+            tuple(index["sources"]),
+            selection._Index(
+                terms=tuple((label, frozenset(terms)) for label, terms in index["terms"]),
+                weights=dict(index["weights"]),
+            ),
+        )
+
+    if matched:
+        logger.info("Corpus loaded from the snapshot compiled %s", snapshot.get("compiled_at"))
+    else:
+        logger.warning(
+            "Corpus snapshot %s no longer matches the docs tree; changed files will be parsed live",
+            path,
+        )
+    return matched
+
+
+def main(argv: Sequence[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Compile the chat corpus into a snapshot file.")
+    parser.add_argument("--out", default=SNAPSHOT_PATH, help="where to write it (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    snapshot = write(args.out)
+    print(
+        f"Wrote {args.out}: {len(snapshot['files'])} documents, "
+        f"{sum(len(l['entries']) for l in snapshot['listings'].values())} listed entries, "
+        f"{len(snapshot['index']['weights'])} index terms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,36 @@
 """Shared fixtures and stubs for the backend tests.
 
-Two pieces of module-level mutable state leak between tests unless they are
-reset: gemini_helper's model cooldown table and context's corpus cache. A test
-that exhausts the fallback chain leaves every model marked unusable, and the
-next test in the same process gets BUSY_MESSAGE for a request that should have
-reached the model - a failure with nothing to do with the behaviour under test,
-in a file that never mentions cooldowns.
+Several pieces of module-level mutable state leak between tests unless they are
+reset: gemini_helper's circuit breakers, model ranking, client pool, latency
+samples and cached-content registry, the quota ledger, the answer cache and its
+in-flight table, context's corpus cache and token estimator, and the metrics
+registry. A test that exhausts the fallback chain leaves every model marked
+unusable, and the next test in the same process gets BUSY_MESSAGE for a
+request that should have reached the model - a failure with nothing to do with
+the behaviour under test, in a file that never mentions circuit breakers.
 
 Resetting centrally rather than in the file that introduced the state is the
 point: the next person to add a test should not have to know this exists.
 """
 
+import inspect
+from types import SimpleNamespace
+
 import pytest
 from google.genai import errors as genai_errors
 
+import answer_cache
 import context
 import gemini_helper
+import metrics
+import quota_ledger
 
 
 class ApiError(genai_errors.APIError):
     """An APIError carrying a status code, without an HTTP response object.
 
-    Built by setting the one attribute the code under test reads, rather than by
+    Built by setting the attributes the code under test reads - the status
+    code, and for Retry-After tests the body and headers - rather than by
     calling the SDK's constructor. The constructor form - `APIError(code, {...})`
     - depends on the shape of the SDK's own __init__, which on some versions
     parses the dict as an HTTP response and raises `AttributeError: 'dict'
@@ -29,8 +38,10 @@ class ApiError(genai_errors.APIError):
     assertion. A test that fails for the wrong reason protects nothing.
     """
 
-    def __init__(self, code: int, message: str = "test"):
+    def __init__(self, code: int, message: str = "test", details=None, headers=None):
         self.code = code
+        self.details = details
+        self.response = None if headers is None else SimpleNamespace(headers=headers)
         self.message = message
         Exception.__init__(self, f"{code} {message}")
 
@@ -48,9 +59,11 @@ class StubModels:
         self.outcomes = list(outcomes)
         self.repeat = repeat
         self.tried = []
+        self.configs = []
 
     def generate_content(self, model, contents, config):
         self.tried.append(model)
+        self.configs.append(config)
         outcome = self.outcomes[0] if self.repeat else self.outcomes.pop(0)
         if isinstance(outcome, Exception):
             raise outcome
@@ -59,11 +72,173 @@ class StubModels:
         return outcome
 
 
+class StubAsyncModels:
+    """`client.aio.models` over the same outcomes and the same `tried` list.
+
+    An outcome callable may be a coroutine function, which is how a test makes
+    an upstream call take real (event-loop) time without blocking the loop.
+    """
+
+    def __init__(self, models: StubModels):
+        self._models = models
+
+    async def generate_content(self, model, contents, config):
+        result = self._models.generate_content(model, contents, config)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    async def generate_content_stream(self, model, contents, config):
+        """The same outcome, relayed as chunks.
+
+        A list or tuple outcome is the chunks in order, and an exception among
+        them is raised at that point in the stream - which is how a test fails
+        a model after its first delta. Anything else is a single chunk.
+        """
+        result = await self.generate_content(model, contents, config)
+        chunks = list(result) if isinstance(result, (list, tuple)) else [result]
+
+        async def relay():
+            for chunk in chunks:
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+
+        return relay()
+
+
+class StubCaches:
+    """A local stand-in for `client.aio.caches`.
+
+    Records what was created and deleted, and refuses every create when given
+    an exception - the shape of the free tier, or a model without caching.
+    """
+
+    def __init__(self):
+        self.created = []
+        self.deleted = []
+        self.refuse_with = None
+
+    async def create(self, model, config):
+        if self.refuse_with is not None:
+            raise self.refuse_with
+        name = f"cachedContents/{len(self.created) + 1}"
+        self.created.append((model, config))
+        return type("CachedContent", (), {"name": name})()
+
+    async def delete(self, name):
+        self.deleted.append(name)
+
+
+class StubAsyncClient:
+    def __init__(self, models: StubModels):
+        self.models = StubAsyncModels(models)
+        self.caches = StubCaches()
+
+    async def aclose(self):
+        pass
+
+
+class StubClient:
+    """Stands in for `genai.Client`: the two model surfaces and the two closes."""
+
+    def __init__(self, models: StubModels):
+        self.models = models
+        self.aio = StubAsyncClient(models)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def reset_circuit_breakers():
+    gemini_helper.circuit_breakers.clear()
+    yield
+    gemini_helper.circuit_breakers.clear()
+
+
+@pytest.fixture(autouse=True)
+def reset_quota_ledger(monkeypatch):
+    """In memory only, and empty: a test must neither read nor write a real ledger."""
+    monkeypatch.setattr(quota_ledger.quota_ledger, "path", None)
+    quota_ledger.quota_ledger.clear()
+    yield
+    quota_ledger.quota_ledger.clear()
+
+
 @pytest.fixture(autouse=True)
-def reset_model_cooldowns():
-    gemini_helper._model_cooldowns.clear()
+def reset_token_estimator():
+    """Stub answers report token counts for prompts they never saw."""
+    context.token_estimator.clear()
+    yield
+    context.token_estimator.clear()
+
+
+@pytest.fixture(autouse=True)
+def reset_model_ranking(monkeypatch):
+    """The learned order would otherwise carry one test's failures into the next.
+
+    Exploration is off unless a test turns it on: at its default rate one
+    request in twenty leads with a demoted model, which is one run in twenty
+    failing any test that asserts the order.
+    """
+    gemini_helper.model_ranking.clear()
+    monkeypatch.setattr(gemini_helper.model_ranking, "exploration_rate", 0.0)
+    yield
+    gemini_helper.model_ranking.clear()
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    """Counters are process-wide and only go up; each test starts them at zero."""
+    metrics.registry.clear()
+    yield
+    metrics.registry.clear()
+
+
+@pytest.fixture(autouse=True)
+def reset_corpus_watcher():
+    """A watcher thread left running would put every later test in watched mode."""
+    context.corpus_watcher.clear()
+    yield
+    context.corpus_watcher.clear()
+
+
+@pytest.fixture(autouse=True)
+def reset_latency_samples():
+    """Hedging decides from observed latencies, so one test's would time another's."""
+    gemini_helper._latency_samples.clear()
+    yield
+    gemini_helper._latency_samples.clear()
+
+
+@pytest.fixture(autouse=True)
+def reset_context_cache():
+    gemini_helper.context_cache._reset()
+    yield
+    gemini_helper.context_cache._reset()
+
+
+@pytest.fixture(autouse=True)
+def reset_answer_cache():
+    """A replayed answer would stand in for whatever the next test's stub says."""
+    answer_cache.answer_cache.clear()
+    answer_cache.single_flight.clear()
+    yield
+    answer_cache.answer_cache.clear()
+    answer_cache.single_flight.clear()
+
+
+@pytest.fixture(autouse=True)
+def reset_client_pool():
+    """A pooled client outlives the test that built it, stub and all.
+
+    Without this the first test to install a stub would answer for every later
+    one that expected a different outcome.
+    """
+    gemini_helper.client_pool._reset()
     yield
-    gemini_helper._model_cooldowns.clear()
+    gemini_helper.client_pool._reset()
 
 
 @pytest.fixture
@@ -83,7 +258,9 @@ def stub_gemini(monkeypatch):
 
     def install(*outcomes, repeat: bool = False) -> StubModels:
         models = StubModels(outcomes, repeat)
-        client = type("StubClient", (), {"models": models})()
+        client = StubClient(models)
+        # The caching stand-in, reachable from the one object tests hold.
+        models.caches = client.aio.caches
         monkeypatch.setattr(gemini_helper.genai, "Client", lambda **kwargs: client)
         return models
 
@@ -99,17 +276,21 @@ def stub_knowledge(monkeypatch):
     real corpus would only couple them to prompt.py.
     """
     monkeypatch.setattr(gemini_helper, "build_system_instruction", lambda k: "sys")
-    monkeypatch.setattr(gemini_helper, "build_contents", lambda q, h: ["q"])
+    monkeypatch.setattr(
+        gemini_helper, "build_contents", lambda q, h: [{"role": "user", "parts": [{"text": q}]}]
+    )
     return type("Knowledge", (), {"is_empty": False})()
 
 
 @pytest.fixture
 def fresh_corpus_cache():
-    """Empties context's module-level corpus cache around a test that rebuilds it.
+    """Empties context's module-level corpus caches around a test that rebuilds them.
 
     Both the cache the test starts from and the one it leaves behind would
     otherwise be someone else's problem.
     """
-    context._cache = None
+    context.corpus_holder.clear()
+    context._parsed = {}
     yield
-    context._cache = None
+    context.corpus_holder.clear()
+    context._parsed = {}
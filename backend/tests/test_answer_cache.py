@@ -0,0 +1,269 @@
+"""Replaying an answer instead of asking Gemini again.
+
+A hit is worth a unit of a daily quota of about twenty, so the cache is worth
+having. What these pin is that it only ever replays what it should: the same
+question against the same documents and the same conversation, a complete
+answer rather than a failure, and a reply that says it was replayed rather than
+presenting an old call's counts as this request's.
+"""
+
+import asyncio
+
+import httpx
+import pytest
+from starlette.testclient import TestClient
+
+import answer_cache
+import context
+import main
+import selection
+from answer_cache import AnswerCache, SingleFlight, cache_key
+from gemini_helper import BUSY_MESSAGE, TRUNCATED_RESPONSE_MESSAGE, Answer
+from rate_limit import SlidingWindowLimiter
+
+
+def _selection(question="what did you build at moonsite?"):
+    return selection.select(question, context.get_knowledge())
+
+
+def _answer(text="an answer", **kwargs):
+    return Answer(text=text, model="gemini-flash-latest", finish_reason="STOP", **kwargs)
+
+
+def test_case_and_punctuation_do_not_make_a_new_question():
+    chosen = _selection()
+
+    assert cache_key("What did you build at Moonsite?", chosen) == cache_key(
+        "what did you build at  moonsite", chosen
+    )
+
+
+def test_question_words_make_a_new_question():
+    """Same topic terms, different question: one answer must not stand in for the other."""
+    chosen = _selection("why did you build reelsensei?")
+
+    assert cache_key("Why did you build ReelSensei?", chosen) != cache_key(
+        "When did you build ReelSensei?", chosen
+    )
+
+
+def test_the_conversation_so_far_is_part_of_the_key():
+    chosen = _selection()
+    earlier = [{"role": "user", "content": "tell me about your writing"}]
+
+    assert cache_key("and moonsite?", chosen) != cache_key("and moonsite?", chosen, earlier)
+
+
+def test_questions_without_topic_terms_are_not_one_question():
+    """Every stopword-only message has the same (empty) topic; "hi" is not "who are you"."""
+    chosen = _selection("hi")
+
+    assert cache_key("hi", chosen) != cache_key("who are you?", chosen)
+    assert cache_key("Hi!", chosen) == cache_key("hi", chosen)
+
+
+def test_a_hit_is_marked_as_replayed():
+    cache = AnswerCache()
+    cache.put("k", _answer())
+
+    replayed = cache.get("k")
+
+    assert replayed.text == "an answer"
+    assert replayed.from_cache is True
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 0, "evictions": 0}
+
+
+@pytest.mark.parametrize(
+    "answer",
+    [
+        Answer(text=BUSY_MESSAGE),
+        Answer(text=TRUNCATED_RESPONSE_MESSAGE, model="m", finish_reason="MAX_TOKENS"),
+    ],
+)
+def test_failures_and_truncations_are_never_stored(answer):
+    cache = AnswerCache()
+    cache.put("k", answer)
+
+    assert cache.get("k") is None
+
+
+def test_the_least_recently_used_answer_is_evicted_first():
+    cache = AnswerCache(max_entries=2)
+    cache.put("a", _answer("a"))
+    cache.put("b", _answer("b"))
+    cache.get("a")
+    cache.put("c", _answer("c"))
+
+    assert cache.get("b") is None
+    assert cache.get("a").text == "a"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_an_answer_expires(monkeypatch):
+    cache = AnswerCache(ttl_seconds=60)
+    cache.put("k", _answer())
+
+    later = answer_cache.time.monotonic() + 61
+    monkeypatch.setattr(answer_cache.time, "monotonic", lambda: later)
+
+    assert cache.get("k") is None
+
+
+def test_a_repeated_question_does_not_reach_gemini_twice(monkeypatch, stub_gemini):
+    monkeypatch.setattr(main, "ORIGIN_SHARED_SECRET", "")
+    monkeypatch.setattr(main, "GEMINI_API_KEY", "k")
+    limiter = SlidingWindowLimiter(per_key_limit=10, global_limit=10)
+    monkeypatch.setattr(main, "chat_limiter", limiter)
+    response = type(
+        "Response", (), {"text": "Moonsite answer.", "candidates": [], "usage_metadata": None}
+    )()
+    models = stub_gemini(response, repeat=True)
+    client = TestClient(main.app)
+
+    first = client.post("/chat-with-files", json={"message": "What did you build at Moonsite?"})
+    second = client.post("/chat-with-files", json={"message": "what did you build at moonsite"})
+
+    assert len(models.tried) == 1
+    assert second.json()["response"] == "Moonsite answer."
+    assert first.json()["trace"]["from_cache"] is False
+    assert second.json()["trace"]["from_cache"] is True
+    # Two requests, one upstream call: only one global slot stays spent.
+    assert len(limiter._global) == 1
+
+
+
+# --- single flight ------------------------------------------------------------
+#
+# The cache only helps once an answer exists. Visitors arriving together from a
+# shared link all miss it at once, so the coalescing is what makes N identical
+# asks cost one call.
+
+
+def test_concurrent_identical_asks_share_one_call():
+    flights = SingleFlight()
+    calls = []
+
+    async def produce():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return _answer()
+
+    async def three_at_once():
+        return await asyncio.gather(*(flights.run("k", produce) for _ in range(3)))
+
+    results = asyncio.run(three_at_once())
+
+    assert len(calls) == 1
+    assert [shared for _, shared in results] == [False, True, True]
+    assert all(answer.text == "an answer" for answer, _ in results)
+    assert flights.stats() == {"in_flight": 0, "led": 1, "joined": 2, "fell_through": 0}
+
+
+def test_a_follower_makes_its_own_call_when_the_leader_fails():
+    """One request's bad luck is not served to everyone who asked alongside it."""
+    flights = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream broke")
+
+    async def succeed():
+        return _answer()
+
+    async def race():
+        leader = asyncio.ensure_future(flights.run("k", fail))
+        await asyncio.sleep(0)
+        follower = await flights.run("k", succeed)
+        with pytest.raises(RuntimeError):
+            await leader
+        return follower
+
+    answer, shared = asyncio.run(race())
+
+    assert shared is False
+    assert answer.text == "an answer"
+    assert flights.stats()["joined"] == 0, "nothing was saved by waiting"
+    assert flights.stats()["fell_through"] == 1
+
+
+def test_a_follower_makes_its_own_call_when_the_leader_gets_a_failure_answer():
+    """A busy message is an answer object, not an exception, and is still not shared."""
+    flights = SingleFlight()
+    calls = []
+
+    async def busy():
+        calls.append("leader")
+        await asyncio.sleep(0.01)
+        return Answer(text=BUSY_MESSAGE)
+
+    async def succeed():
+        calls.append("follower")
+        return _answer()
+
+    async def race():
+        leader = asyncio.ensure_future(flights.run("k", busy))
+        await asyncio.sleep(0)
+        follower = await flights.run("k", succeed)
+        return await leader, follower
+
+    (led, _), (answer, shared) = asyncio.run(race())
+
+    assert led.text == BUSY_MESSAGE
+    assert shared is False
+    assert answer.text == "an answer"
+    assert calls == ["leader", "follower"]
+    assert flights.stats()["joined"] == 0
+    assert flights.stats()["fell_through"] == 1
+
+
+def test_the_leader_going_away_does_not_cancel_the_call_for_its_followers():
+    flights = SingleFlight()
+
+    async def produce():
+        await asyncio.sleep(0.02)
+        return _answer()
+
+    async def leader_leaves():
+        leader = asyncio.ensure_future(flights.run("k", produce))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flights.run("k", produce))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower
+
+    answer, shared = asyncio.run(leader_leaves())
+
+    assert shared is True
+    assert answer.text == "an answer"
+
+
+def test_simultaneous_chat_requests_cost_one_upstream_call(monkeypatch, stub_gemini):
+    monkeypatch.setattr(main, "ORIGIN_SHARED_SECRET", "")
+    monkeypatch.setattr(main, "GEMINI_API_KEY", "k")
+    limiter = SlidingWindowLimiter(per_key_limit=10, global_limit=10)
+    monkeypatch.setattr(main, "chat_limiter", limiter)
+
+    async def slow_answer():
+        await asyncio.sleep(0.05)
+        return type(
+            "Response", (), {"text": "Moonsite answer.", "candidates": [], "usage_metadata": None}
+        )()
+
+    models = stub_gemini(slow_answer, repeat=True)
+
+    async def three_visitors():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(
+                *(
+                    client.post("/chat-with-files", json={"message": "What did you build at Moonsite?"})
+                    for _ in range(3)
+                )
+            )
+
+    responses = asyncio.run(three_visitors())
+
+    assert len(models.tried) == 1
+    assert [r.json()["response"] for r in responses] == ["Moonsite answer."] * 3
+    assert sorted(r.json()["trace"]["coalesced"] for r in responses) == [False, True, True]
+    assert len(limiter._global) == 1, "the followers hand their global slots back"
@@ -0,0 +1,55 @@
+"""The microbenchmark suite's bookkeeping: its inputs, and what it calls a regression.
+
+Not the timings themselves - those belong to a machine, not to CI - but the
+parts that decide whether a comparison means anything: that a synthetic corpus
+is the same corpus every time, and that the gate fails on a slowdown beyond the
+threshold and on nothing else.
+"""
+
+import pytest
+
+from benchmarks import suite
+
+
+def _result(**mins):
+    return {"version": suite.RESULT_VERSION, "results": {k: {"min": v, "median": v} for k, v in mins.items()}}
+
+
+def test_a_synthetic_corpus_is_the_same_corpus_every_time():
+    first, second = suite.synthetic_corpus(12), suite.synthetic_corpus(12)
+
+    assert first.knowledge == second.knowledge
+    assert len(first.knowledge.sections) == 12
+    assert [s.is_profile for s in first.knowledge.sections[:3]] == [True, True, False]
+    assert [count for _, count in first.knowledge.source_counts] == [2, 5, 5]
+
+
+def test_compare_fails_only_beyond_the_threshold():
+    baseline = _result(a=1.0, b=1.0, gone=1.0)
+    current = _result(a=1.1, b=1.3, new=5.0)
+
+    lines, regressed = suite.compare(baseline, current, threshold=15)
+
+    assert regressed == ["b"]
+    assert any(line.startswith("new") and "new" in line[1:] for line in lines)
+    assert any(line.startswith("gone") and "not run" in line for line in lines)
+
+
+def test_a_baseline_in_another_format_is_refused():
+    with pytest.raises(ValueError):
+        suite.compare({"version": 0, "results": {}}, _result(a=1.0))
+
+
+def test_every_case_runs_at_the_smallest_scale():
+    result = suite.run(scales=("10",), min_batch_seconds=0.0, rounds=1)
+
+    assert set(result["results"]) == {f"{case}[10]" for case in suite.CASES}
+    assert all(timing["min"] > 0 for timing in result["results"].values())
+
+
+def test_cached_work_is_timed_uncached():
+    """A case that times a cache hit cannot catch a slow join behind it."""
+    cases = suite._cases(suite.synthetic_corpus(12))
+
+    for name in ("Knowledge.text", "prompt.build_system_instruction"):
+        assert cases[name]() is not cases[name](), name
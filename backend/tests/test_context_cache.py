@@ -0,0 +1,196 @@
+"""Explicit caching of the system instruction upstream.
+
+The rules plus the corpus are most of every request's prompt_tokens, and they
+repeat verbatim between requests that selected the same documents. What these
+pin is the bookkeeping around that: one entry per distinct instruction and
+model, reused until it expires or the corpus changes, and a refusal remembered
+rather than re-asked on every request. The saving itself is only ever reported
+as the API measured it, in cached_tokens.
+
+The caching API is the local stand-in in conftest.py; nothing reaches Google.
+"""
+
+import asyncio
+import time
+
+import pytest
+
+import context
+import gemini_helper
+import main
+import selection
+from conftest import ApiError
+
+
+def _answered(cached=None):
+    usage = type(
+        "Usage",
+        (),
+        {
+            "prompt_token_count": 5_000,
+            "cached_content_token_count": cached,
+            "thoughts_token_count": None,
+            "candidates_token_count": 40,
+            "total_token_count": 5_040,
+        },
+    )()
+    return lambda: type(
+        "Response", (), {"text": "an answer", "candidates": [], "usage_metadata": usage}
+    )()
+
+
+@pytest.fixture
+def caching(monkeypatch, stub_knowledge):
+    monkeypatch.setattr(gemini_helper, "CONTEXT_CACHE_ENABLED", True)
+    monkeypatch.setattr(gemini_helper, "CONTEXT_CACHE_MIN_TOKENS", 0)
+    version = {"current": "v1"}
+    monkeypatch.setattr(context, "corpus_version", lambda: version["current"])
+    return version
+
+
+def _ask(knowledge, question="hi"):
+    return asyncio.run(gemini_helper.get_gemini_response_async("k", question, knowledge))
+
+
+def test_an_instruction_is_cached_once_and_then_referenced_by_name(
+    caching, stub_gemini, stub_knowledge
+):
+    models = stub_gemini(_answered(), repeat=True)
+
+    _ask(stub_knowledge)
+    _ask(stub_knowledge, "again")
+
+    assert len(models.caches.created) == 1
+    first, second = models.configs
+    # Named rather than resent: the API refuses a request carrying both.
+    assert second.cached_content == "cachedContents/1"
+    assert second.system_instruction is None
+    assert first.cached_content == "cachedContents/1"
+    assert gemini_helper.context_cache.stats()["reused"] == 1
+
+
+def test_distinct_instructions_get_distinct_entries(caching, monkeypatch, stub_gemini, stub_knowledge):
+    models = stub_gemini(_answered(), repeat=True)
+
+    _ask(stub_knowledge)
+    monkeypatch.setattr(gemini_helper, "build_system_instruction", lambda k: "narrowed")
+    _ask(stub_knowledge)
+
+    assert len(models.caches.created) == 2
+
+
+def test_a_corpus_change_drops_every_entry_built_from_the_old_one(
+    caching, stub_gemini, stub_knowledge
+):
+    models = stub_gemini(_answered(), repeat=True)
+    _ask(stub_knowledge)
+
+    caching["current"] = "v2"
+    _ask(stub_knowledge)
+
+    assert models.caches.deleted == ["cachedContents/1"]
+    assert len(models.caches.created) == 2
+    assert models.configs[-1].cached_content == "cachedContents/2"
+
+
+def test_stale_entries_are_deleted_without_holding_up_the_request(
+    caching, stub_gemini, stub_knowledge
+):
+    models = stub_gemini(_answered(), repeat=True)
+    _ask(stub_knowledge)
+    started = []
+
+    async def stall(name):
+        started.append(name)
+        await asyncio.sleep(60)
+
+    models.caches.delete = stall
+    caching["current"] = "v2"
+    begun = time.monotonic()
+    answer = _ask(stub_knowledge)
+
+    assert answer.text == "an answer"
+    assert time.monotonic() - begun < 5
+    assert started == ["cachedContents/1"], "the delete was still sent"
+
+
+def test_a_refused_create_falls_back_inline_and_is_not_re_asked(
+    caching, stub_gemini, stub_knowledge
+):
+    models = stub_gemini(_answered(), repeat=True)
+    models.caches.refuse_with = ApiError(400, "caching not available")
+
+    answer = _ask(stub_knowledge)
+    models.caches.refuse_with = None
+    _ask(stub_knowledge, "again")
+
+    assert answer.text == "an answer", "a caching failure never costs the visitor the answer"
+    assert models.configs[-1].system_instruction == "sys"
+    assert models.configs[-1].cached_content is None
+    assert models.caches.created == [], "the refusal is remembered for a while"
+
+
+def test_a_hanging_create_is_cut_off_and_the_call_gets_what_is_left(
+    caching, monkeypatch, stub_gemini, stub_knowledge
+):
+    """A create must not spend the visitor's deadline and then hand the call a stale timeout."""
+    monkeypatch.setattr(gemini_helper, "CONTEXT_CACHE_CREATE_TIMEOUT_MS", 200)
+    models = stub_gemini(_answered(), repeat=True)
+
+    async def hang(model, config):
+        await asyncio.sleep(60)
+
+    models.caches.create = hang
+    deadline = gemini_helper.Deadline.start(10)
+
+    answer = asyncio.run(
+        gemini_helper.get_gemini_response_async("k", "hi", stub_knowledge, deadline=deadline)
+    )
+
+    assert answer.text == "an answer"
+    assert models.configs[-1].system_instruction == "sys"
+    assert models.configs[-1].cached_content is None
+    assert models.configs[-1].http_options.timeout <= 9_800, "timed after the create"
+
+
+def test_a_short_instruction_is_sent_inline_without_asking(
+    caching, monkeypatch, stub_gemini, stub_knowledge
+):
+    monkeypatch.setattr(gemini_helper, "CONTEXT_CACHE_MIN_TOKENS", 1_024)
+    models = stub_gemini(_answered(), repeat=True)
+
+    _ask(stub_knowledge)
+
+    assert models.caches.created == []
+
+
+def test_caching_is_off_unless_enabled(monkeypatch, stub_gemini, stub_knowledge):
+    monkeypatch.setattr(gemini_helper, "CONTEXT_CACHE_ENABLED", False)
+    models = stub_gemini(_answered(), repeat=True)
+
+    _ask(stub_knowledge)
+
+    assert models.caches.created == []
+    assert models.configs[0].system_instruction == "sys"
+
+
+def test_cached_tokens_are_reported_as_measured(stub_gemini, stub_knowledge):
+    stub_gemini(_answered(cached=4_096), repeat=True)
+
+    answer = _ask(stub_knowledge)
+    knowledge = context.get_knowledge()
+    trace = main._answer_trace(
+        answer,
+        selection.Selection(
+            knowledge=knowledge, outcome=selection.UNFOCUSED, available=len(knowledge.sections)
+        ),
+    )
+
+    assert answer.cached_tokens == 4_096
+    assert trace["cached_tokens"] == 4_096
+
+
+def test_an_absent_cached_count_stays_absent(stub_gemini, stub_knowledge):
+    stub_gemini(_answered(cached=None), repeat=True)
+
+    assert _ask(stub_knowledge).cached_tokens is None
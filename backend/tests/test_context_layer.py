@@ -8,7 +8,9 @@ speaker - because none of them crash and the only symptom is a wrong answer.
 Run from the backend directory: `pytest`
 """
 
+import os
 import re
+import threading
 
 import pytest
 
@@ -17,6 +19,7 @@ from conftest import ApiError
 import context
 import gemini_helper
 import main
+import metrics
 import prompt
 import selection
 from gemini_helper import (
@@ -75,6 +78,18 @@ def test_corpus_is_cached_between_calls():
     assert context.get_knowledge() is context.get_knowledge()
 
 
+def test_corpus_version_names_the_build_it_describes(fresh_corpus_cache):
+    """State derived from the corpus elsewhere keys its staleness on this."""
+    assert context.corpus_version() is None
+
+    context.get_knowledge()
+    version = context.corpus_version()
+
+    assert version
+    context.get_knowledge()
+    assert context.corpus_version() == version
+
+
 # --- the behavioural contract -------------------------------------------------
 
 
@@ -113,6 +128,35 @@ def test_system_instruction_fences_the_corpus():
     assert body.rstrip().endswith("=== END PROFILE ===")
 
 
+def test_a_repeat_selection_reuses_the_finished_instruction():
+    corpus = context.get_knowledge()
+    chosen = corpus.sections[:2]
+
+    first = build_system_instruction(context.Knowledge(sections=chosen))
+    again = build_system_instruction(context.Knowledge(sections=chosen))
+
+    assert again is first
+    assert context.Knowledge(sections=chosen).text in first
+
+
+def test_a_reused_label_over_a_different_body_is_not_served_the_old_instruction():
+    label = context.get_knowledge().sources[0]
+    build_system_instruction(context.Knowledge(sections=(context.Section(label, "old body"),)))
+
+    instruction = build_system_instruction(
+        context.Knowledge(sections=(context.Section(label, "new body"),))
+    )
+
+    assert "new body" in instruction and "old body" not in instruction
+
+
+def test_the_joined_corpus_is_built_once_per_instance():
+    knowledge = context.Knowledge(sections=context.get_knowledge().sections)
+
+    assert knowledge.text is knowledge.text
+    assert knowledge.source_counts is knowledge.source_counts
+
+
 def test_empty_corpus_is_refused_without_calling_the_model(monkeypatch):
     """No corpus means no answer - never an ungrounded one about a real person."""
 
@@ -247,6 +291,160 @@ def test_debug_and_ungrounded_endpoints_are_gone():
     assert "/api/chat/status" in paths
 
 
+# --- prompt size --------------------------------------------------------------
+
+
+def _doc(label, chars):
+    return context.Section(label=label, body="x" * chars)
+
+
+def test_the_token_estimate_is_corrected_by_what_the_api_counted():
+    estimator = context.token_estimator
+    assert estimator.estimate("x" * 400) == 100
+
+    estimator.observe("m", 400, 130)
+
+    assert estimator.estimate("x" * 400, "m") == 130
+    # With no model chosen yet, the largest correction any model has shown.
+    assert estimator.estimate("x" * 400) == 130
+
+
+def test_one_absurd_measurement_cannot_swing_the_estimate_wildly():
+    context.token_estimator.observe("m", 4, 5_000)
+
+    assert context.token_estimator.factor("m") == context.ESTIMATOR_FACTOR_BOUNDS[1]
+
+
+def test_a_prompt_within_budget_is_left_alone():
+    knowledge = context.Knowledge(sections=(_doc("Profile / me", 400),))
+    turns = [{"role": "user", "content": "earlier"}]
+
+    fitted, kept = prompt.fit_to_budget("q", knowledge, turns, budget=100_000)
+
+    assert fitted == knowledge
+    assert kept == turns
+
+
+def test_over_budget_drops_the_oldest_turns_first():
+    knowledge = context.Knowledge(
+        sections=(_doc("Profile / me", 400), _doc("Project / a", 400))
+    )
+    turns = [
+        {"role": "user", "content": "o" * 2_000},
+        {"role": "model", "content": "o" * 2_000},
+        {"role": "user", "content": "recent"},
+        {"role": "model", "content": "reply"},
+    ]
+    everything = prompt._estimated_size("q", knowledge, turns)
+
+    fitted, kept = prompt.fit_to_budget("q", knowledge, turns, budget=everything - 600)
+
+    # The model turn goes with the user turn that prompted it.
+    assert kept == turns[2:]
+    assert fitted == knowledge, "no document goes while a turn can"
+
+
+def test_the_weakest_match_goes_before_any_profile_document():
+    knowledge = context.Knowledge(
+        sections=(
+            _doc("Profile / me", 400),
+            _doc("Project / strong", 400),
+            _doc("Writing / weak", 400),
+        )
+    )
+    scores = (("Profile / me", 0.0), ("Project / strong", 3.0), ("Writing / weak", 0.5))
+    everything = prompt._estimated_size("q", knowledge, [])
+
+    fitted, _ = prompt.fit_to_budget("q", knowledge, [], scores, budget=everything - 50)
+
+    assert fitted.sources == ("Profile / me", "Project / strong")
+
+
+def test_the_last_profile_document_is_never_trimmed():
+    knowledge = context.Knowledge(
+        sections=(_doc("Profile / me", 400), _doc("Profile / more", 400), _doc("Project / a", 400))
+    )
+
+    fitted, _ = prompt.fit_to_budget("q", knowledge, [], budget=1)
+
+    assert fitted.sources == ("Profile / me",)
+
+
+def test_a_long_session_stops_growing_the_request(monkeypatch):
+    """The request main.py sends is the fitted one, so the trace and the answer
+    cache describe the prompt that was actually sent."""
+    monkeypatch.setattr(prompt, "PROMPT_TOKEN_BUDGET", 6_000)
+    history = [
+        main.ChatMessage(type="user" if i % 2 == 0 else "ai", content="y" * 4_000)
+        for i in range(6)
+    ]
+    request = main.ChatRequest(message="What did you build?", conversation_history=history)
+
+    turns, chosen = main._select_for(request, gemini_helper.Deadline.start())
+    size = prompt._estimated_size(request.message, chosen.knowledge, turns)
+
+    assert size <= 6_000 or len(chosen.knowledge.sections) == 1
+    assert len(turns) < 6
+
+
+def test_the_shipped_corpus_is_never_trimmed_at_default_settings(monkeypatch):
+    """Even under the longest conversation a request can carry, with the
+    estimator reading twice what chars over four suggests."""
+    monkeypatch.setattr(prompt.token_estimator, "factor", lambda model_id=None: 2.0)
+    knowledge = context.get_knowledge()
+    history = [
+        {"role": "user" if i % 2 == 0 else "model", "content": "y" * main.MAX_HISTORY_CONTENT_CHARS}
+        for i in range(prompt.HISTORY_TURNS)
+    ]
+
+    fitted, kept = prompt.fit_to_budget("q" * main.MAX_MESSAGE_CHARS, knowledge, history)
+
+    assert fitted is knowledge
+    assert kept == history
+    assert prompt.RESERVED_OUTPUT_TOKENS >= max(
+        p.max_output_tokens for p in [gemini_helper.DEFAULT_PROFILE, *gemini_helper.GENERATION_PROFILES.values()]
+    )
+
+
+def test_the_default_budget_is_a_cost_ceiling_inside_the_window():
+    assert prompt.DEFAULT_PROMPT_TOKEN_BUDGET < prompt.MAX_PROMPT_TOKEN_BUDGET
+    assert prompt.DEFAULT_PROMPT_TOKEN_BUDGET <= 2 * context.CONTEXT_REVIEW_TOKENS
+    assert prompt.PROMPT_TOKEN_BUDGET <= prompt.MAX_PROMPT_TOKEN_BUDGET
+
+
+def test_trimming_is_logged_as_a_warning(caplog):
+    knowledge = context.Knowledge(sections=(_doc("Profile / me", 400), _doc("Project / a", 400)))
+
+    with caplog.at_level("WARNING", logger="prompt"):
+        prompt.fit_to_budget("q", knowledge, [], budget=150)
+
+    assert "dropped 0 turns and 1 passages (Project / a)" in caplog.text
+
+
+def test_a_trimmed_selection_reports_what_was_sent(monkeypatch):
+    monkeypatch.setattr(prompt, "PROMPT_TOKEN_BUDGET", 6_000)
+    request = main.ChatRequest(message="tell me about quux")
+    chosen = selection.select(request.message, context.get_knowledge())
+    assert chosen.outcome == selection.UNFOCUSED
+
+    _, sent = main._select_for(request, gemini_helper.Deadline.start())
+    trace = main._answer_trace(gemini_helper.Answer(text="a", model="m"), sent)
+
+    assert sent.trimmed == len(chosen.knowledge.sections) - len(sent.knowledge.sections) > 0
+    assert trace["context_trimmed"] == sent.trimmed
+    assert sum(entry["count"] for entry in trace["context"]) == len(sent.knowledge.documents)
+
+
+def test_fitting_does_not_fill_the_instruction_cache(monkeypatch):
+    knowledge = context.get_knowledge()
+    cache = context.corpus_holder.current.derived(prompt.INSTRUCTIONS)
+    before = list(cache._entries)
+
+    prompt.fit_to_budget("q", knowledge, [], budget=1)
+
+    assert list(cache._entries) == before
+
+
 # --- silent failures of corpus assembly ---------------------------------------
 #
 # None of these crash. The only symptom of each is a wrong answer or a corpus
@@ -276,14 +474,257 @@ def test_partial_corpus_is_not_cached(monkeypatch, fresh_corpus_cache):
 
     def build_missing_one():
         full = real_build()
-        return context.Knowledge(sections=full.sections[:-1])
+        last = full.sections[-1].document
+        return context.Knowledge(sections=tuple(s for s in full.sections if s.document != last))
 
     monkeypatch.setattr(context, "_build", build_missing_one)
 
     knowledge = context.get_knowledge()
 
     assert not knowledge.is_empty, "the partial corpus is still served for this request"
-    assert context._cache is None, "a partial corpus must not be cached"
+    assert context.corpus_holder.current is None, "a partial corpus must not be cached"
+
+
+@pytest.fixture
+def tmp_corpus(tmp_path, monkeypatch, fresh_corpus_cache):
+    """One document of each kind in a throwaway docs tree; returns the tree's root."""
+    for directory, name, text in (
+        ("profile", "about.md", "# About\nI build things."),
+        ("projects", "tool.md", "# Tool\nA project."),
+        ("writing", "post.md", "# Post\n\n## date\n2025-01-01\n\nA post."),
+    ):
+        (tmp_path / directory).mkdir()
+        (tmp_path / directory / name).write_text(text, encoding="utf-8")
+    monkeypatch.setattr(context, "PROFILE_DIR", str(tmp_path / "profile"))
+    monkeypatch.setattr(context, "PROJECTS_DIR", str(tmp_path / "projects"))
+    monkeypatch.setattr(context, "WRITING_DIR", str(tmp_path / "writing"))
+    return tmp_path
+
+
+def test_documents_are_split_at_their_headings_into_labelled_passages():
+    body = (
+        "# Post\n\n" + "An opening paragraph. " * 20
+        + "\n\n## Findings\n\n" + "What was measured. " * 20
+        + "\n\n```\n## not a heading\n```"
+        + "\n\n## Date\n2025-01-01"
+    )
+
+    sections = context.chunk("Writing / Post", body)
+
+    assert [s.label for s in sections] == ["Writing / Post", "Writing / Post § Findings"]
+    assert sections[1].document == "Writing / Post"
+    assert "## Date" in sections[1].body, "a passage too short to stand alone joins the one before"
+    assert "".join(s.body for s in sections).count("not a heading") == 1
+
+
+FACT = (
+    "I led the migration of a sports betting platform from a monolith to services "
+    "on Kubernetes, cutting deploy time from an hour to eight minutes."
+)
+
+
+def test_a_paragraph_another_document_already_states_is_replaced_by_a_reference():
+    profile = context.Section("Profile / resume", f"Work.\n\n{FACT}")
+    restated = FACT.replace("I led", "Yanir led")
+    extended = f"{FACT} The same pipeline later served three other teams and their releases too."
+    project = context.Section("Project / Platform", f"{restated}\n\n{extended}")
+    untouched = context.Section("Writing / Other", "Nothing here repeats anything said elsewhere.")
+
+    sections, replaced, saved = context.deduplicate([profile, project, untouched])
+
+    assert sections[0] is profile, "the profile copy is the one kept"
+    assert sections[1].body.startswith("[Repeats Profile / resume.]")
+    assert extended in sections[1].body, "a paragraph that adds to the fact is kept whole"
+    assert sections[2] is untouched
+    assert replaced == 1 and saved > 0
+
+
+def test_passages_of_one_document_are_not_repeats_of_each_other():
+    sections = [
+        context.Section("Project / Platform", FACT),
+        context.Section("Project / Platform § Details", FACT),
+    ]
+
+    assert context.deduplicate(sections)[1] == 0
+
+
+def test_a_repeat_is_sent_in_full_when_its_first_copy_is_not_selected():
+    """A reference to a passage the request does not carry would lose the fact."""
+    knowledge = context.Knowledge(
+        sections=(
+            context.Section("Profile / me", "I build things."),
+            context.Section("Project / Platform", f"Kubernetes migration.\n\n{FACT}"),
+            context.Section("Project / Odds", f"Zeppelin pricing engine.\n\n{FACT}"),
+        )
+    )
+
+    chosen = selection.select("tell me about the zeppelin pricing engine", knowledge)
+    alone = build_system_instruction(chosen.knowledge)
+    together = build_system_instruction(knowledge)
+
+    assert chosen.knowledge.sources == ("Profile / me", "Project / Odds")
+    assert FACT in alone and "[Repeats" not in alone
+    assert together.count(FACT) == 1
+    assert "[Repeats Project / Platform.]" in together
+
+
+def test_a_rebuild_rereads_only_the_file_that_changed(tmp_corpus, caplog):
+    before = context._build()
+    edited = tmp_corpus / "projects" / "tool.md"
+    edited.write_text("# Tool\nA project, rewritten.", encoding="utf-8")
+    os.utime(edited, ns=(1, 1))
+
+    with caplog.at_level("INFO", logger="context"):
+        after = context._build()
+
+    assert "read 1 files and reused 2" in caplog.text
+    assert after.sections[0] is before.sections[0], "an unchanged file keeps its parsed section"
+    assert after.sections[1].body == "# Tool\nA project, rewritten."
+
+
+def test_a_file_that_read_empty_is_read_again_next_build(tmp_corpus, caplog):
+    (tmp_corpus / "writing" / "draft.md").write_text("", encoding="utf-8")
+    context._build()
+
+    with caplog.at_level("INFO", logger="context"):
+        context._build()
+
+    assert "read 1 files and reused 3" in caplog.text
+
+
+@pytest.fixture
+def watched(monkeypatch, fresh_corpus_cache):
+    """The watcher running, with `_fingerprint` calls counted and scripted.
+
+    The thread's interval is long enough that it never polls during a test;
+    each test drives `poll` itself.
+    """
+    calls = []
+    real = context._fingerprint
+    scripted = {}
+
+    def fingerprint():
+        calls.append(1)
+        return scripted.get("value") or real()
+
+    monkeypatch.setattr(context, "_fingerprint", fingerprint)
+    monkeypatch.setattr(context.corpus_watcher, "interval", 600)
+    assert context.corpus_watcher.start()
+    calls.clear()
+    return calls, scripted
+
+
+def test_a_watched_corpus_is_served_without_touching_the_disk(watched):
+    calls, _ = watched
+
+    first = context.get_knowledge()
+    checked = len(calls)
+    for _ in range(5):
+        assert context.get_knowledge() is first
+
+    assert checked == 1, "the first read after start confirms the cache against the disk"
+    assert len(calls) == checked, "steady-state reads must not fingerprint"
+
+
+def test_a_change_the_watcher_sees_is_picked_up_by_the_next_request(watched):
+    _, scripted = watched
+    before = context.get_knowledge()
+    version = context.corpus_version()
+
+    scripted["value"] = tuple((f"/docs/{i}.md", 1, 1) for i in range(len(before.documents)))
+    assert context.corpus_watcher.poll()
+    assert context.corpus_watcher.dirty
+
+    after = context.get_knowledge()
+
+    assert after is not before, "a changed fingerprint is rebuilt, not served from cache"
+    assert context.corpus_version() != version
+    assert not context.corpus_watcher.dirty
+    assert context.get_knowledge() is after
+
+
+def test_a_partial_rebuild_leaves_the_watched_corpus_dirty(watched, monkeypatch):
+    """Otherwise the watcher would stop the retry the partial-corpus rule exists for."""
+    real_build = context._build
+    def build_missing_one():
+        full = real_build()
+        last = full.sections[-1].document
+        return context.Knowledge(sections=tuple(s for s in full.sections if s.document != last))
+
+    monkeypatch.setattr(context, "_build", build_missing_one)
+
+    context.get_knowledge()
+
+    assert context.corpus_holder.current is None
+    assert context.corpus_watcher.dirty
+
+
+def test_without_the_watcher_every_read_checks_the_disk(monkeypatch):
+    calls = []
+    real = context._fingerprint
+    monkeypatch.setattr(context, "_fingerprint", lambda: calls.append(1) or real())
+
+    context.get_knowledge()
+    context.get_knowledge()
+
+    assert not context.corpus_watcher.running
+    assert len(calls) == 2
+
+
+def _touched(fingerprint):
+    """`fingerprint` as it would read after its first file was saved again."""
+    path, size, _ = fingerprint[0]
+    return ((path, size, 1),) + fingerprint[1:]
+
+
+def test_one_caller_rebuilds_while_the_rest_serve_the_previous_corpus(
+    monkeypatch, fresh_corpus_cache
+):
+    """Without single flight every request noticing a change rebuilds it too."""
+    before = context.get_knowledge()
+    first = context.corpus_holder.current
+    real_build = context._build
+    building, release, builds = threading.Event(), threading.Event(), []
+
+    def slow_build():
+        builds.append(1)
+        building.set()
+        assert release.wait(5)
+        return real_build()
+
+    monkeypatch.setattr(context, "_build", slow_build)
+    monkeypatch.setattr(context, "_fingerprint", lambda: _touched(first.fingerprint))
+
+    rebuilder = threading.Thread(target=context.get_knowledge)
+    rebuilder.start()
+    assert building.wait(5)
+
+    served = [context.get_knowledge() for _ in range(3)]
+    release.set()
+    rebuilder.join(5)
+
+    assert all(knowledge is before for knowledge in served), "the stale corpus is served meanwhile"
+    assert len(builds) == 1
+    installed = context.corpus_holder.current
+    assert installed.version == first.version + 1
+    assert metrics.corpus_version.value() == installed.version
+
+
+def test_the_index_is_swapped_in_with_the_corpus_it_was_built_from(monkeypatch, fresh_corpus_cache):
+    context.get_knowledge()
+    first = context.corpus_holder.current
+    built_for = []
+    real = selection._derive_index
+    monkeypatch.setitem(
+        context._derivers, selection.INDEX, lambda k: built_for.append(k) or real(k)
+    )
+    monkeypatch.setattr(context, "_fingerprint", lambda: _touched(first.fingerprint))
+    monkeypatch.setattr(context, "_parsed", {})
+
+    knowledge = context.get_knowledge()
+
+    assert built_for == [knowledge], "built before the swap, for the corpus swapped in"
+    assert selection._index_for(knowledge) is context.corpus_holder.current.derived(selection.INDEX)
 
 
 def _response_with_finish_reason(name):
@@ -393,7 +834,7 @@ def test_a_model_answer_reports_the_corpus_it_was_given():
     # Every document is accounted for under some kind, so the breakdown a
     # visitor reads adds up to what was sent rather than to a subset of it.
     assert sum(entry["count"] for entry in trace["context"]) == len(
-        chosen.knowledge.sections
+        chosen.knowledge.documents
     )
     # Not reported upstream in this response, so absent here rather than zero.
     assert trace["thinking_tokens"] is None
@@ -416,9 +857,9 @@ def test_source_counts_name_every_document_kind_without_zeroes():
 
     counts = dict(knowledge.source_counts)
 
-    assert counts["note"] == sum(s.startswith("Profile / ") for s in knowledge.sources)
+    assert counts["note"] == sum(d.startswith("Profile / ") for d in knowledge.documents)
     assert all(count > 0 for count in counts.values()), "a kind with nothing in it is omitted"
-    assert sum(counts.values()) == len(knowledge.sources)
+    assert sum(counts.values()) == len(knowledge.documents)
 
 
 def test_an_unrecognised_label_is_still_counted():
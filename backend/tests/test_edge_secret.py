@@ -52,6 +52,8 @@ def test_health_stays_reachable_so_platform_probes_do_not_break(guarded_client):
     # no quota and disclose nothing, so they are deliberately outside the guard.
     for path in ("/", "/health"):
         assert guarded_client.get(path).status_code == 200
+    # Readiness may be 503 while warming, but never for want of the header.
+    assert guarded_client.get("/ready").status_code != 403
 
 
 def test_preflight_is_not_refused(guarded_client):
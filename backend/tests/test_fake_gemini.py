@@ -0,0 +1,135 @@
+"""The local fake Gemini API, driven through the real SDK and the real chain.
+
+These are what make a capacity run's numbers worth reading: if the fake stopped
+looking like the API where the backend reads it - usage counts, finish reasons,
+error statuses and retry delays - a load test against it would measure a
+different program. No socket is opened; the SDK's httpx client is handed the
+fake app as its transport.
+"""
+
+import asyncio
+
+import httpx
+from google import genai
+from google.genai import types
+
+import context
+import gemini_helper
+from gemini_helper import BUSY_MESSAGE, TRUNCATED_RESPONSE_MESSAGE
+from loadtest.fake_gemini import FakeConfig, FakeGemini, create_app
+
+KNOWLEDGE = context.Knowledge(
+    sections=(context.Section(label="Profile / about-me", body="I build things."),)
+)
+
+
+def _client(**config):
+    fake = FakeGemini(FakeConfig(latency_median_ms=1, seed=7, **config))
+    transport = httpx.ASGITransport(app=create_app(fake))
+    client = genai.Client(
+        api_key="fake",
+        http_options=types.HttpOptions(
+            base_url="http://fake-gemini", async_client_args={"transport": transport}
+        ),
+    )
+    return client, fake
+
+
+def _ask(client):
+    return asyncio.run(
+        gemini_helper.get_gemini_response_async("fake", "What do you build?", KNOWLEDGE, client=client)
+    )
+
+
+def test_an_answer_carries_usage_the_way_the_api_reports_it():
+    client, _ = _client()
+
+    answer = _ask(client)
+
+    assert answer.model == gemini_helper.model_ranking.order()[0]
+    assert answer.finish_reason == "STOP"
+    assert answer.prompt_tokens > 0
+    assert answer.thinking_tokens >= 100
+    assert answer.total_tokens == answer.prompt_tokens + answer.output_tokens + answer.thinking_tokens
+
+
+def test_a_max_tokens_finish_reaches_the_visitor_as_the_truncation_notice():
+    client, _ = _client(rate_max_tokens=1.0)
+
+    assert _ask(client).text == TRUNCATED_RESPONSE_MESSAGE
+
+
+def test_injected_429s_open_every_circuit_for_the_retry_delay_given():
+    client, fake = _client(rate_429=1.0, retry_after_seconds=42)
+
+    first = _ask(client)
+    second = _ask(client)
+
+    assert first.text == second.text == BUSY_MESSAGE
+    snapshot = gemini_helper.circuit_breakers.snapshot()
+    assert all(41 <= model["retry_in_seconds"] <= 42 for model in snapshot.values())
+    # The second request was answered without reaching the fake at all.
+    assert sum(o["429"] for o in fake.stats()["outcomes"].values()) == len(gemini_helper.MODELS)
+
+
+def test_a_spent_daily_quota_moves_the_chain_to_the_next_model():
+    client, fake = _client(quota_per_model=1)
+
+    first = _ask(client)
+    second = _ask(client)
+
+    assert first.from_model and second.from_model
+    assert first.model != second.model
+
+
+def test_streaming_relays_several_chunks_and_ends_with_the_usage():
+    client, _ = _client(stream_chunks=4)
+
+    async def drain():
+        return [
+            item
+            async for item in gemini_helper.stream_gemini_response(
+                "fake", "What do you build?", KNOWLEDGE, client=client
+            )
+        ]
+
+    items = asyncio.run(drain())
+
+    assert len(items) == 5
+    assert items[-1].text == "".join(items[:-1]).strip()
+    assert items[-1].output_tokens > 0
+
+
+def test_the_base_url_is_configurable_for_pointing_the_app_at_the_fake(monkeypatch):
+    monkeypatch.setattr(gemini_helper, "GEMINI_BASE_URL", "http://127.0.0.1:8090")
+    built = {}
+    monkeypatch.setattr(gemini_helper.genai, "Client", lambda **kwargs: built.update(kwargs))
+
+    gemini_helper._new_client("k", 1_000)
+
+    assert built["http_options"].base_url == "http://127.0.0.1:8090"
+
+
+def test_a_thinking_budget_caps_the_thinking_the_fake_reports():
+    client, _ = _client(thinking_tokens_min=500, thinking_tokens_max=500)
+
+    answer = asyncio.run(
+        gemini_helper.get_gemini_response_async(
+            "fake",
+            "hi",
+            KNOWLEDGE,
+            client=client,
+            profile=gemini_helper.GenerationProfile(name="t", thinking_budget=0, max_output_tokens=400),
+        )
+    )
+
+    assert answer.thinking_tokens == 0
+    assert answer.total_tokens == answer.prompt_tokens + answer.output_tokens
+
+
+def test_a_prewarm_reaches_the_api_without_generating_anything():
+    client, fake = _client()
+
+    asyncio.run(gemini_helper.prewarm(client))
+
+    assert not fake.stats()["outcomes"]
@@ -0,0 +1,100 @@
+"""Generation profiles: what each selection outcome is allowed to spend upstream.
+
+The saving is the point - a greeting should not pay for deliberation it does
+not need - so these pin the config each profile actually sends and that the
+trace names the profile an answer ran under, which is how the saving is read.
+"""
+
+import asyncio
+
+import pytest
+from starlette.testclient import TestClient
+
+import gemini_helper
+import main
+import selection
+from gemini_helper import DEFAULT_PROFILE, GENERATION_PROFILES, profile_for
+
+KNOWLEDGE = gemini_helper.Knowledge(
+    sections=(gemini_helper.context.Section(label="Profile / about-me", body="I build things."),)
+)
+
+
+def _response(text="An answer."):
+    return type("Response", (), {"text": text, "candidates": [], "usage_metadata": None})()
+
+
+def _ask(profile):
+    return asyncio.run(
+        gemini_helper.get_gemini_response_async("k", "hi", KNOWLEDGE, profile=profile)
+    )
+
+
+def test_every_outcome_that_reaches_a_model_has_a_profile():
+    for outcome in (selection.CONVERSATIONAL, selection.NARROWED, selection.UNFOCUSED):
+        assert profile_for(outcome) is GENERATION_PROFILES[outcome]
+    assert profile_for(None) is DEFAULT_PROFILE
+
+
+def test_profiles_get_cheaper_as_the_question_gets_simpler():
+    conversational, narrowed, unfocused = (
+        GENERATION_PROFILES[o]
+        for o in (selection.CONVERSATIONAL, selection.NARROWED, selection.UNFOCUSED)
+    )
+
+    assert conversational.thinking_budget < narrowed.thinking_budget < unfocused.thinking_budget
+    for profile in (conversational, narrowed, unfocused):
+        # Thinking shares the output cap; a budget that filled it would
+        # truncate every answer.
+        assert profile.max_output_tokens > profile.thinking_budget + 200
+
+
+def test_a_conversational_reply_switches_thinking_off_and_asks_the_lite_model_first(stub_gemini):
+    models = stub_gemini(_response(), repeat=True)
+
+    answer = _ask(GENERATION_PROFILES[selection.CONVERSATIONAL])
+
+    assert models.tried == ["gemini-flash-lite-latest"]
+    config = models.configs[0]
+    assert config.thinking_config.thinking_budget == 0
+    assert config.max_output_tokens == 400
+    assert answer.profile == "conversational"
+
+
+def test_the_default_profile_sends_the_config_every_request_used_to(stub_gemini):
+    models = stub_gemini(_response(), repeat=True)
+
+    answer = _ask(None)
+
+    assert models.tried == [gemini_helper.model_ranking.order()[0]]
+    assert models.configs[0].thinking_config is None
+    assert models.configs[0].max_output_tokens == gemini_helper.MAX_OUTPUT_TOKENS
+    assert answer.profile == "default"
+
+
+def test_a_preferred_model_that_is_refusing_is_skipped_like_any_other(monkeypatch, stub_gemini):
+    lite = "gemini-flash-lite-latest"
+    monkeypatch.setattr(
+        gemini_helper.circuit_breakers, "allow", lambda model_id, now=None: model_id != lite
+    )
+    models = stub_gemini(_response(), repeat=True)
+
+    _ask(GENERATION_PROFILES[selection.CONVERSATIONAL])
+
+    assert models.tried == [gemini_helper.model_ranking.order()[0]]
+
+
+@pytest.mark.parametrize(
+    "message, profile",
+    [("hi", "conversational"), ("What did you build with ReelSensei?", "focused")],
+)
+def test_the_trace_names_the_profile_the_selection_chose(monkeypatch, stub_gemini, message, profile):
+    monkeypatch.setattr(main, "ORIGIN_SHARED_SECRET", "")
+    monkeypatch.setattr(main, "GEMINI_API_KEY", "k")
+    models = stub_gemini(_response(), repeat=True)
+
+    trace = TestClient(main.app).post("/chat-with-files", json={"message": message}).json()["trace"]
+
+    assert trace["profile"] == profile
+    budget = models.configs[0].thinking_config.thinking_budget
+    assert budget == GENERATION_PROFILES[trace["context_outcome"]].thinking_budget
@@ -0,0 +1,109 @@
+"""The load-test harness: what it counts, and that a short run against the app holds together.
+
+A capacity number is only as good as the bookkeeping behind it. These pin the
+parts a reader of a result file takes on trust - which responses count as
+answers, which as refusals, and what a comparison calls a regression.
+"""
+
+import asyncio
+
+import httpx
+import pytest
+
+import main
+from loadtest.harness import (
+    LoadConfig,
+    Sample,
+    _chat_outcome,
+    compare,
+    parse_mix,
+    percentile,
+    run_load,
+    summarise,
+)
+from rate_limit import SlidingWindowLimiter
+
+
+def test_percentiles_are_observed_values():
+    values = [float(v) for v in range(1, 101)]
+
+    assert percentile(values, 50) == 50.0
+    assert percentile(values, 99) == 99.0
+    assert percentile([7.0], 95) == 7.0
+    assert percentile([], 95) is None
+
+
+def test_the_mix_rejects_an_endpoint_that_does_not_exist():
+    assert parse_mix("chat=1, status=3") == {"chat": 1.0, "status": 3.0}
+    with pytest.raises(ValueError):
+        parse_mix("chat=1,contact=1")
+    with pytest.raises(ValueError):
+        parse_mix("chat=0")
+
+
+def test_a_busy_reply_is_not_counted_as_an_answer():
+    assert _chat_outcome(200, {"response": "busy", "trace": None}) == "no_model"
+    assert _chat_outcome(200, {"trace": {"from_cache": True}}) == "replayed"
+    assert _chat_outcome(200, {"trace": {"from_cache": False, "coalesced": False}}) == "model"
+    assert _chat_outcome(429, None) is None
+
+
+def test_refusals_are_counted_apart_from_errors_and_kept_out_of_latency():
+    samples = [
+        Sample("status", 200, 10.0, 0.0),
+        Sample("status", 200, 30.0, 0.0),
+        Sample("status", 429, 0.1, 0.0),
+        Sample("status", 0, 60_000.0, 0.0),
+    ]
+
+    summary = summarise(samples, elapsed=2.0)["status"]
+
+    assert (summary["ok"], summary["rate_limited"], summary["errors"]) == (2, 1, 1)
+    assert summary["error_rate"] == 0.25
+    assert summary["rate_limited_rate"] == 0.25
+    assert summary["throughput_rps"] == 1.0
+    assert summary["latency_ms"]["max"] == 30.0
+
+
+def test_compare_marks_only_changes_beyond_the_tolerance():
+    def result(p95, rps):
+        return {
+            "version": 1,
+            "config": {"rate": 5},
+            "endpoints": {"chat": {"latency_ms": {"p95": p95}, "throughput_rps": rps}},
+        }
+
+    lines = compare(result(100.0, 10.0), result(105.0, 8.0), tolerance=10.0)
+
+    assert "chat latency_ms.p95: 100.0 -> 105.0 (+5.0%)" in lines
+    assert "chat throughput_rps: 10.0 -> 8.0 (-20.0%) WORSE" in lines
+
+
+def test_a_short_run_drives_every_endpoint_through_the_app(monkeypatch, stub_gemini):
+    monkeypatch.setattr(main, "ORIGIN_SHARED_SECRET", "")
+    monkeypatch.setattr(main, "GEMINI_API_KEY", "k")
+    monkeypatch.setattr(main, "chat_limiter", SlidingWindowLimiter(per_key_limit=3, global_limit=0))
+    stub_gemini(
+        type("Response", (), {"text": "An answer.", "candidates": [], "usage_metadata": None})(),
+        repeat=True,
+    )
+    config = LoadConfig(
+        target="http://test",
+        duration_seconds=0.5,
+        rate=40,
+        concurrency=4,
+        mix={"chat": 3.0, "projects": 1.0, "writing": 1.0, "status": 1.0},
+        seed=3,
+    )
+
+    result = asyncio.run(run_load(config, transport=httpx.ASGITransport(app=main.app), edge_secret=""))
+
+    endpoints = result["endpoints"]
+    assert set(endpoints) == {"chat", "projects", "writing", "status"}
+    assert all(e["errors"] == 0 for e in endpoints.values())
+    chat = endpoints["chat"]
+    # One address, three answers a window: the rest are the limiter's.
+    assert chat["ok"] == min(3, chat["requests"])
+    assert chat["rate_limited"] == chat["requests"] - chat["ok"]
+    assert result["event_loop_lag_ms"]["app"] is None
+    assert result["event_loop_lag_ms"]["harness"]["p50"] is not None
@@ -0,0 +1,133 @@
+"""The /metrics endpoint: the text format a scraper parses, and the events it counts.
+
+A metric nobody increments is worse than none - a flat line reads as "this
+never happens" - so the tests drive the real paths and read the exposition
+back, rather than checking that a counter can count.
+"""
+
+import pytest
+from starlette.testclient import TestClient
+
+import context
+import gemini_helper
+import main
+import metrics
+from rate_limit import SlidingWindowLimiter
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main, "ORIGIN_SHARED_SECRET", "")
+    monkeypatch.setattr(main, "GEMINI_API_KEY", "k")
+    return TestClient(main.app)
+
+
+def _usage(prompt=1200, thinking=None, output=40):
+    return type(
+        "Usage",
+        (),
+        {
+            "prompt_token_count": prompt,
+            "cached_content_token_count": None,
+            "thoughts_token_count": thinking,
+            "candidates_token_count": output,
+            "total_token_count": prompt + output,
+        },
+    )()
+
+
+def _response(text="An answer."):
+    return type("Response", (), {"text": text, "candidates": [], "usage_metadata": _usage()})()
+
+
+def test_the_exposition_is_the_prometheus_text_format():
+    requests = metrics.Counter("requests_total", "Requests.", ("path",))
+    latency = metrics.Histogram("latency_ms", "Latency.", (10, 100), ("model",))
+    requests.inc(path='/a"b')
+    requests.inc(2, path='/a"b')
+    latency.observe(5, model="m")
+    latency.observe(50, model="m")
+    latency.observe(500, model="m")
+
+    lines = requests.render() + latency.render()
+
+    assert "# TYPE requests_total counter" in lines
+    assert 'requests_total{path="/a\\"b"} 3' in lines
+    assert 'latency_ms_bucket{model="m",le="10"} 1' in lines
+    assert 'latency_ms_bucket{model="m",le="100"} 2' in lines
+    assert 'latency_ms_bucket{model="m",le="+Inf"} 3' in lines
+    assert 'latency_ms_sum{model="m"} 555' in lines
+    assert 'latency_ms_count{model="m"} 3' in lines
+
+
+def test_a_label_set_that_does_not_match_is_refused():
+    with pytest.raises(ValueError):
+        metrics.selection_outcomes.inc(result="narrowed")
+
+
+def test_an_answer_records_latency_tokens_and_its_selection(client, stub_gemini):
+    stub_gemini(_response(), repeat=True)
+
+    response = client.post("/chat-with-files", json={"message": "What did you build at Moonsite?"})
+
+    trace = response.json()["trace"]
+    model, profile = trace["model"], trace["profile"]
+    assert metrics.answer_latency_ms.count(model=model, profile=profile) == 1
+    assert metrics.answer_tokens.count(model=model, profile=profile, kind="prompt") == 1
+    assert metrics.answer_tokens.count(model=model, profile=profile, kind="output") == 1
+    # Not reported by the API, so not observed as zero.
+    assert metrics.answer_tokens.count(model=model, profile=profile, kind="thinking") == 0
+    outcome = response.json()["trace"]["context_outcome"]
+    assert metrics.selection_outcomes.value(outcome=outcome) == 1
+
+
+def test_skipped_models_and_refused_visitors_are_counted(client, monkeypatch, stub_gemini):
+    import gemini_helper
+
+    monkeypatch.setattr(main, "chat_limiter", SlidingWindowLimiter(per_key_limit=1, global_limit=0))
+    first = gemini_helper.MODELS[0]
+    monkeypatch.setattr(gemini_helper.circuit_breakers, "allow", lambda model_id, now=None: model_id != first)
+    stub_gemini(_response(), repeat=True)
+
+    client.post("/chat-with-files", json={"message": "What did you build?"})
+    refused = client.post("/chat-with-files", json={"message": "And then?"})
+
+    assert refused.status_code == 429
+    assert metrics.rate_limit_rejections.value(route="chat-with-files", window="per_key") == 1
+    assert metrics.model_skips.value(model=first, reason="circuit_open") == 1
+
+
+def test_a_rejection_by_the_instance_ceiling_is_counted_as_global(client, monkeypatch, stub_gemini):
+    monkeypatch.setattr(main, "chat_limiter", SlidingWindowLimiter(per_key_limit=0, global_limit=1))
+    stub_gemini(_response(), repeat=True)
+
+    client.post("/chat-with-files", json={"message": "What did you build?"})
+    refused = client.post("/chat-with-files", json={"message": "And then?"})
+
+    assert refused.status_code == 429
+    assert metrics.rate_limit_rejections.value(route="chat-with-files", window="global") == 1
+    assert metrics.rate_limit_rejections.value(route="chat-with-files", window="per_key") == 0
+
+
+def test_latency_buckets_reach_the_deadlines():
+    """A call cut off at its timeout is a measurement, not an overflow into +Inf."""
+    assert gemini_helper.REQUEST_TIMEOUT_MS in metrics.LATENCY_BUCKETS_MS
+    assert gemini_helper.TOTAL_DEADLINE_SECONDS * 1000 in metrics.LATENCY_BUCKETS_MS
+
+
+def test_a_corpus_rebuild_is_counted(fresh_corpus_cache):
+    context.get_knowledge()
+    context.get_knowledge()
+
+    assert metrics.corpus_rebuilds.value(result="ok") == 1
+
+
+def test_metrics_are_behind_the_edge_secret(monkeypatch):
+    monkeypatch.setattr(main, "ORIGIN_SHARED_SECRET", "s3cret")
+    client = TestClient(main.app)
+
+    assert client.get("/metrics").status_code == 403
+    served = client.get("/metrics", headers={"x-edge-auth": "s3cret"})
+    assert served.status_code == 200
+    assert served.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert "# TYPE chat_answer_latency_ms histogram" in served.text
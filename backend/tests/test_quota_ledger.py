@@ -0,0 +1,163 @@
+"""The per-model daily ledger, and the chain skipping what it says is spent.
+
+The conftest fixture keeps the shared ledger in memory; tests that exercise
+persistence build their own against a temporary file.
+"""
+
+import json
+
+import gemini_helper
+import quota_ledger
+from conftest import ApiError
+from gemini_helper import BUSY_MESSAGE
+from quota_ledger import QuotaLedger
+
+
+def _ledger(tmp_path, **limits):
+    return QuotaLedger(path=str(tmp_path / "ledger.json"), **limits)
+
+
+def test_a_model_is_spent_once_it_reaches_its_daily_requests(tmp_path):
+    ledger = _ledger(tmp_path, requests_per_day=2, tokens_per_day=0)
+
+    ledger.record("m", 100)
+    assert ledger.is_spent("m") is False
+    ledger.record("m", 100)
+
+    assert ledger.is_spent("m") is True
+    assert ledger.is_spent("other") is False
+
+
+def test_a_token_budget_spends_a_model_too(tmp_path):
+    ledger = _ledger(tmp_path, requests_per_day=0, tokens_per_day=1_000)
+
+    ledger.record("m", 600)
+    ledger.record("m", None)  # no count reported: nothing invented
+    assert ledger.is_spent("m") is False
+    ledger.record("m", 600)
+
+    assert ledger.is_spent("m") is True
+    assert ledger.stats()["models"]["m"] == {"requests": 3, "tokens": 1_200, "spent": True}
+
+
+def _recorded(ledger, *calls):
+    for model_id, tokens in calls:
+        ledger.record(model_id, tokens)
+    ledger.flush()
+    return ledger
+
+
+def test_a_restarted_process_remembers_the_days_spend(tmp_path):
+    _recorded(_ledger(tmp_path, requests_per_day=2), ("m", 10))
+    _recorded(_ledger(tmp_path, requests_per_day=2), ("m", 10))
+
+    assert _ledger(tmp_path, requests_per_day=2).is_spent("m") is True
+
+
+def test_recording_an_answer_does_not_write_the_file(tmp_path):
+    """record runs on the event loop; the write waits for the timer, and batches."""
+    ledger = _ledger(tmp_path, requests_per_day=5)
+
+    ledger.record("m", 10)
+    ledger.record("m", 10)
+    assert not (tmp_path / "ledger.json").exists()
+
+    ledger.flush()
+    assert json.loads((tmp_path / "ledger.json").read_text())["models"]["m"]["requests"] == 2
+
+
+def test_a_pending_write_lands_without_a_flush(tmp_path):
+    ledger = QuotaLedger(path=str(tmp_path / "ledger.json"), save_delay_seconds=0.01)
+    ledger.record("m", 10)
+    ledger._pending.join(timeout=5)
+
+    assert json.loads((tmp_path / "ledger.json").read_text())["models"]["m"]["requests"] == 1
+
+
+def test_the_ledger_rolls_over_at_the_quota_day(monkeypatch, tmp_path):
+    monkeypatch.setattr(quota_ledger, "_quota_day", lambda: "2026-10-17")
+    ledger = _recorded(_ledger(tmp_path, requests_per_day=1), ("m", 10))
+    assert ledger.is_spent("m") is True
+
+    monkeypatch.setattr(quota_ledger, "_quota_day", lambda: "2026-10-18")
+
+    assert ledger.is_spent("m") is False
+    # Yesterday's file is not today's spend either.
+    assert _ledger(tmp_path, requests_per_day=1).is_spent("m") is False
+
+
+def test_an_unreadable_ledger_is_ignored_rather_than_fatal(tmp_path):
+    (tmp_path / "ledger.json").write_text("{not json")
+
+    _recorded(_ledger(tmp_path, requests_per_day=1), ("m", 10))
+
+    assert json.loads((tmp_path / "ledger.json").read_text())["models"]["m"]["requests"] == 1
+
+
+def test_a_malformed_entry_is_skipped_rather_than_fatal(tmp_path):
+    (tmp_path / "ledger.json").write_text(
+        json.dumps(
+            {
+                "day": quota_ledger._quota_day(),
+                "models": {"torn": 3, "edited": {"requests": "many"}, "m": {"requests": 1}},
+            }
+        )
+    )
+
+    ledger = _ledger(tmp_path, requests_per_day=1)
+
+    assert ledger.is_spent("m") is True
+    assert set(ledger.stats()["models"]) == {"m"}
+
+
+def test_the_chain_skips_a_spent_model_without_calling_it(monkeypatch, stub_gemini, stub_knowledge):
+    monkeypatch.setattr(quota_ledger.quota_ledger, "requests_per_day", 1)
+    first, second, _ = gemini_helper.MODELS
+    quota_ledger.quota_ledger.record(first, 10)
+    models = stub_gemini(
+        type("R", (), {"text": "From the second.", "candidates": [], "usage_metadata": None})(),
+    )
+
+    answer = gemini_helper.get_gemini_response("k", "hi", stub_knowledge)
+
+    assert models.tried == [second]
+    assert answer.model == second
+    assert quota_ledger.quota_ledger.is_spent(second) is True, "the answer was counted"
+
+
+def test_every_model_spent_answers_busy_without_a_call(monkeypatch, stub_gemini, stub_knowledge):
+    monkeypatch.setattr(quota_ledger.quota_ledger, "requests_per_day", 1)
+    for model_id in gemini_helper.MODELS:
+        quota_ledger.quota_ledger.record(model_id, 10)
+    models = stub_gemini(AssertionError("should not be called"), repeat=True)
+
+    answer = gemini_helper.get_gemini_response("k", "hi", stub_knowledge)
+
+    assert models.tried == []
+    assert answer.text == BUSY_MESSAGE
+
+
+def test_a_refused_call_counts_against_the_day_and_adds_no_tokens(stub_gemini, stub_knowledge):
+    """Google counts the 429 too; a ledger that did not would under-read the busiest days."""
+    first, second, _ = gemini_helper.MODELS
+    usage = type("Usage", (), {"total_token_count": 900})()
+    stub_gemini(
+        ApiError(429),
+        type("R", (), {"text": "From the second.", "candidates": [], "usage_metadata": usage})(),
+    )
+
+    gemini_helper.get_gemini_response("k", "hi", stub_knowledge)
+
+    models = quota_ledger.quota_ledger.stats()["models"]
+    assert models[first] == {"requests": 1, "tokens": 0, "spent": False}
+    assert models[second] == {"requests": 1, "tokens": 900, "spent": False}
+
+
+def test_tokens_are_added_only_when_reported(tmp_path):
+    ledger = _ledger(tmp_path, requests_per_day=0, tokens_per_day=0)
+
+    ledger.record_request("m")
+    ledger.record_tokens("m", None)
+    ledger.record_tokens("m", 40)
+
+    assert ledger.stats()["models"]["m"] == {"requests": 1, "tokens": 40, "spent": False}
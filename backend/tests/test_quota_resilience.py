@@ -8,47 +8,142 @@ that re-attempt every model and pay a round-trip to be refused by each hold
 workers long enough for endpoints that never call Gemini, /api/chat/status
 among them, to start timing out.
 
-Cooldown state is reset for every test by tests/conftest.py.
+Circuit breaker state is reset for every test by tests/conftest.py.
 """
 
+import asyncio
 import time
 
+import httpx
+
 import gemini_helper
+import quota_ledger
 from conftest import ApiError
 from gemini_helper import BUSY_MESSAGE
 
 
-def test_a_refused_model_is_not_retried_while_cooling():
+def _open(model_id, now, error=None):
+    """Trips a model's circuit the way a refused call would."""
+    breakers = gemini_helper.circuit_breakers
+    assert breakers.allow(model_id, now)
+    breakers.settle(model_id, error or ApiError(429, "quota"), now)
+
+
+def test_a_refused_model_is_not_retried_while_its_circuit_is_open():
     now = time.monotonic()
-    gemini_helper._start_cooldown("gemini-flash-latest", now)
+    _open("gemini-flash-latest", now)
 
-    assert gemini_helper._model_is_cooling("gemini-flash-latest", now) is True
+    assert gemini_helper.circuit_breakers.allow("gemini-flash-latest", now) is False
     # Untouched models stay available; one model refusing must not sideline the
     # rest of the fallback chain.
-    assert gemini_helper._model_is_cooling("gemini-3.5-flash", now) is False
+    assert gemini_helper.circuit_breakers.allow("gemini-3.5-flash", now) is True
+
+
+def test_an_open_circuit_lets_exactly_one_probe_through_once_it_expires():
+    breakers = gemini_helper.circuit_breakers
+    now = time.monotonic()
+    _open("gemini-flash-latest", now)
+    later = now + gemini_helper.BREAKER_POLICIES["rate_limited"].max_seconds + 1
+
+    assert breakers.state("gemini-flash-latest", later) == "half_open"
+    assert breakers.allow("gemini-flash-latest", later) is True
+    # Everyone else keeps skipping it while the probe finds out.
+    assert breakers.allow("gemini-flash-latest", later) is False
+
+    breakers.settle("gemini-flash-latest", None, later)
+    assert breakers.state("gemini-flash-latest", later) == "closed"
+
+
+def test_a_failed_probe_reopens_the_circuit_for_longer(monkeypatch):
+    breakers = gemini_helper.circuit_breakers
+    # The top of the jitter range, so the doubling is exact.
+    monkeypatch.setattr(gemini_helper.random, "uniform", lambda low, high: high)
+    policy = gemini_helper.BREAKER_POLICIES["rate_limited"]
+    now = time.monotonic()
+    _open("gemini-flash-latest", now)
+    first = breakers.snapshot(now)["gemini-flash-latest"]["retry_in_seconds"]
+
+    probe_at = now + first
+    assert breakers.allow("gemini-flash-latest", probe_at)
+    breakers.settle("gemini-flash-latest", ApiError(429, "quota"), probe_at)
+    second = breakers.snapshot(probe_at)["gemini-flash-latest"]["retry_in_seconds"]
+
+    assert first == policy.base_seconds
+    assert second == 2 * policy.base_seconds
+
+
+def test_a_cancelled_probe_hands_the_probe_back():
+    """A hedge loser or a deadline says nothing about the model. Holding the
+    probe after one would leave the circuit half-open with nobody allowed to
+    close it."""
+    breakers = gemini_helper.circuit_breakers
+    now = time.monotonic()
+    _open("gemini-flash-latest", now)
+    later = now + gemini_helper.BREAKER_POLICIES["rate_limited"].max_seconds + 1
 
+    assert breakers.allow("gemini-flash-latest", later)
+    breakers.settle("gemini-flash-latest", asyncio.CancelledError(), later)
 
-def test_cooldown_expires_and_its_entry_is_discarded():
+    assert breakers.state("gemini-flash-latest", later) == "half_open"
+    assert breakers.allow("gemini-flash-latest", later) is True
+
+
+def test_retry_after_from_upstream_sets_how_long_the_circuit_stays_open():
+    breakers = gemini_helper.circuit_breakers
+    now = time.monotonic()
+    _open("gemini-flash-latest", now, ApiError(503, "overloaded", headers={"retry-after": "7"}))
+    retry_info = {
+        "error": {
+            "details": [
+                {"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": "37s"}
+            ]
+        }
+    }
+    _open("gemini-3.5-flash", now, ApiError(429, "quota", details=retry_info))
+
+    snapshot = breakers.snapshot(now)
+    # A lone 503 is a blip: the circuit stays closed despite the header.
+    assert snapshot["gemini-flash-latest"]["state"] == "closed"
+    assert snapshot["gemini-3.5-flash"]["retry_in_seconds"] == 37
+
+
+def test_server_errors_open_the_circuit_only_after_a_run_of_them():
+    breakers = gemini_helper.circuit_breakers
+    threshold = gemini_helper.BREAKER_POLICIES["server_error"].failure_threshold
+    now = time.monotonic()
+
+    for _ in range(threshold - 1):
+        _open("gemini-flash-latest", now, ApiError(503, "overloaded"))
+    assert breakers.state("gemini-flash-latest", now) == "closed"
+
+    _open("gemini-flash-latest", now, ApiError(503, "overloaded"))
+    assert breakers.state("gemini-flash-latest", now) == "open"
+
+
+def test_a_success_resets_the_run_of_server_errors():
+    breakers = gemini_helper.circuit_breakers
+    threshold = gemini_helper.BREAKER_POLICIES["server_error"].failure_threshold
     now = time.monotonic()
-    gemini_helper._start_cooldown("gemini-flash-latest", now)
-    later = now + gemini_helper.MODEL_COOLDOWN_SECONDS + 1
 
-    assert gemini_helper._model_is_cooling("gemini-flash-latest", later) is False
-    # The entry is cleaned up rather than accumulating one per model per
-    # refusal for the life of the process.
-    assert "gemini-flash-latest" not in gemini_helper._model_cooldowns
+    for _ in range(threshold - 1):
+        _open("gemini-flash-latest", now, ApiError(500, "internal"))
+    breakers.allow("gemini-flash-latest", now)
+    breakers.settle("gemini-flash-latest", None, now)
+    _open("gemini-flash-latest", now, ApiError(500, "internal"))
 
+    assert breakers.state("gemini-flash-latest", now) == "closed"
 
-def test_429_puts_every_attempted_model_on_cooldown(stub_gemini, stub_knowledge):
+
+def test_429_opens_every_attempted_models_circuit(stub_gemini, stub_knowledge):
     models = stub_gemini(ApiError(429, "quota"), repeat=True)
 
     gemini_helper.get_gemini_response("k", "hi", stub_knowledge)
 
     # The whole chain is tried once...
     assert models.tried == list(gemini_helper.MODELS)
-    # ...and none of it is tried again until it cools off.
+    # ...and none of it is tried again until its circuit lets a probe through.
     now = time.monotonic()
-    assert all(gemini_helper._model_is_cooling(m, now) for m in gemini_helper.MODELS)
+    assert all(gemini_helper.circuit_breakers.state(m, now) == "open" for m in gemini_helper.MODELS)
 
 
 def test_second_request_answers_busy_without_calling_upstream(stub_gemini, stub_knowledge):
@@ -59,33 +154,45 @@ def test_second_request_answers_busy_without_calling_upstream(stub_gemini, stub_
 
     reply = gemini_helper.get_gemini_response("k", "hi again", stub_knowledge)
 
-    # This is what stops the starvation: while the chain is cooling, a request
+    # This is what stops the starvation: while every circuit is open, a request
     # costs no upstream call at all, so requests stop queueing behind refusals.
     assert len(models.tried) == calls_after_first
     assert reply.text == BUSY_MESSAGE
 
 
-def test_404_does_not_put_a_model_on_cooldown(stub_gemini, stub_knowledge):
-    # A retired model is not a busy one: no cooldown brings it back, and
-    # sidelining the chain for a minute over it would be wrong.
+def test_a_model_failing_with_503_stops_costing_a_round_trip(stub_gemini, stub_knowledge):
+    """The case the old 429-only cooldown missed: a model answering 503 on every
+    call was asked again on every request."""
+    threshold = gemini_helper.BREAKER_POLICIES["server_error"].failure_threshold
+    models = stub_gemini(ApiError(503, "overloaded"), repeat=True)
+
+    for _ in range(threshold + 2):
+        gemini_helper.get_gemini_response("k", "hi", stub_knowledge)
+
+    assert models.tried.count("gemini-flash-latest") == threshold
+
+
+def test_404_does_not_open_a_circuit(stub_gemini, stub_knowledge):
+    # A retired model is not a busy one: no amount of waiting brings it back,
+    # and sidelining the chain over it would be wrong.
     models = stub_gemini(ApiError(404, "not found"), repeat=True)
 
     gemini_helper.get_gemini_response("k", "hi", stub_knowledge)
 
     assert models.tried == list(gemini_helper.MODELS), "404 still advances the chain"
     now = time.monotonic()
-    assert not any(gemini_helper._model_is_cooling(m, now) for m in gemini_helper.MODELS)
+    assert all(gemini_helper.circuit_breakers.state(m, now) == "closed" for m in gemini_helper.MODELS)
 
 
-def test_cooldowns_do_not_leak_into_the_next_test():
+def test_circuits_do_not_leak_into_the_next_test():
     # Guards the autouse reset in conftest.py rather than any behaviour of its
-    # own: the 429 tests above put every model on cooldown, so deleting that
+    # own: the 429 tests above open every model's circuit, so deleting that
     # fixture makes this assertion fail. With the fixture in place it passes by
     # construction, which is the point - the cost of keeping it is one cheap
     # assertion, and what it catches is a whole file inheriting a chain where
     # nothing is callable and answering BUSY_MESSAGE for reasons of its own
     # file's making.
-    assert gemini_helper._model_cooldowns == {}
+    assert gemini_helper.circuit_breakers._circuits == {}
 
 
 def test_a_slow_chain_stops_at_the_deadline_rather_than_multiplying_the_wait(
@@ -119,3 +226,324 @@ def test_the_per_call_timeout_leaves_room_for_a_real_answer():
     # spend it entirely.
     assert gemini_helper.REQUEST_TIMEOUT_MS >= 40_000
     assert gemini_helper.TOTAL_DEADLINE_SECONDS * 1000 > gemini_helper.REQUEST_TIMEOUT_MS
+
+
+def test_each_call_gets_only_what_is_left_of_the_deadline(stub_gemini, stub_knowledge):
+    """A call started with 10s left gets 10s, not the whole per-call cap, so the
+    last model in the chain cannot run the visitor past their ceiling."""
+    models = stub_gemini(_answered, repeat=True)
+    deadline = gemini_helper.Deadline.start(10)
+
+    answer = asyncio.run(
+        gemini_helper.get_gemini_response_async("k", "hi", stub_knowledge, deadline=deadline)
+    )
+
+    timeout_ms = models.configs[0].http_options.timeout
+    assert 9_000 < timeout_ms <= 10_000
+    assert 9_000 < answer.deadline_remaining_ms <= 10_000
+
+
+def test_a_call_with_time_to_spare_is_capped_at_the_per_call_timeout():
+    deadline = gemini_helper.Deadline.start(1_000)
+
+    assert deadline.call_timeout_ms() == gemini_helper.REQUEST_TIMEOUT_MS
+
+
+def test_time_spent_before_the_call_comes_out_of_the_same_budget(monkeypatch):
+    base = time.monotonic()
+    monkeypatch.setattr(gemini_helper.time, "monotonic", lambda: base)
+    deadline = gemini_helper.Deadline.start(70)
+
+    # Selection and prompt assembly took a minute, somehow.
+    monkeypatch.setattr(gemini_helper.time, "monotonic", lambda: base + 60)
+
+    assert deadline.call_timeout_ms() == 10_000
+    assert deadline.elapsed() == 60
+
+
+def _answered(text="an answer"):
+    return type("Response", (), {"text": text, "candidates": [], "usage_metadata": None})()
+
+
+def test_the_deadline_cancels_a_call_in_flight(monkeypatch, stub_gemini, stub_knowledge):
+    """A call that starts inside the deadline must not be allowed to run past it.
+
+    Checking the clock only between attempts lets the last attempt overrun the
+    visitor's ceiling by up to a whole per-call timeout.
+    """
+    monkeypatch.setattr(gemini_helper, "TOTAL_DEADLINE_SECONDS", 0.05)
+    cancelled = []
+
+    async def hang():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    models = stub_gemini(hang, repeat=True)
+
+    started = time.monotonic()
+    answer = asyncio.run(
+        gemini_helper.get_gemini_response_async("k", "hi", stub_knowledge)
+    )
+
+    assert time.monotonic() - started < 1
+    assert cancelled == [True], "the upstream call is cancelled, not abandoned"
+    assert models.tried == [gemini_helper.MODELS[0]]
+    assert answer.from_model is False
+
+
+def test_a_model_the_deadline_cuts_off_is_counted_as_timing_out(
+    monkeypatch, stub_gemini, stub_knowledge
+):
+    """A hang is the failure these exist for: it must demote the model and,
+    repeated, open its circuit, not leave it first in line."""
+    monkeypatch.setattr(gemini_helper, "TOTAL_DEADLINE_SECONDS", 0.05)
+    first = gemini_helper.MODELS[0]
+    gemini_helper.model_ranking.record_success(first, 10)
+    stub_gemini(_hanging([]), repeat=True)
+
+    asyncio.run(gemini_helper.get_gemini_response_async("k", "hi", stub_knowledge))
+
+    record = gemini_helper.model_ranking.stats()["models"][first]
+    assert record["success_rate"] < 1
+    assert record["latency_ewma_ms"] > 10, "the wait counts as latency"
+    assert gemini_helper.model_ranking.stats()["order"][0] != first
+
+    # Kept first regardless, to see the circuit open on the next hang.
+    monkeypatch.setattr(gemini_helper.model_ranking, "order", lambda: gemini_helper.MODELS)
+    for _ in range(gemini_helper.BREAKER_POLICIES["timeout"].failure_threshold - 1):
+        asyncio.run(gemini_helper.get_gemini_response_async("k", "hi", stub_knowledge))
+
+    assert gemini_helper.circuit_breakers.state(first) == "open"
+    assert gemini_helper.circuit_breakers.snapshot()[first]["last_failure"] == "timeout"
+
+
+def test_a_per_call_timeout_moves_on_to_the_next_model(stub_gemini, stub_knowledge):
+    models = stub_gemini(httpx.ReadTimeout("timed out"), _answered())
+
+    answer = asyncio.run(gemini_helper.get_gemini_response_async("k", "hi", stub_knowledge))
+
+    assert models.tried == list(gemini_helper.MODELS[:2])
+    assert answer.model == gemini_helper.MODELS[1]
+    assert gemini_helper.model_ranking.stats()["models"][gemini_helper.MODELS[0]]["success_rate"] < 1
+
+
+def test_an_answer_in_flight_does_not_hold_the_event_loop(stub_gemini, stub_knowledge):
+    """Other work on the instance keeps running while Gemini thinks.
+
+    The app is a single process per instance, so a blocking upstream call would
+    stall /health and every other request for the length of an answer.
+    """
+    ticks = []
+
+    async def slow_answer():
+        await asyncio.sleep(0.05)
+        return _answered()
+
+    stub_gemini(slow_answer, repeat=True)
+
+    async def ticker():
+        for _ in range(3):
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.005)
+
+    async def answer_then_note_when():
+        answer = await gemini_helper.get_gemini_response_async("k", "hi", stub_knowledge)
+        return answer, time.monotonic()
+
+    async def both():
+        return await asyncio.gather(answer_then_note_when(), ticker())
+
+    (answer, answered_at), _ = asyncio.run(both())
+
+    assert answer.text == "an answer"
+    assert len(ticks) == 3
+    assert ticks[-1] < answered_at, "the loop ran other work while the call was in flight"
+
+
+def test_requests_share_one_pooled_client(stub_gemini, stub_knowledge):
+    """A client per request meant a TLS handshake in front of every answer."""
+    stub_gemini(_answered, repeat=True)
+
+    async def two_requests():
+        await gemini_helper.get_gemini_response_async("k", "hi", stub_knowledge)
+        await gemini_helper.get_gemini_response_async("k", "again", stub_knowledge)
+
+    asyncio.run(two_requests())
+
+    stats = gemini_helper.client_pool.stats()
+    assert stats["clients"] == 1
+    assert stats["created"] == 1
+    assert stats["reused"] == 1
+
+
+def test_closing_the_pool_releases_its_clients(stub_gemini):
+    stub_gemini(_answered, repeat=True)
+    gemini_helper.client_pool.get("k")
+
+    asyncio.run(gemini_helper.client_pool.aclose())
+
+    stats = gemini_helper.client_pool.stats()
+    assert stats["clients"] == 0
+    assert stats["closed"] >= 1
+
+
+# --- hedging ------------------------------------------------------------------
+#
+# A model that hangs without erroring is indistinguishable from a slow answer
+# until the per-call timeout ends it. Hedging races the next model once the
+# first is slower than it usually is, at the price of a second upstream call.
+
+
+def _observed(model_id, latency_ms, count=gemini_helper.HEDGE_MIN_SAMPLES):
+    for _ in range(count):
+        gemini_helper._record_latency(model_id, latency_ms)
+
+
+def _hanging(cancelled):
+    async def hang():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    return hang
+
+
+def test_a_hedge_races_the_next_model_once_the_first_is_unusually_slow(
+    stub_gemini, stub_knowledge
+):
+    _observed(gemini_helper.MODELS[0], 10)
+    cancelled = []
+    models = stub_gemini(_hanging(cancelled), _answered)
+
+    answer = asyncio.run(
+        gemini_helper.get_gemini_response_async("k", "hi", stub_knowledge, hedge=True)
+    )
+
+    assert models.tried == list(gemini_helper.MODELS[:2])
+    assert answer.model == gemini_helper.MODELS[1], "the model that answered first wins"
+    assert answer.hedged is True
+    assert cancelled == [True], "the loser is cancelled, not left running"
+
+
+def test_the_loser_of_a_hedge_is_charged_the_time_it_took(stub_gemini, stub_knowledge):
+    first = gemini_helper.MODELS[0]
+    gemini_helper.model_ranking.record_success(first, 1)
+    _observed(first, 10)
+    stub_gemini(_hanging([]), _answered)
+
+    asyncio.run(gemini_helper.get_gemini_response_async("k", "hi", stub_knowledge, hedge=True))
+
+    record = gemini_helper.model_ranking.stats()["models"][first]
+    assert record["latency_ewma_ms"] > 1
+    assert record["success_rate"] == 1, "abandoned, not failed"
+    # Sent, so counted against the day, even though it never answered.
+    assert quota_ledger.quota_ledger.stats()["models"][first]["requests"] == 1
+
+
+def test_no_hedge_without_enough_observed_latencies(monkeypatch, stub_gemini, stub_knowledge):
+    """A percentile of a couple of samples is guesswork, and a hedge costs quota."""
+    monkeypatch.setattr(gemini_helper, "TOTAL_DEADLINE_SECONDS", 0.1)
+    _observed(gemini_helper.MODELS[0], 10, count=gemini_helper.HEDGE_MIN_SAMPLES - 1)
+    models = stub_gemini(_hanging([]), _answered)
+
+    answer = asyncio.run(
+        gemini_helper.get_gemini_response_async("k", "hi", stub_knowledge, hedge=True)
+    )
+
+    assert models.tried == [gemini_helper.MODELS[0]]
+    assert answer.from_model is False
+
+
+def test_hedging_is_off_unless_asked_for(monkeypatch, stub_gemini, stub_knowledge):
+    monkeypatch.setattr(gemini_helper, "HEDGING_ENABLED", False)
+    monkeypatch.setattr(gemini_helper, "TOTAL_DEADLINE_SECONDS", 0.1)
+    _observed(gemini_helper.MODELS[0], 10)
+    models = stub_gemini(_hanging([]), _answered)
+
+    asyncio.run(gemini_helper.get_gemini_response_async("k", "hi", stub_knowledge))
+
+    assert models.tried == [gemini_helper.MODELS[0]]
+
+
+def test_an_unhedged_answer_says_so(stub_gemini, stub_knowledge):
+    stub_gemini(_answered, repeat=True)
+
+    answer = asyncio.run(
+        gemini_helper.get_gemini_response_async("k", "hi", stub_knowledge, hedge=True)
+    )
+
+    assert answer.hedged is False
+    assert answer.model == gemini_helper.MODELS[0]
+
+
+def test_the_hedge_delay_is_a_percentile_of_observed_latencies(monkeypatch):
+    monkeypatch.setattr(gemini_helper, "HEDGE_PERCENTILE", 0.9)
+    for latency_ms in range(100, 1100, 100):
+        gemini_helper._record_latency("m", latency_ms)
+
+    assert gemini_helper._hedge_delay("m") == 0.9
+    assert gemini_helper._hedge_delay("never-seen") is None
+
+
+# --- learned model order ------------------------------------------------------
+
+
+def test_with_no_history_models_are_tried_in_preference_order():
+    assert gemini_helper.model_ranking.order() == gemini_helper.MODELS
+
+
+def test_a_faster_more_reliable_model_moves_ahead():
+    ranking = gemini_helper.model_ranking
+    first, second, _ = gemini_helper.MODELS
+    for _ in range(5):
+        ranking.record_success(first, 16_000)
+        ranking.record_success(second, 4_000)
+
+    assert ranking.order()[0] == second
+    assert ranking.stats()["order"][0] == second
+
+
+def test_a_small_latency_edge_does_not_override_the_preference():
+    ranking = gemini_helper.model_ranking
+    first, second, _ = gemini_helper.MODELS
+    ranking.record_success(first, 10_000)
+    ranking.record_success(second, 9_500)
+
+    assert ranking.order()[0] == first
+
+
+def test_a_failing_model_is_demoted_for_later_requests(stub_gemini, stub_knowledge):
+    # 404 opens no circuit, so this is the ranking alone at work.
+    first, second, _ = gemini_helper.MODELS
+    stub_gemini(ApiError(404, "not found"), _answered)
+
+    gemini_helper.get_gemini_response("k", "hi", stub_knowledge)
+    models = stub_gemini(_answered, repeat=True)
+    answer = gemini_helper.get_gemini_response("k", "hi", stub_knowledge)
+
+    assert models.tried == [second]
+    assert answer.model == second
+    assert gemini_helper.model_ranking.stats()["models"][first]["success_rate"] < 1
+
+
+def test_exploration_sometimes_leads_with_a_demoted_model(monkeypatch):
+    """Without it a demoted model is never tried first, so nothing would ever
+    show that it recovered."""
+    ranking = gemini_helper.model_ranking
+    first, second, _ = gemini_helper.MODELS
+    for _ in range(5):
+        ranking.record_failure(first)
+        ranking.record_success(second, 4_000)
+    monkeypatch.setattr(ranking, "exploration_rate", 0.05)
+
+    monkeypatch.setattr(gemini_helper.random, "random", lambda: 1.0)
+    assert ranking.order()[0] == second
+
+    monkeypatch.setattr(gemini_helper.random, "random", lambda: 0.0)
+    monkeypatch.setattr(gemini_helper.random, "choice", lambda options: options[-1])
+    assert ranking.order()[0] == first
@@ -205,11 +205,11 @@ def test_every_document_is_reachable_by_some_question():
     knowledge = context.get_knowledge()
     reachable = set()
     for question, _ in ROUTING:
-        reachable.update(selection.select(question, knowledge).knowledge.sources)
+        reachable.update(selection.select(question, knowledge).knowledge.documents)
 
     unreachable = [
         label
-        for label in knowledge.sources
+        for label in knowledge.documents
         if label not in reachable and not label.startswith("Profile / ")
     ]
 
@@ -261,6 +261,42 @@ def test_available_reports_the_whole_corpus_even_when_narrowed():
     assert len(chosen.knowledge.sections) < chosen.available
 
 
+LONG_POST = (
+    "# Queues\n\n" + "Why I stopped polling and what replaced it. " * 8
+    + "\n\n## Retries\n\n" + "Exponential backoff with jitter, capped at a minute. " * 8
+    + "\n\n## Billing\n\n" + "Invoices reconcile nightly against the ledger export. " * 8
+)
+
+
+def test_a_question_about_one_passage_sends_that_passage_and_its_lead():
+    corpus = Knowledge(
+        sections=context.chunk("Profile / about-me", "I build AI products end to end.")
+        + context.chunk("Writing / Queues", LONG_POST)
+        + context.chunk("Writing / Cursor tokens", "Cursor burned 22.7 million tokens.")
+    )
+
+    chosen = selection.select("How do you handle backoff and jitter?", corpus)
+
+    assert chosen.outcome == selection.NARROWED
+    assert chosen.knowledge.sources == (
+        "Profile / about-me",
+        "Writing / Queues",
+        "Writing / Queues § Retries",
+    )
+    assert chosen.available == 3, "available counts documents, not passages"
+    assert dict(chosen.knowledge.source_counts) == {"note": 1, "post": 1}
+
+
+def test_every_profile_passage_is_kept_when_narrowing():
+    profile = context.chunk("Profile / resume", LONG_POST.replace("# Queues", "# Resume"))
+    corpus = Knowledge(sections=profile + context.chunk("Writing / Queues", LONG_POST))
+
+    chosen = selection.select("Tell me about invoices", corpus)
+
+    assert len(profile) > 1
+    assert all(section in chosen.knowledge.sections for section in profile)
+
+
 def test_narrowing_reduces_what_the_request_pays_for():
     corpus = _corpus(*SAMPLE)
     chosen = selection.select("What did you say about Cursor tokens?", corpus)
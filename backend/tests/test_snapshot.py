@@ -0,0 +1,95 @@
+"""The build-time corpus snapshot: used when it matches the docs, parsed over when not.
+
+A snapshot that could be served after the files under it changed would be a
+second corpus quietly disagreeing with the first, so staleness is what these pin.
+"""
+
+import json
+
+import pytest
+
+import context
+import docs_helper
+import selection
+import snapshot
+
+
+@pytest.fixture
+def cold(fresh_corpus_cache):
+    """An instance as it starts: nothing parsed, nothing indexed, nothing listed."""
+    selection._reset_cache()
+    docs_helper._listings.clear()
+    yield
+    selection._reset_cache()
+    docs_helper._listings.clear()
+
+
+@pytest.fixture
+def compiled(tmp_path, cold):
+    path = tmp_path / "corpus_snapshot.json"
+    snapshot.write(str(path))
+    context._parsed = {}
+    context.corpus_holder.clear()
+    return path
+
+
+def test_a_matching_snapshot_is_loaded_without_reading_a_document(compiled, caplog, monkeypatch):
+    live = context._build()
+    context._parsed = {}
+    monkeypatch.setattr(context, "_read", lambda path: pytest.fail(f"{path} was read"))
+    monkeypatch.setattr(context, "read_markdown_file", lambda path: pytest.fail(f"{path} was read"))
+
+    with caplog.at_level("INFO"):
+        assert snapshot.load(str(compiled))
+        assert context.get_knowledge() == live
+
+    assert "read 0 files" in caplog.text
+    seeded = selection._index_cache[1]
+    assert context.corpus_holder.current.derived(selection.INDEX) is seeded
+    assert seeded == selection._build_index(live)
+
+
+def test_a_snapshot_older_than_a_file_parses_that_file_live(compiled, caplog):
+    data = json.loads(compiled.read_text(encoding="utf-8"))
+    # As if the first document had been edited after the image was built.
+    stale = data["files"][0]
+    stale["sections"][0][1] = "an older draft"
+    stale["key"][2] -= 1
+    data["fingerprint"] = [key for key in data["fingerprint"] if key[0] != stale["key"][0]] + [stale["key"]]
+    compiled.write_text(json.dumps(data), encoding="utf-8")
+
+    with caplog.at_level("INFO"):
+        assert not snapshot.load(str(compiled))
+        knowledge = context.get_knowledge()
+
+    assert "read 1 files" in caplog.text
+    assert "an older draft" not in knowledge.text
+    assert selection._index_cache is None, "a stale index is not primed"
+
+
+def test_a_snapshot_from_another_format_is_ignored(compiled):
+    data = json.loads(compiled.read_text(encoding="utf-8"))
+    data["version"] = snapshot.SNAPSHOT_VERSION + 1
+    compiled.write_text(json.dumps(data), encoding="utf-8")
+
+    assert not snapshot.load(str(compiled))
+    assert context._parsed == {}
+
+
+def test_loading_builds_nothing_until_the_corpus_is_asked_for(compiled):
+    assert snapshot.load(str(compiled))
+    assert context.corpus_holder.current is None
+
+    context.get_knowledge()
+
+    assert context.corpus_holder.current is not None
+
+
+def test_listings_primed_from_a_snapshot_are_copies(compiled):
+    snapshot.load(str(compiled))
+
+    projects = docs_helper.get_all_projects()
+    projects[0].pop("content")
+
+    assert "content" in docs_helper.get_all_projects()[0]
+    assert docs_helper.get_all_writing() == docs_helper.parse_all_writing()
@@ -0,0 +1,254 @@
+"""The streamed chat: what arrives while the model writes, and what ends it.
+
+The property worth pinning is that the final event is the authority. Deltas are
+relayed as they arrive, which means a truncated answer or a failure part-way
+through has already been partly shown by the time anyone knows - so the `done`
+event has to carry the reply the visitor should be left with, built by the same
+rules as the non-streamed route.
+
+No network: the Gemini client is stubbed and the app is driven through
+Starlette's test client.
+"""
+
+import asyncio
+import json
+from contextlib import aclosing
+
+import pytest
+from starlette.testclient import TestClient
+
+import context
+import gemini_helper
+import main
+from conftest import ApiError
+from gemini_helper import (
+    BUSY_MESSAGE,
+    GENERIC_ERROR_MESSAGE,
+    TRUNCATED_RESPONSE_MESSAGE,
+    Answer,
+    stream_gemini_response,
+)
+
+
+def _chunk(text, finish=None, usage=None):
+    candidates = []
+    if finish:
+        reason = type("FinishReason", (), {"name": finish})()
+        candidates = [type("Candidate", (), {"finish_reason": reason})()]
+    return type(
+        "Chunk", (), {"text": text, "candidates": candidates, "usage_metadata": usage}
+    )()
+
+
+def _usage(prompt=900, thinking=40, output=12):
+    return type(
+        "Usage",
+        (),
+        {
+            "prompt_token_count": prompt,
+            "thoughts_token_count": thinking,
+            "candidates_token_count": output,
+            "total_token_count": prompt + thinking + output,
+        },
+    )()
+
+
+def _drain(**kwargs):
+    async def collect():
+        return [
+            item
+            async for item in stream_gemini_response(
+                "k", "hi", context.get_knowledge(), **kwargs
+            )
+        ]
+
+    return asyncio.run(collect())
+
+
+def _events(body: str):
+    """(event, payload) pairs from a text/event-stream body."""
+    parsed = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        parsed.append((lines["event"], json.loads(lines["data"])))
+    return parsed
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main, "ORIGIN_SHARED_SECRET", "")
+    monkeypatch.setattr(main, "GEMINI_API_KEY", "k")
+    monkeypatch.setattr(main, "enforce_rate_limit", lambda *a, **k: None)
+    return TestClient(main.app)
+
+
+def test_deltas_arrive_in_order_and_the_answer_comes_last(stub_gemini):
+    stub_gemini([_chunk("I build "), _chunk("web apps."), _chunk("", "STOP", _usage())])
+
+    items = _drain()
+
+    assert items[:2] == ["I build ", "web apps."]
+    answer = items[-1]
+    assert isinstance(answer, Answer)
+    assert answer.text == "I build web apps."
+    assert answer.prompt_tokens == 900
+    assert answer.finish_reason == "STOP"
+    assert answer.first_token_ms is not None
+    assert answer.first_token_ms <= answer.latency_ms
+
+
+def test_a_max_tokens_finish_mid_stream_ends_in_the_truncation_message(stub_gemini):
+    """The fragment has already been relayed; the final answer must not endorse it."""
+    stub_gemini([_chunk("I started at"), _chunk(" a", "MAX_TOKENS", _usage())])
+
+    answer = _drain()[-1]
+
+    assert answer.text == TRUNCATED_RESPONSE_MESSAGE
+    assert answer.finish_reason == "MAX_TOKENS"
+
+
+def test_a_refusal_before_the_first_delta_falls_back_to_the_next_model(stub_gemini):
+    models = stub_gemini(ApiError(429), [_chunk("fine", "STOP")])
+
+    items = _drain()
+
+    assert models.tried == list(gemini_helper.MODELS[:2])
+    assert items[-1].model == gemini_helper.MODELS[1]
+
+
+def test_a_failure_after_the_first_delta_does_not_splice_in_another_model(stub_gemini):
+    models = stub_gemini([_chunk("I started"), ApiError(500)], [_chunk("other", "STOP")])
+
+    items = _drain()
+
+    assert models.tried == [gemini_helper.MODELS[0]]
+    assert items[-1].text == GENERIC_ERROR_MESSAGE
+    assert items[-1].from_model is False
+
+
+def test_a_chain_with_every_circuit_open_streams_only_the_busy_answer(stub_gemini):
+    stub_gemini(ApiError(429), repeat=True)
+
+    items = _drain()
+
+    assert len(items) == 1
+    assert items[0].text == BUSY_MESSAGE
+
+
+class _StalledUpstream:
+    """An upstream stream that sends one delta and then goes quiet.
+
+    Records whether it was closed, and is checked before the event loop shuts
+    down - the loop closes any generator still open on its way out, which would
+    hide a stream this code abandoned.
+    """
+
+    def __init__(self):
+        self.closed = False
+
+    async def chunks(self):
+        try:
+            yield _chunk("I started")
+            await asyncio.sleep(60)
+            yield _chunk(" late", "STOP")
+        finally:
+            self.closed = True
+
+    def install(self, stub_gemini):
+        stub_gemini(_chunk("unused"))
+        client = gemini_helper.genai.Client()
+
+        async def generate_content_stream(model, contents, config):
+            return self.chunks()
+
+        client.aio.models.generate_content_stream = generate_content_stream
+
+
+def test_a_consumer_cancelled_mid_stream_closes_the_upstream_stream(stub_gemini):
+    """The visitor going away while a delta is relayed must not strand the connection."""
+    upstream = _StalledUpstream()
+    upstream.install(stub_gemini)
+
+    async def scenario():
+        relayed = asyncio.Event()
+
+        async def consume():
+            async with aclosing(
+                stream_gemini_response("k", "hi", context.get_knowledge())
+            ) as items:
+                async for _ in items:
+                    relayed.set()
+                    await asyncio.sleep(60)
+
+        consumer = asyncio.create_task(consume())
+        await relayed.wait()
+        consumer.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await consumer
+        return upstream.closed
+
+    assert asyncio.run(scenario()) is True
+
+
+def test_a_deadline_expiring_mid_stream_closes_the_upstream_stream(stub_gemini):
+    upstream = _StalledUpstream()
+    upstream.install(stub_gemini)
+
+    async def scenario():
+        items = [
+            item
+            async for item in stream_gemini_response(
+                "k", "hi", context.get_knowledge(), deadline=gemini_helper.Deadline.start(0.2)
+            )
+        ]
+        return items, upstream.closed
+
+    items, closed = asyncio.run(scenario())
+
+    assert items[0] == "I started"
+    assert isinstance(items[-1], Answer)
+    assert items[-1].from_model is False
+    assert closed is True
+
+
+def test_the_endpoint_relays_deltas_then_one_done_event_with_the_trace(client, stub_gemini):
+    stub_gemini([_chunk("Hello "), _chunk("there.", "STOP", _usage())])
+
+    response = client.post("/chat-with-files/stream", json={"message": "what do you build?"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = _events(response.text)
+    assert [name for name, _ in events] == ["delta", "delta", "done"]
+    done = events[-1][1]
+    assert done["response"] == "Hello there."
+    assert done["trace"]["latency_ms"] is not None
+    assert done["trace"]["first_token_ms"] is not None
+    assert done["trace"]["prompt_tokens"] == 900
+
+
+def test_the_contact_flow_answers_in_a_single_event_without_calling_gemini(
+    client, monkeypatch
+):
+    def explode(**kwargs):
+        raise AssertionError("the contact flow must not reach Gemini")
+
+    monkeypatch.setattr(gemini_helper.genai, "Client", explode)
+
+    response = client.post("/chat-with-files/stream", json={"message": "how can I get in touch?"})
+
+    events = _events(response.text)
+    assert [name for name, _ in events] == ["done"]
+    assert events[0][1]["is_email_collection"] is True
+    assert events[0][1]["trace"] is None
+
+
+def test_the_whole_reply_route_reports_no_first_token(client, stub_gemini):
+    """Only a stream has a first token to time; the other route says so with None."""
+    stub_gemini(_chunk("An answer.", "STOP", _usage()), repeat=True)
+
+    response = client.post("/chat-with-files", json={"message": "what do you build?"})
+
+    trace = response.json()["trace"]
+    assert trace["latency_ms"] is not None
+    assert trace["first_token_ms"] is None
@@ -0,0 +1,84 @@
+"""Startup warmup, and the readiness endpoint that reports it.
+
+What is pinned is the point of warming at all: by the time an instance says it
+is ready, the first chat has nothing left to build. The app is started the way
+uvicorn starts it, through its lifespan, by entering the test client.
+"""
+
+import asyncio
+import time
+
+import pytest
+from starlette.testclient import TestClient
+
+import context
+import main
+import selection
+from gemini_helper import client_pool
+
+
+@pytest.fixture
+def cold(fresh_corpus_cache, monkeypatch):
+    """A process that has imported the app and nothing more."""
+    monkeypatch.setattr(main, "GEMINI_API_KEY", "test-key")
+    selection._reset_cache()
+    main.warmup.clear()
+    yield
+    selection._reset_cache()
+    main.warmup.clear()
+
+
+def test_not_ready_before_startup_has_run(cold):
+    assert TestClient(main.app).get("/ready").status_code == 503
+
+
+def test_ready_once_the_corpus_index_and_client_are_built(cold):
+    with TestClient(main.app) as client:
+        assert client.get("/ready").json() == {"ready": True}
+
+        corpus = context.corpus_holder.current
+        assert corpus is not None
+        assert selection.INDEX in corpus._derived
+        assert client_pool.stats()["clients"] == 1
+        assert set(main.warmup.timings_ms) == {"snapshot", "corpus", "index", "instruction", "client"}
+
+
+def test_a_failing_step_is_left_to_the_first_request(cold, monkeypatch):
+    def broken(knowledge):
+        raise RuntimeError("index")
+
+    monkeypatch.setattr(main, "warm_index", broken)
+
+    with TestClient(main.app) as client:
+        assert client.get("/ready").status_code == 200
+
+
+def test_readiness_waits_for_an_enabled_prewarm(cold, monkeypatch):
+    async def slow(client):
+        await asyncio.sleep(0.3)
+
+    monkeypatch.setattr(main, "PREWARM_ENABLED", True)
+    monkeypatch.setattr(main, "prewarm", slow)
+
+    with TestClient(main.app) as client:
+        assert client.get("/health").status_code == 200
+        assert client.get("/ready").status_code == 503
+
+        deadline = time.monotonic() + 5
+        while client.get("/ready").status_code != 200:
+            assert time.monotonic() < deadline, "prewarm never finished"
+            time.sleep(0.05)
+
+
+def test_a_failed_prewarm_does_not_hold_the_instance_out_of_service(cold, monkeypatch):
+    async def unreachable(client):
+        raise OSError("no route")
+
+    monkeypatch.setattr(main, "PREWARM_ENABLED", True)
+    monkeypatch.setattr(main, "prewarm", unreachable)
+
+    with TestClient(main.app) as client:
+        deadline = time.monotonic() + 5
+        while client.get("/ready").status_code != 200:
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
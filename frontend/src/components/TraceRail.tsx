@@ -99,11 +99,18 @@ export const TraceRail: React.FC<TraceRailProps> = ({ trace }) => {
     // for this question and is worth stating precisely; an unfocused one means
     // nothing in the question distinguished one document from another, so the
     // honest report is that everything went, not a count dressed as a choice.
+    //
+    // A set the token budget cut down is neither: it is stated as the counts
+    // that were actually sent, and says it was trimmed, so "all 10" never
+    // appears above a prompt that carried fewer.
+    const trimmed = present(trace.context_trimmed) && trace.context_trimmed > 0;
     const context = !counts.length
         ? null
-        : trace.context_outcome === 'unfocused'
-          ? `all ${present(trace.context_available) ? trace.context_available : counts.length} of my documents in context`
-          : `${listed} in context`;
+        : trimmed
+          ? `${listed} in context, trimmed to fit`
+          : trace.context_outcome === 'unfocused'
+            ? `all ${present(trace.context_available) ? trace.context_available : counts.length} of my documents in context`
+            : `${listed} in context`;
 
     // Nothing measured, nothing to say. An empty rule under an answer would
     // read as a failed render rather than as an absence.
@@ -42,11 +42,25 @@ export interface ContextCount {
 export interface AnswerTrace {
     model?: string | null;
     prompt_tokens?: number | null;
+    /** The part of prompt_tokens read from a cached prefix, as the API measured it. */
+    cached_tokens?: number | null;
     thinking_tokens?: number | null;
     output_tokens?: number | null;
     total_tokens?: number | null;
     finish_reason?: string | null;
     latency_ms?: number | null;
+    /** Only a streamed answer has one; a whole-reply answer reports null. */
+    first_token_ms?: number | null;
+    /** A second model was raced against a slow first one; `model` won. */
+    hedged?: boolean | null;
+    /** Replayed from the answer cache: the counts describe the original call. */
+    from_cache?: boolean | null;
+    /** Shared another visitor's identical in-flight call rather than making one. */
+    coalesced?: boolean | null;
+    /** What was left of the request's deadline when the answer arrived. */
+    deadline_remaining_ms?: number | null;
+    /** The generation profile the answer ran under, chosen from context_outcome. */
+    profile?: string | null;
     context?: ContextCount[] | null;
     /*
      * How that set was arrived at. 'narrowed' means the question selected these
@@ -58,6 +72,12 @@ export interface AnswerTrace {
     context_outcome?: 'narrowed' | 'conversational' | 'unfocused' | 'no_corpus' | null;
     /** The whole corpus, so a narrowed set can be reported as a share of it. */
     context_available?: number | null;
+    /**
+     * Passages chosen for the question but dropped to fit the prompt's token
+     * budget. `context` counts only what was sent, so an unfocused set with
+     * any trimmed is no longer "all" of anything.
+     */
+    context_trimmed?: number | null;
 }
 
 export interface ChatMessage {